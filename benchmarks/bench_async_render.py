@@ -0,0 +1,85 @@
+"""
+Benchmark: training step time with feature map monitoring off, synchronous and asynchronous.
+
+Usage::
+
+    python benchmarks/bench_async_render.py --steps 50
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+# The benchmark runs from a checkout, without installing the package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch  # noqa: E402
+import torch.nn as nn  # noqa: E402
+import torch.nn.functional as F  # noqa: E402
+
+from laymon import FeatureMapMonitoring  # noqa: E402
+
+
+class Net(nn.Module):
+    def __init__(self):
+        super(Net, self).__init__()
+        self.conv1 = nn.Conv2d(3, 6, 5)
+        self.pool = nn.MaxPool2d(2, 2)
+        self.conv2 = nn.Conv2d(6, 16, 5)
+        self.fc1 = nn.Linear(16 * 5 * 5, 10)
+
+    def forward(self, x):
+        x = self.pool(F.relu(self.conv1(x)))
+        x = self.pool(F.relu(self.conv2(x)))
+        return self.fc1(x.view(-1, 16 * 5 * 5))
+
+
+def run(mode, steps, batch_size):
+    torch.manual_seed(0)
+    net = Net()
+    optimizer = torch.optim.SGD(net.parameters(), lr=0.001)
+    criterion = nn.CrossEntropyLoss()
+    inputs, labels = torch.randn(batch_size, 3, 32, 32), torch.randint(0, 10, (batch_size,))
+
+    monitoring = None
+    if mode != "off":
+        monitoring = FeatureMapMonitoring(async_render=(mode == "async"))
+        monitoring.add_model(net)
+
+    timings = []
+    for _ in range(steps):
+        begin = time.perf_counter()
+        optimizer.zero_grad()
+        loss = criterion(net(inputs), labels)
+        if monitoring is not None:
+            monitoring.start()
+        loss.backward()
+        optimizer.step()
+        timings.append(time.perf_counter() - begin)
+
+    dropped = 0
+    if monitoring is not None:
+        if monitoring.renderer is not None:
+            dropped = monitoring.renderer.dropped
+        monitoring.close()
+    timings.sort()
+    return timings[len(timings) // 2], dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=4)
+    args = parser.parse_args()
+
+    for mode in ("off", "sync", "async"):
+        median, dropped = run(mode, args.steps, args.batch_size)
+        print(f"{mode:>5}: median step {median * 1000:8.2f} ms  (dropped snapshots: {dropped})")
+
+
+if __name__ == "__main__":
+    main()
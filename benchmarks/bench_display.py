@@ -0,0 +1,87 @@
+"""
+Benchmark: frames per second and resident memory of `FeatureMapDisplay` over many updates,
+comparing the previous implementation (a new `imshow` and a full `canvas.draw()` on every update)
+with the current one (image artists updated in place and blitted).
+
+Usage::
+
+    python benchmarks/bench_display.py --updates 10000
+"""
+
+import argparse
+import os
+import resource
+import sys
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+# The benchmark runs from a checkout, without installing the package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matplotlib.pyplot as plt  # noqa: E402
+import torch  # noqa: E402
+
+from laymon import FeatureMapDisplay  # noqa: E402
+
+
+class LegacyFeatureMapDisplay(FeatureMapDisplay):
+    """The display as it was before the image artists were reused."""
+
+    def display_params(self, activation, max_subplots=5):
+        num_of_subplots = min(activation.size(0), max_subplots)
+        if self._figure is None:
+            self._figure, subplots = plt.subplots(num_of_subplots, squeeze=False)
+            self._subplots = list(subplots.ravel())
+            self._figure.suptitle(self.title, fontsize=12)
+        for idx in range(num_of_subplots):
+            self._subplots[idx].imshow(activation[idx])
+        self._figure.canvas.draw()
+
+
+def current_rss_mb():
+    """Returns the current resident set size in MB (peak RSS where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def run(display_class, updates, report_every):
+    display = display_class()
+    activations = [torch.randn(1, 5, 28, 28) for _ in range(8)]
+    rss_start = current_rss_mb()
+    begin = last = time.perf_counter()
+    for step in range(1, updates + 1):
+        display.update_display(activations[step % len(activations)], display_title="conv")
+        if step % report_every == 0:
+            now = time.perf_counter()
+            print(
+                f"  {display_class.__name__:>24} step {step:6d}: "
+                f"{report_every / (now - last):8.1f} fps, rss {current_rss_mb():8.1f} MB"
+            )
+            last = now
+    elapsed = time.perf_counter() - begin
+    plt.close("all")
+    return updates / elapsed, current_rss_mb() - rss_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=10000)
+    parser.add_argument("--report-every", type=int, default=1000)
+    parser.add_argument(
+        "--skip-legacy", action="store_true", help="only benchmark the current display"
+    )
+    args = parser.parse_args()
+
+    displays = (LegacyFeatureMapDisplay, FeatureMapDisplay)
+    for display_class in displays[1:] if args.skip_legacy else displays:
+        fps, rss_growth = run(display_class, args.updates, args.report_every)
+        print(f"{display_class.__name__}: {fps:.1f} fps, RSS growth {rss_growth:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Benchmark: overhead of the monitoring on the CPU, across models, numbers of monitored layers and
+display backends. For every configuration it measures:
+    * the forward pass time without monitoring and with the hooks registered
+    * the latency of `start()`
+    * the steps per second of a forward pass followed by `start()`
+    * the peak resident memory of the process, before the monitoring and at the end of the run
+
+Every configuration runs in its own process, so that the peak memory of one doesn't hide the others,
+with a fixed seed and number of threads. The results are written as JSON, to be compared across versions.
+
+Usage::
+
+    python benchmarks/bench_overhead.py --output overhead.json
+    python benchmarks/bench_overhead.py --models mlp --layers 1 1000 --backends stats --steps 50
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import matplotlib
+
+matplotlib.use("Agg")
+# The benchmark runs from a checkout, without installing the package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch  # noqa: E402
+import torch.nn as nn  # noqa: E402
+
+import laymon  # noqa: E402
+from laymon.export import FeatureMapExporter  # noqa: E402
+from laymon.interfaces import Display  # noqa: E402
+from laymon.recording import FeatureMapRecorder  # noqa: E402
+from laymon.transforms import CaptureTransform  # noqa: E402
+
+MODELS = ("cnn", "resnet", "mlp")
+BACKENDS = ("agg", "recorder", "export", "stats")
+
+
+class ResidualBlock(nn.Module):
+    def __init__(self, channels):
+        super(ResidualBlock, self).__init__()
+        self.conv1 = nn.Conv2d(channels, channels, 3, padding=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(channels)
+        self.conv2 = nn.Conv2d(channels, channels, 3, padding=1, bias=False)
+        self.bn2 = nn.BatchNorm2d(channels)
+
+    def forward(self, x):
+        out = torch.relu(self.bn1(self.conv1(x)))
+        return torch.relu(x + self.bn2(self.conv2(out)))
+
+
+def build_model(name, layers, channels=8, width=64):
+    """
+    Builds a model with `layers` layers to monitor (convolutions or linear layers).
+    :return: (model, input batch, list of the (name, layer) pairs to monitor)
+    """
+    if name == "cnn":
+        model = nn.Sequential(
+            nn.Conv2d(3, channels, 3, padding=1),
+            *[nn.Conv2d(channels, channels, 3, padding=1) for _ in range(layers - 1)],
+        )
+        inputs = torch.randn(8, 3, 16, 16)
+    elif name == "resnet":
+        model = nn.Sequential(
+            nn.Conv2d(3, channels, 3, padding=1),
+            *[ResidualBlock(channels) for _ in range(layers // 2)],
+        )
+        inputs = torch.randn(8, 3, 16, 16)
+    elif name == "mlp":
+        model = nn.Sequential(
+            *[nn.Sequential(nn.Linear(width, width), nn.ReLU()) for _ in range(layers)]
+        )
+        inputs = torch.randn(8, width)
+    else:
+        raise ValueError(f"model should be one of {MODELS}.")
+
+    monitored = [
+        (layer_name, layer)
+        for layer_name, layer in model.named_modules()
+        if isinstance(layer, (nn.Conv2d, nn.Linear))
+    ]
+    return model.eval(), inputs, monitored[:layers]
+
+
+class StatsOnlyDisplay(Display):
+    """Keeps the latest statistics of every layer, without logging them."""
+
+    def __init__(self):
+        self.statistics = None
+
+    def update_display(self, parameters, display_title):
+        self.statistics = parameters
+
+
+def create_monitoring(backend, directory):
+    """Creates the monitoring of a display backend."""
+    if backend == "agg":
+        monitoring = laymon.FeatureMapMonitoring(capture_transform=CaptureTransform(sample=0))
+        monitoring.observer_factory.display_object = laymon.FeatureMapDashboard
+    elif backend == "recorder":
+        monitoring = laymon.FeatureMapMonitoring(capture_transform=CaptureTransform(sample=0))
+        monitoring.observer_factory.display_object = FeatureMapRecorder
+        monitoring.observer_factory.display_options = {"path": directory, "dtype": "float16"}
+    elif backend == "export":
+        monitoring = laymon.FeatureMapMonitoring(capture_transform=CaptureTransform(sample=0))
+        monitoring.observer_factory.display_object = FeatureMapExporter
+        monitoring.observer_factory.display_options = {"path": directory}
+    elif backend == "stats":
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory = laymon.FeatureMapStatsObserverFactory()
+        monitoring.observer_factory.display_object = StatsOnlyDisplay
+    else:
+        raise ValueError(f"backend should be one of {BACKENDS}.")
+    return monitoring
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the process in MB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2**20 if sys.platform == "darwin" else maxrss / 2**10
+
+
+def time_forwards(model, inputs, steps):
+    """Returns the time of every forward pass, in seconds."""
+    timings = []
+    with torch.no_grad():
+        for _ in range(steps):
+            begin = time.perf_counter()
+            model(inputs)
+            timings.append(time.perf_counter() - begin)
+    return timings
+
+
+def run_configuration(model_name, layers, backend, steps, warmup):
+    """Benchmarks a single configuration and returns its results."""
+    torch.manual_seed(0)
+    model, inputs, monitored = build_model(model_name, layers)
+    time_forwards(model, inputs, warmup)
+    baseline = time_forwards(model, inputs, steps)
+    baseline_rss = peak_rss_mb()
+
+    with tempfile.TemporaryDirectory() as directory:
+        monitoring = create_monitoring(backend, directory)
+        begin = time.perf_counter()
+        for layer_name, layer in monitored:
+            monitoring.add_layer(layer, layer_name)
+        registration = time.perf_counter() - begin
+
+        with warnings.catch_warnings():
+            # The outputs of the linear layers can't be drawn as images.
+            warnings.simplefilter("ignore")
+            for _ in range(warmup):
+                time_forwards(model, inputs, 1)
+                monitoring.start()
+
+            hooked, starts = ([], [])
+            begin = time.perf_counter()
+            for _ in range(steps):
+                hooked.extend(time_forwards(model, inputs, 1))
+                start = time.perf_counter()
+                monitoring.start()
+                starts.append(time.perf_counter() - start)
+            elapsed = time.perf_counter() - begin
+        monitoring.close()
+
+    forward = statistics.median(baseline)
+    forward_hooked = statistics.median(hooked)
+    return {
+        "model": model_name,
+        "layers": len(monitored),
+        "backend": backend,
+        "registration_ms": registration * 1e3,
+        "forward_ms": forward * 1e3,
+        "forward_hooked_ms": forward_hooked * 1e3,
+        "hook_overhead_ms": (forward_hooked - forward) * 1e3,
+        "hook_overhead_pct": 100.0 * (forward_hooked - forward) / forward,
+        "start_ms": {
+            "median": statistics.median(starts) * 1e3,
+            "mean": statistics.mean(starts) * 1e3,
+            "max": max(starts) * 1e3,
+        },
+        "steps_per_second": steps / elapsed,
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_isolated(model_name, layers, backend, args):
+    """Runs a configuration in a new process, and returns its results."""
+    command = [
+        sys.executable,
+        __file__,
+        "--single",
+        model_name,
+        str(layers),
+        backend,
+        "--steps",
+        str(args.steps),
+        "--warmup",
+        str(args.warmup),
+        "--threads",
+        str(args.threads),
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", nargs="+", choices=MODELS, default=list(MODELS))
+    parser.add_argument("--layers", nargs="+", type=int, default=[1, 10, 100, 1000])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=1, help="number of pyTorch CPU threads")
+    parser.add_argument("--output", default="overhead.json", help="path of the JSON results")
+    parser.add_argument(
+        "--single", nargs=3, metavar=("MODEL", "LAYERS", "BACKEND"), help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    if args.single:
+        model_name, layers, backend = args.single
+        results = run_configuration(model_name, int(layers), backend, args.steps, args.warmup)
+        print(json.dumps(results))
+        return
+
+    results = []
+    for model_name in args.models:
+        for layers in args.layers:
+            for backend in args.backends:
+                result = run_isolated(model_name, layers, backend, args)
+                results.append(result)
+                print(
+                    f"{model_name:>6} {result['layers']:5d} layers {backend:>8}: "
+                    f"hooks +{result['hook_overhead_ms']:7.3f} ms "
+                    f"({result['hook_overhead_pct']:6.1f}%), "
+                    f"start {result['start_ms']['median']:8.2f} ms, "
+                    f"{result['steps_per_second']:7.1f} steps/s, "
+                    f"peak RSS {result['peak_rss_mb']:7.1f} MB"
+                )
+
+    report = {
+        "laymon": laymon.__version__,
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "threads": args.threads,
+        "steps": args.steps,
+        "warmup": args.warmup,
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark: seek latency of `FeatureMapReplay` on a synthetic recording, cold (frame read from the
+memory-mapped segments) versus warm (frame served from the LRU cache).
+
+Usage::
+
+    python benchmarks/bench_replay.py --layers 100 --steps 10000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# The benchmark runs from a checkout, without installing the package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from laymon.recording import _LayerWriter  # noqa: E402
+from laymon.replay import FeatureMapReplay  # noqa: E402
+
+
+def write_recording(path, layers, steps, frame_shape, chunk_size):
+    """Writes a synthetic uint8 recording, segment by segment."""
+    for layer in range(layers):
+        writer = _LayerWriter(path, f"layer{layer:03d}", chunk_size)
+        for begin in range(0, steps, chunk_size):
+            end = min(begin + chunk_size, steps)
+            frames = np.random.randint(0, 255, (end - begin,) + frame_shape, dtype=np.uint8)
+            writer.write(np.arange(begin, end, dtype=np.int64), frames)
+        writer.close()
+
+
+def measure(replay, keys):
+    latencies = []
+    for layer_name, step in keys:
+        begin = time.perf_counter()
+        replay.frame(layer_name, step)
+        latencies.append(time.perf_counter() - begin)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--layers", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=10000)
+    parser.add_argument("--seeks", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        begin = time.perf_counter()
+        write_recording(path, args.layers, args.steps, (1, 4, 8, 8), args.chunk_size)
+        elapsed = time.perf_counter() - begin
+        print(f"wrote {args.layers} layers x {args.steps} steps in {elapsed:.1f} s")
+
+        keys = [
+            (f"layer{random.randrange(args.layers):03d}", random.randrange(args.steps))
+            for _ in range(args.seeks)
+        ]
+        replay = FeatureMapReplay(path, display_object=None, cache_size=args.seeks, prefetch=0)
+        for label in ("cold", "warm"):
+            median, p99 = measure(replay, keys)
+            print(f"{label}: median {median * 1e6:8.1f} us, p99 {p99 * 1e6:8.1f} us")
+        replay.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 """Top-level package for PyLaymon."""
 
 from laymon.monitoring import FeatureMapMonitoring
-from laymon.observers import FeatureMapObserver, FeatureMapDisplay
+from laymon.observers import FeatureMapObserver, FeatureMapDisplay, FeatureMapGridDisplay
+from laymon.observers import FeatureMapDashboard
 from laymon.monitoring import FeatureMapMonitor
-
+from laymon.observers import FeatureMapStatsObserver, FeatureMapStatsObserverFactory
+from laymon.observers import FeatureMapHistogramObserver, FeatureMapHistogramObserverFactory
 
 __author__ = """Shubham Gupta"""
 __email__ = "shubhamgupta3121@gmail.com"
@@ -1,48 +1,356 @@
+import logging
+import math
+
+import numpy as np
 import matplotlib.pyplot as plt
 from .interfaces import Display
+from .profiling import measure
+from .statistics import STATISTICS
+from .transforms import feature_map_image
+
+logger = logging.getLogger(__name__)
 
 
 class FeatureMapDisplay(Display):
     """
     A class for defining methods for displaying the parameters being monitored by a FeatureMapObserver.
+
+    The image artists are created once, on the first update, and updated in place afterwards.
+    Redraws blit the images over a cached background instead of drawing the whole figure again.
+    When the channels of the captures are selected (see `laymon.transforms.ChannelSelector`),
+    every subplot is titled with the index of the channel it shows.
     """
 
+    accepts_channels = True
+
     def __init__(self):
         """
         Initialize the figures and subplots.
         """
         self._figure, self._subplots, self._parameters, self.title = (None, [], None, None)
+        self._images, self._background = ([], None)
+        self._channels, self._labels = (None, None)
+
+    @staticmethod
+    def _to_array(tensor):
+        """Converts a tensor (e.g. a quantized or half precision one) to an array for matplotlib."""
+        return tensor.detach().cpu().float().numpy()
+
+    def _create_figure(self, activation, num_of_subplots):
+        """Creates the figure, the subplots and an image artist per subplot."""
+        self._figure, subplots = plt.subplots(num_of_subplots, squeeze=False)
+        self._subplots = list(subplots.ravel())
+        self._figure.suptitle(self.title, fontsize=12)
+
+        # The images are animated, i.e. they are excluded from the regular draw and are
+        # blitted over the background captured on every full draw of the figure.
+        self._images = [
+            subplot.imshow(self._to_array(activation[idx]), animated=True)
+            for idx, subplot in enumerate(self._subplots)
+        ]
+        self._figure.canvas.mpl_connect("draw_event", self._on_draw)
+        self._figure.show()
+        self._figure.canvas.draw()
+
+    def _on_draw(self, event):
+        """Caches the background of the figure whenever it is fully redrawn (e.g. on resize)."""
+        canvas = self._figure.canvas
+        if canvas.supports_blit:
+            self._background = canvas.copy_from_bbox(self._figure.bbox)
+        self._draw_images()
+
+    def _draw_images(self):
+        for subplot, image in zip(self._subplots, self._images):
+            subplot.draw_artist(image)
+
+    def _redraw(self):
+        """Blits the updated images onto the figure, falling back to a full draw if needed."""
+        canvas = self._figure.canvas
+        if self._background is None:
+            canvas.draw()
+        else:
+            canvas.restore_region(self._background)
+            self._draw_images()
+            canvas.blit(self._figure.bbox)
+        canvas.flush_events()
+
+    def _channel_labels(self, num_of_subplots):
+        """Returns the titles of the subplots, None if the channels weren't selected."""
+        if self._channels is None:
+            return None
+        return [f"channel {channel}" for channel in self._channels[:num_of_subplots]]
+
+    def _update_labels(self, num_of_subplots):
+        labels = self._channel_labels(num_of_subplots)
+        if labels == self._labels:
+            return
+        for idx, subplot in enumerate(self._subplots):
+            subplot.set_title(labels[idx] if labels and idx < len(labels) else "", fontsize=8)
+        self._labels = labels
+        # The titles aren't blitted, the whole figure is drawn again.
+        self._background = None
 
     def display_params(self, activation, max_subplots=5):
         """Method for updating the subplots and figure with the new parameters (activation maps)."""
+        with measure(self.profiler, "display_params", self.title):
+            self._display_params(activation, max_subplots)
 
+    def _display_params(self, activation, max_subplots):
         num_of_subplots = min(activation.size(0), max_subplots)
 
         # If this method is called for the first time, then create a figure and respective subplots.
         if self._figure is None:
-            self._figure, self._subplots = plt.subplots(num_of_subplots)
-            self._figure.suptitle(self.title, fontsize=12)
-            self._figure.show()
+            self._create_figure(activation, num_of_subplots)
+        self._update_labels(num_of_subplots)
 
-        # Overwrite and update each subplot against the respective activation parameters.
-        for idx in range(num_of_subplots):
-            self._subplots[idx].imshow(activation[idx])
-        self._figure.canvas.draw()  # Overwrite the figure
-        self._figure.show()  # Display the figure
+        # Update the data of each image artist in place against the respective activation parameters.
+        for idx, image in enumerate(self._images[:num_of_subplots]):
+            data = self._to_array(activation[idx])
+            if data.shape != image.get_array().shape:
+                height, width = data.shape[:2]
+                image.set_extent((-0.5, width - 0.5, height - 0.5, -0.5))
+            image.set_data(data)
+            image.set_clim(np.nanmin(data), np.nanmax(data))
+        with measure(self.profiler, "draw", self.title):
+            self._redraw()  # Overwrite the figure
 
     def _show(self):
         activations = self._parameters
         for activation in activations:
             self.display_params(activation=activation)
 
-    def update_display(self, parameters, display_title):
+    def update_display(self, parameters, display_title, channels=None):
         """
         Updates the display with the new parameters
         :param parameters: Tensor (activation map params)
         :param display_title: Title of the figure
+        :param channels: Tensor of the indices of the channels of the parameters, if selected
         """
 
         # Update the parameters with the new values.
         self._parameters = parameters
         self.title = display_title
+        self._channels = None if channels is None else channels.tolist()
         self._show()  # Call the method to update the figures with the new parameters
+
+    def close(self):
+        """Closes the figure."""
+        if self._figure is not None:
+            plt.close(self._figure)
+        self._figure, self._subplots, self._images, self._background = (None, [], [], None)
+        self._labels = None
+
+
+class FeatureMapGridDisplay(FeatureMapDisplay):
+    """
+    A display which shows a single sample of the batch, with its channels tiled into one mosaic image.
+    Irrespective of the batch size, the figure is drawn once per update.
+    """
+
+    def __init__(self, sample=0, max_channels=16, columns=None, padding=1):
+        """
+        :param sample: index of the sample to display, or a reduction over the batch (`mean`, `max`)
+        :param max_channels: (int) maximum number of channels tiled into the mosaic
+        :param columns: (int) number of tiles per row, defaults to a square-ish layout
+        :param padding: (int) number of blank pixels between two tiles
+        """
+        super(FeatureMapGridDisplay, self).__init__()
+        self.sample = sample
+        self.max_channels = max_channels
+        self.columns = columns
+        self.padding = padding
+
+    def _show(self):
+        mosaic = feature_map_image(
+            self._parameters,
+            sample=self.sample,
+            max_channels=self.max_channels,
+            columns=self.columns,
+            padding=self.padding,
+        )
+        self.display_params(activation=mosaic.unsqueeze(0), max_subplots=1)
+
+    def _channel_labels(self, num_of_subplots):
+        """Titles the mosaic with the indices of its tiles, in order."""
+        if self._channels is None:
+            return None
+        channels = ", ".join(str(channel) for channel in self._channels[: self.max_channels])
+        return [f"channels {channels}"]
+
+
+class HistogramDisplay(FeatureMapDisplay):
+    """
+    A display for the histogram history of a layer, drawn as a single heatmap (steps on the x-axis,
+    bins on the y-axis) which is updated in place.
+    """
+
+    def _create_figure(self, activation, num_of_subplots):
+        super(HistogramDisplay, self)._create_figure(activation, num_of_subplots)
+        subplot = self._subplots[0]
+        subplot.set_aspect("auto")
+        subplot.set_xlabel("step")
+        subplot.set_ylabel("bin")
+        self._figure.canvas.draw()
+
+    def _show(self):
+        # (history, bins) -> (bins, history), with the lowest bin at the bottom.
+        heatmap = self._parameters.t().flip(0)
+        self.display_params(activation=heatmap.unsqueeze(0), max_subplots=1)
+
+
+class StatsDisplay(Display):
+    """
+    A display for the per-channel statistics of a layer. It keeps the latest statistics, logs a summary
+    of them and warns about dead channels (always zero) and exploding channels.
+    """
+
+    def __init__(self, exploding_threshold=1e4):
+        """
+        :param exploding_threshold: (float) absolute activation above which a channel is exploding
+        """
+        self.exploding_threshold = exploding_threshold
+        self.statistics, self.title = (None, None)
+        self.dead_channels, self.exploding_channels = ([], [])
+
+    def update_display(self, parameters, display_title):
+        """
+        Updates the display with the new statistics
+        :param parameters: Tensor of shape (len(STATISTICS), channels)
+        :param display_title: Title of the display, i.e. the name of the layer
+        """
+        self.title = display_title
+        values = parameters.detach().cpu()
+        self.statistics = dict(zip(STATISTICS, values))
+
+        magnitude = values[2:4].abs().amax(dim=0)
+        self.dead_channels = (values[4] == 1.0).nonzero().flatten().tolist()
+        exploding = (magnitude > self.exploding_threshold) | ~magnitude.isfinite()
+        self.exploding_channels = exploding.nonzero().flatten().tolist()
+
+        logger.info(
+            "%s: mean %.4g, std %.4g, min %.4g, max %.4g, zeros %.1f%%, l2 %.4g",
+            display_title,
+            values[0].mean(),
+            values[1].mean(),
+            values[2].min(),
+            values[3].max(),
+            100.0 * values[4].mean(),
+            values[5].mean(),
+        )
+        if self.dead_channels:
+            logger.warning("%s: dead channels %s", display_title, self.dead_channels)
+        if self.exploding_channels:
+            logger.warning("%s: exploding channels %s", display_title, self.exploding_channels)
+
+
+class FeatureMapDashboard(Display):
+    """
+    A display shared by all the monitored layers, which lays them out as panels of a single figure.
+
+    Every panel shows a single sample of a layer with its channels tiled into one image. The updates
+    of a notify pass are only buffered, the figure is redrawn once when the pass is complete (`refresh`).
+    Adding or removing layers only moves the existing panels to their new position in the grid.
+    """
+
+    shared = True
+
+    def __init__(self, sample=0, max_channels=16, padding=1):
+        """
+        :param sample: index of the sample to display, or a reduction over the batch (`mean`, `max`)
+        :param max_channels: (int) maximum number of channels tiled into every panel
+        :param padding: (int) number of blank pixels between two tiles
+        """
+        self.sample = sample
+        self.max_channels = max_channels
+        self.padding = padding
+        self._figure, self._background = (None, None)
+        self._panels = dict()  # layer name -> (subplot, image), in the order the layers were added
+        self._pending = dict()  # layer name -> latest mosaic not drawn yet
+        self._layout_changed = False
+
+    def update_display(self, parameters, display_title):
+        """
+        Buffers the new parameters of a layer until the next `refresh`
+        :param parameters: Tensor (activation map params)
+        :param display_title: Title of the panel, i.e. the name of the layer
+        """
+        image = feature_map_image(
+            parameters, sample=self.sample, max_channels=self.max_channels, padding=self.padding
+        )
+        self._pending[display_title] = image.cpu().float().numpy()
+
+    def _layout(self):
+        """Moves every panel to its position in a square-ish grid."""
+        count = len(self._panels)
+        columns = max(1, math.ceil(math.sqrt(count)))
+        rows = max(1, math.ceil(count / columns))
+        grid = self._figure.add_gridspec(rows, columns)
+        for position, (subplot, _) in enumerate(self._panels.values()):
+            subplot.set_subplotspec(grid[position // columns, position % columns])
+        self._layout_changed = True
+
+    def _add_panel(self, layer_name, image):
+        subplot = self._figure.add_subplot(1, 1, 1, label=layer_name)
+        subplot.set_title(layer_name, fontsize=8)
+        subplot.set_axis_off()
+        self._panels[layer_name] = (subplot, subplot.imshow(image, animated=True))
+
+    def remove(self, layer_name):
+        """Removes the panel of a layer which is not monitored anymore."""
+        self._pending.pop(layer_name, None)
+        panel = self._panels.pop(layer_name, None)
+        if panel is not None:
+            panel[0].remove()
+            self._layout()
+
+    def _on_draw(self, event):
+        """Caches the background of the figure whenever it is fully redrawn (e.g. on resize)."""
+        canvas = self._figure.canvas
+        if canvas.supports_blit:
+            self._background = canvas.copy_from_bbox(self._figure.bbox)
+        for subplot, image in self._panels.values():
+            subplot.draw_artist(image)
+
+    def refresh(self):
+        """Applies all the buffered updates and redraws the figure once."""
+        if not self._pending:
+            return
+        if self._figure is None:
+            self._figure = plt.figure()
+            self._figure.canvas.mpl_connect("draw_event", self._on_draw)
+            self._figure.show()
+
+        new_panels = [name for name in self._pending if name not in self._panels]
+        for layer_name in new_panels:
+            self._add_panel(layer_name, self._pending[layer_name])
+        if new_panels:
+            self._layout()
+
+        for layer_name, data in self._pending.items():
+            image = self._panels[layer_name][1]
+            if data.shape != image.get_array().shape:
+                height, width = data.shape[:2]
+                image.set_extent((-0.5, width - 0.5, height - 0.5, -0.5))
+            image.set_data(data)
+            image.set_clim(np.nanmin(data), np.nanmax(data))
+        self._pending = dict()
+        with measure(self.profiler, "draw"):
+            self._redraw()
+
+    def _redraw(self):
+        canvas = self._figure.canvas
+        if self._layout_changed or self._background is None:
+            self._layout_changed = False
+            canvas.draw()  # The panels moved, the background needs to be drawn again.
+        else:
+            canvas.restore_region(self._background)
+            for subplot, image in self._panels.values():
+                subplot.draw_artist(image)
+            canvas.blit(self._figure.bbox)
+        canvas.flush_events()
+
+    def close(self):
+        """Closes the figure."""
+        if self._figure is not None:
+            plt.close(self._figure)
+        self._figure, self._background, self._panels = (None, None, dict())
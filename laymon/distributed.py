@@ -0,0 +1,194 @@
+import threading
+from collections import deque
+
+import torch
+import torch.distributed as dist
+
+from .statistics import merge_statistics
+
+MERGE_CAT = "cat"
+MERGE_MEAN = "mean"
+MERGE_FIRST = "first"
+MERGE_STATISTICS = "statistics"
+
+
+def merge_captures(captures, mode, counts=None):
+    """
+    Merges the captures of a layer gathered from several ranks.
+    :param captures: list of Tensors, in rank order
+    :param mode: (str) `cat` concatenates them along the batch dimension, `mean` averages them,
+        `first` keeps the capture of the lowest rank and `statistics` combines per-channel statistics
+    :param counts: list of the numbers of values per channel of the captures, with `statistics`
+    :return: Tensor
+    """
+    if mode == MERGE_CAT:
+        return torch.cat(captures, dim=0)
+    if mode == MERGE_MEAN:
+        return torch.stack([capture.float() for capture in captures]).mean(dim=0)
+    if mode == MERGE_FIRST:
+        return captures[0]
+    if mode == MERGE_STATISTICS:
+        return merge_statistics(captures, counts)
+    raise ValueError(
+        f"mode should be one of {MERGE_CAT}, {MERGE_MEAN}, {MERGE_FIRST}, {MERGE_STATISTICS}."
+    )
+
+
+class DistributedGatherer(object):
+    """
+    Gathers the captures of every rank of a distributed run to a single destination rank,
+    on a background thread, so that only the destination rank renders.
+
+    Every rank submits one snapshot per monitoring step, captured ranks send their captures and
+    the other ranks send an empty snapshot. The snapshots are gathered with `gather_object` over a
+    dedicated gloo group, so the captures travel through the host whatever the backend of the
+    training, and the collectives never interleave with the ones of the training loop.
+
+    As every rank has to take part in every gather, all the ranks must submit the same number of
+    snapshots, e.g. call `start` on every step. When more than `max_outgoing` snapshots with
+    captures are waiting to be sent, the captures of the oldest one are dropped, but it is still
+    sent as an empty snapshot so that the gathers of the ranks stay aligned.
+    """
+
+    def __init__(
+        self, capture_ranks=None, destination_rank=0, group=None, max_pending=2, max_outgoing=8
+    ):
+        """
+        Creates the gloo group (collectively, all the ranks must create their gatherer) and starts the
+        gathering thread.
+        :param capture_ranks: iterable of the ranks which capture their layers, defaults to all
+        :param destination_rank: (int) rank which receives the captures and renders them
+        :param group: process group used to gather, defaults to a new gloo group of all the ranks
+        :param max_pending: (int) number of merged snapshots kept on the destination rank until they
+            are rendered, the oldest ones are dropped
+        :param max_outgoing: (int) number of snapshots with captures waiting to be sent, the captures
+            of the oldest ones are dropped
+        """
+        if not (dist.is_available() and dist.is_initialized()):
+            raise RuntimeError("The distributed mode requires an initialized process group.")
+        self.rank = dist.get_rank()
+        world_size = dist.get_world_size()
+        self.capture_ranks = set(range(world_size) if capture_ranks is None else capture_ranks)
+        self.destination_rank = destination_rank
+        self.group = dist.new_group(backend="gloo") if group is None else group
+        self._world_size = dist.get_world_size(self.group)
+
+        self.max_outgoing = max_outgoing
+        self._outgoing = deque()
+        self._outgoing_captures = 0  # Number of the queued snapshots which hold captures.
+        self._gathered = deque(maxlen=max_pending)
+        self._condition = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self.sent, self.dropped, self.dropped_outgoing = (0, 0, 0)
+        self.last_error = None
+
+        self._thread = threading.Thread(target=self._run, name="laymon-gatherer", daemon=True)
+        self._thread.start()
+
+    @property
+    def capturing(self):
+        """Whether this rank captures its layers."""
+        return self.rank in self.capture_ranks
+
+    @property
+    def rendering(self):
+        """Whether this rank renders the gathered captures."""
+        return self.rank == self.destination_rank
+
+    def submit(self, snapshot):
+        """
+        Queues the snapshot of a step to be sent to the destination rank, without waiting for it.
+        :param snapshot: dict of layer name -> (merge mode, Tensor, number of values per channel or
+            None), the tensors may be on the device
+        """
+        snapshot = snapshot if self.capturing else {}
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot submit to a closed gatherer.")
+            self._outgoing.append(snapshot)
+            if snapshot:
+                self._outgoing_captures += 1
+            if self._outgoing_captures > self.max_outgoing:
+                for position, queued in enumerate(self._outgoing):
+                    if queued:
+                        # The snapshot keeps its gather, without the captures.
+                        self._outgoing[position] = {}
+                        self._outgoing_captures -= 1
+                        self.dropped_outgoing += 1
+                        break
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._outgoing and not self._closed:
+                    self._condition.wait()
+                if not self._outgoing:
+                    return  # Closed and fully sent.
+                snapshot = self._outgoing.popleft()
+                if snapshot:
+                    self._outgoing_captures -= 1
+                self._busy = True
+
+            try:
+                self._gather(snapshot)
+            except Exception as error:  # Keep the worker alive, surface the error to the caller.
+                self.last_error = error
+
+            with self._condition:
+                self._busy = False
+                self.sent += 1
+                self._condition.notify_all()
+
+    def _gather(self, snapshot):
+        # The device to host copies happen here rather than on the training thread.
+        snapshot = {
+            layer_name: (mode, capture.cpu(), count)
+            for layer_name, (mode, capture, count) in snapshot.items()
+        }
+        snapshots = [None] * self._world_size if self.rendering else None
+        dist.gather_object(snapshot, snapshots, dst=self.destination_rank, group=self.group)
+        if not self.rendering:
+            return
+
+        captures = dict()
+        for rank_snapshot in snapshots:
+            for layer_name, (mode, capture, count) in rank_snapshot.items():
+                layer_captures = captures.setdefault(layer_name, (mode, [], []))
+                layer_captures[1].append(capture)
+                layer_captures[2].append(count)
+        merged = {
+            layer_name: merge_captures(layer_captures, mode, counts=counts)
+            for layer_name, (mode, layer_captures, counts) in captures.items()
+        }
+        with self._condition:
+            if len(self._gathered) == self._gathered.maxlen:
+                self.dropped += 1
+            self._gathered.append(merged)
+
+    def completed(self):
+        """
+        Returns the merged snapshots gathered since the last call, on the destination rank.
+        :return: list of dicts of layer name -> Tensor, from the oldest to the latest
+        """
+        with self._condition:
+            gathered = list(self._gathered)
+            self._gathered.clear()
+        return gathered
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every queued snapshot has been sent.
+        :param timeout: (float) maximum number of seconds to wait
+        :return: True if the queue was drained, else False
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._outgoing and not self._busy, timeout)
+
+    def close(self, timeout=None):
+        """Sends the pending snapshots and stops the gathering thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
@@ -0,0 +1,74 @@
+import torch
+import torch.nn.functional as F
+
+COSINE = "cosine"
+RELATIVE_L2 = "relative_l2"
+
+_POOLS = {3: F.adaptive_avg_pool1d, 4: F.adaptive_avg_pool2d, 5: F.adaptive_avg_pool3d}
+
+
+class DriftGate(object):
+    """
+    Decides whether a capture differs enough from the last published one to be worth publishing,
+    i.e. rendered or recorded again.
+
+    A compact reference is kept per layer: the captures are downsampled on the device to at most
+    `reference_size` values per spatial dimension and averaged over the batch, so that the reference
+    of a layer is only a few hundred floats. The distance between a capture and the reference is also
+    computed on the device, only the resulting scalar is copied to the host. The reference is only
+    replaced when a capture drifts, so a slow drift over many captures is detected as well.
+    """
+
+    def __init__(self, threshold=0.05, metric=RELATIVE_L2, reference_size=8):
+        """
+        :param threshold: (float) distance from which a capture has drifted
+        :param metric: (str) `relative_l2`, the L2 norm of the difference relative to the one of the
+            reference, or `cosine`, one minus the cosine similarity
+        :param reference_size: (int) size of the spatial dimensions of the reference
+        """
+        if metric not in (COSINE, RELATIVE_L2):
+            raise ValueError(f"metric should be one of {COSINE}, {RELATIVE_L2}.")
+        self.threshold = threshold
+        self.metric = metric
+        self.reference_size = reference_size
+        self.reference = None
+        self.distance = None  # Distance of the last capture to the reference.
+
+    def sketch(self, activation):
+        """
+        Reduces a capture to its compact reference.
+        :param activation: Tensor of shape (batch, channels, ...)
+        :return: Tensor of shape (channels * reference_size ** spatial dims,)
+        """
+        activation = activation.detach().float()
+        pool = _POOLS.get(activation.dim())
+        if pool is not None:
+            spatial_size = [min(self.reference_size, size) for size in activation.shape[2:]]
+            activation = pool(activation, spatial_size)
+        if activation.dim() > 1:
+            activation = activation.mean(dim=0)
+        return activation.flatten()
+
+    def _distance(self, sketch):
+        if self.metric == COSINE:
+            return 1.0 - F.cosine_similarity(sketch, self.reference, dim=0)
+        eps = torch.finfo(sketch.dtype).eps
+        return torch.linalg.vector_norm(sketch - self.reference) / torch.linalg.vector_norm(
+            self.reference
+        ).clamp_min(eps)
+
+    def drifted(self, activation):
+        """
+        Compares a capture with the reference, and makes it the new reference if it has drifted.
+        :param activation: Tensor
+        :return: True if the capture has drifted (or is the first one), else False
+        """
+        sketch = self.sketch(activation)
+        if self.reference is None or self.reference.shape != sketch.shape:
+            self.reference, self.distance = (sketch, None)
+            return True
+        self.distance = float(self._distance(sketch))
+        if self.distance < self.threshold:
+            return False
+        self.reference = sketch
+        return True
@@ -0,0 +1,90 @@
+"""
+===========================================
+Image encoding of the feature maps
+===========================================
+
+Colormaps the feature maps with a lookup table and encodes them to PNG, using numpy and zlib
+only, so that the frames can be encoded by worker threads or processes without matplotlib.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+_LUTS = dict()
+
+
+def colormap_lut(name="viridis"):
+    """
+    Returns the lookup table of a matplotlib colormap.
+    :param name: (str) name of the colormap
+    :return: numpy array of shape (256, 3) and dtype uint8
+    """
+    if name not in _LUTS:
+        try:
+            from matplotlib import colormaps
+
+            colormap = colormaps[name]
+        except ImportError:  # matplotlib < 3.5
+            from matplotlib import cm
+
+            colormap = cm.get_cmap(name)
+        _LUTS[name] = (colormap(np.linspace(0.0, 1.0, 256))[:, :3] * 255).astype(np.uint8)
+    return _LUTS[name]
+
+
+def normalize(image):
+    """
+    Min-max scales an image to uint8, NaN values (e.g. the padding of a mosaic) are mapped to 0.
+    :param image: numpy array of shape (height, width)
+    :return: numpy array of dtype uint8
+    """
+    image = np.asarray(image, dtype=np.float32)
+    finite = np.isfinite(image)
+    if not finite.any():
+        return np.zeros(image.shape, dtype=np.uint8)
+    low, high = image[finite].min(), image[finite].max()
+    scaled = (image - low) * (255.0 / max(high - low, np.finfo(np.float32).eps))
+    return np.where(finite, scaled, 0.0).round().astype(np.uint8)
+
+
+def apply_colormap(image, lut):
+    """
+    Colormaps an image with a lookup table, in a single vectorized indexing.
+    :param image: numpy array of shape (height, width)
+    :param lut: numpy array of shape (256, 3) and dtype uint8
+    :return: numpy array of shape (height, width, 3) and dtype uint8
+    """
+    return lut[normalize(image)]
+
+
+def _chunk(kind, data):
+    chunk = kind + data
+    return struct.pack(">I", len(data)) + chunk + struct.pack(">I", zlib.crc32(chunk) & 0xFFFFFFFF)
+
+
+def encode_png(pixels, compression=6):
+    """
+    Encodes an 8-bit grayscale or RGB image to PNG.
+    :param pixels: numpy array of shape (height, width) or (height, width, 3) and dtype uint8
+    :param compression: (int) zlib compression level
+    :return: bytes
+    """
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    height, width = pixels.shape[:2]
+    color_type = 2 if pixels.ndim == 3 else 0
+    # Every row starts with its filter type, 0 (no filtering).
+    rows = np.zeros((height, 1 + pixels[0].size), dtype=np.uint8)
+    rows[:, 1:] = pixels.reshape(height, -1)
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    return b"".join(
+        (
+            PNG_SIGNATURE,
+            _chunk(b"IHDR", header),
+            _chunk(b"IDAT", zlib.compress(rows.tobytes(), compression)),
+            _chunk(b"IEND", b""),
+        )
+    )
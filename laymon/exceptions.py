@@ -32,3 +32,23 @@ class SingleDimensionalLayerWarning(Warning):
 
     def __str__(self):
         return f"{self.layer_name} -> {self.message}"
+
+
+class ReplicatedLayerWarning(Warning):
+    """
+    Warning to indicate that the hook of a layer was called by a replica of the layer, e.g. by
+    nn.DataParallel, whose outputs are not captured.
+    """
+
+    default_message = (
+        "Layer was called by a replica (nn.DataParallel is not supported, use "
+        "DistributedDataParallel), its outputs are not captured."
+    )
+
+    def __init__(self, layer_name, message=default_message):
+        self.layer_name = layer_name
+        self.message = message
+        super(ReplicatedLayerWarning, self).__init__()
+
+    def __str__(self):
+        return f"{self.layer_name} -> {self.message}"
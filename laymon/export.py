@@ -0,0 +1,228 @@
+"""
+===========================================
+Export of the feature maps as images
+===========================================
+
+Writes the feature maps of every monitored layer as PNG frames, in
+`<path>/<layer name>/frame_000000.png`, and optionally stitches the frames of every layer into a
+video with ffmpeg.
+
+The frames are colormapped and encoded by a pool of worker processes, so the export scales with the
+number of cores and the training thread only tiles the feature maps. The images are handed over to
+the workers through shared memory instead of being pickled, and the number of frames waiting for a
+worker is bounded: an update blocks until a worker is free, which bounds the memory of the export.
+"""
+
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .encoding import apply_colormap, colormap_lut, encode_png
+from .interfaces import Display
+from .transforms import feature_map_image
+
+FRAME_FILE = "frame_{:06d}.png"
+VIDEO_FILE = "{}.mp4"
+
+
+def _attach(name):
+    """Attaches a shared memory block created by the exporting process."""
+    if sys.version_info >= (3, 13):
+        # The block is unlinked by the exporting process, the worker mustn't track it.
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def _encode_frame(name, shape, dtype, lut, frame_path, compression):
+    """Colormaps and encodes a frame of the shared memory to a PNG file, in a worker process."""
+    memory = _attach(name)
+    try:
+        image = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+        pixels = apply_colormap(image, lut)
+        del image  # Release the buffer before closing the block.
+    finally:
+        memory.close()
+    with open(frame_path, "wb") as frame_file:
+        frame_file.write(encode_png(pixels, compression=compression))
+    return frame_path
+
+
+def _stitch_video(directory, video_path, fps):
+    """Stitches the PNG frames of a layer into a video with ffmpeg, in a worker process."""
+    command = [
+        "ffmpeg",
+        "-y",
+        "-loglevel",
+        "error",
+        "-framerate",
+        str(fps),
+        "-i",
+        os.path.join(directory, FRAME_FILE.replace("{:06d}", "%06d")),
+        # H.264 needs even dimensions.
+        "-vf",
+        "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        "-pix_fmt",
+        "yuv420p",
+        video_path,
+    ]
+    subprocess.run(command, check=True, capture_output=True)
+    return video_path
+
+
+def _layer_directory(path, layer_name):
+    return os.path.join(path, layer_name.replace(os.sep, "_"))
+
+
+class FeatureMapExporter(Display):
+    """
+    A display shared by all the monitored layers, which exports their feature maps as PNG frames
+    (and videos) from a pool of worker processes.
+    """
+
+    shared = True
+
+    def __init__(
+        self,
+        path,
+        sample=0,
+        max_channels=16,
+        colormap="viridis",
+        workers=None,
+        max_pending=None,
+        compression=6,
+        video=False,
+        fps=10,
+        start_method="spawn",
+    ):
+        """
+        :param path: (str) directory of the export, with a sub-directory per layer
+        :param sample: index of the sample to export, or a reduction over the batch (`mean`, `max`)
+        :param max_channels: (int) maximum number of channels tiled into every frame
+        :param colormap: (str) name of the matplotlib colormap of the frames
+        :param workers: (int) number of worker processes, defaults to the number of CPUs
+        :param max_pending: (int) maximum number of frames waiting for or being encoded, an update
+            blocks until one of them is written. Defaults to twice the number of workers.
+        :param compression: (int) zlib compression level of the PNG frames
+        :param video: (bool) stitch the frames of every layer into `<path>/<layer name>.mp4` when the
+            exporter is closed, ffmpeg must be on the PATH
+        :param fps: (int) frame rate of the videos
+        :param start_method: (str) start method of the worker processes, `spawn` doesn't inherit the
+            state (threads, CUDA context) of the training process
+        """
+        self.path = path
+        self.sample = sample
+        self.max_channels = max_channels
+        self.compression = compression
+        self.video = video
+        self.fps = fps
+        self.workers = workers or os.cpu_count() or 1
+        self._lut = colormap_lut(colormap)
+        self._pending = threading.BoundedSemaphore(max_pending or 2 * self.workers)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)  # Notified when a frame has been written.
+        self._frames = dict()  # layer name -> number of frames exported
+        self._futures = set()
+        self._errors = []
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context(start_method)
+        )
+        os.makedirs(path, exist_ok=True)
+
+    def update_display(self, parameters, display_title):
+        """
+        Hands the new parameters of a layer over to the workers, blocks while too many frames are
+        waiting for a worker.
+        :param parameters: Tensor (activation map params)
+        :param display_title: Name of the layer
+        """
+        image = feature_map_image(parameters, sample=self.sample, max_channels=self.max_channels)
+        image = image.cpu().float().numpy()
+        with self._lock:
+            number = self._frames.get(display_title, 0)
+            self._frames[display_title] = number + 1
+        directory = _layer_directory(self.path, display_title)
+        if number == 0:
+            os.makedirs(directory, exist_ok=True)
+
+        self._pending.acquire()
+        memory = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        np.ndarray(image.shape, dtype=image.dtype, buffer=memory.buf)[...] = image
+        try:
+            future = self._executor.submit(
+                _encode_frame,
+                memory.name,
+                image.shape,
+                image.dtype.str,
+                self._lut,
+                os.path.join(directory, FRAME_FILE.format(number)),
+                self.compression,
+            )
+        except BaseException:
+            self._release(memory)
+            raise
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(lambda done: self._on_done(done, memory))
+
+    def _release(self, memory):
+        memory.close()
+        memory.unlink()
+        self._pending.release()
+
+    def _on_done(self, future, memory):
+        self._release(memory)
+        with self._idle:
+            self._futures.discard(future)
+            if not future.cancelled() and future.exception() is not None:
+                self._errors.append(future.exception())
+            self._idle.notify_all()
+
+    def refresh(self):
+        """Frames are handed over to the workers as soon as they are updated, nothing to redraw."""
+
+    def remove(self, layer_name):
+        """The frames of a layer which is not monitored anymore stay in the export."""
+
+    def flush(self):
+        """Waits for the frames handed over so far to be written, and raises the first failure."""
+        with self._idle:
+            self._idle.wait_for(lambda: not self._futures)
+            errors, self._errors = (self._errors, [])
+        if errors:
+            raise errors[0]
+
+    def _stitch_videos(self):
+        if shutil.which("ffmpeg") is None:
+            warnings.warn("ffmpeg was not found, the frames are not stitched into videos.")
+            return
+        futures = [
+            self._executor.submit(
+                _stitch_video,
+                _layer_directory(self.path, layer_name),
+                os.path.join(self.path, VIDEO_FILE.format(layer_name.replace(os.sep, "_"))),
+                self.fps,
+            )
+            for layer_name in self._frames
+        ]
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """Writes the pending frames, stitches the videos (if any) and stops the workers."""
+        if self._executor is None:
+            return
+        try:
+            self.flush()
+            if self.video:
+                self._stitch_videos()
+        finally:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,117 @@
+"""
+===========================================
+Capture of compiled models
+===========================================
+
+Forward hooks are Python callbacks, which `torch.compile` either traces into the compiled graph or
+breaks the graph for. Instead, the model is traced with `torch.fx` and its graph is rewritten to return
+the outputs of the monitored layers (optionally reduced in the graph) as extra outputs. The rewritten
+graph can be compiled as a whole, the captures are handed over to the monitor once it has returned.
+"""
+
+import torch
+import torch.fx
+import torch.nn as nn
+
+
+class Reduction(nn.Module):
+    """Wraps a reduction function, so that it can be called as a submodule of a rewritten graph."""
+
+    def __init__(self, function):
+        super(Reduction, self).__init__()
+        self.function = function
+
+    def forward(self, capture):
+        return self.function(capture)
+
+
+def _modifies_in_place(node, graph_module):
+    """Checks if a node overwrites its inputs, e.g. a ReLU(inplace=True) or an `add_` call."""
+    if node.kwargs.get("inplace", False):
+        return True
+    if node.op == "call_module":
+        return getattr(graph_module.get_submodule(node.target), "inplace", False)
+    if node.op == "call_method":
+        return node.target.endswith("_") and not node.target.endswith("__")
+    return False
+
+
+def capture_graph(model, layer_names, reductions=None):
+    """
+    Traces a model and rewrites its graph to also return the outputs of some of its layers.
+    :param model: pyTorch model, it must be traceable by `torch.fx.symbolic_trace`
+    :param layer_names: list of the names of the layers (leaf modules of the trace) to capture
+    :param reductions: callable, or dict of layer name -> callable, applied to the captured outputs
+        within the graph, e.g. to keep a single sample
+    :return: GraphModule returning (outputs of the model, tuple of the captures in layer order)
+    """
+    graph_module = torch.fx.symbolic_trace(model)
+    graph = graph_module.graph
+    # A layer called several times is captured on its last call, as with the forward hooks.
+    layer_nodes = {node.target: node for node in graph.nodes if node.op == "call_module"}
+    missing = [layer_name for layer_name in layer_names if layer_name not in layer_nodes]
+    if missing:
+        raise ValueError(f"The layers {missing} are not called as modules in the traced graph.")
+
+    captures = []
+    for index, layer_name in enumerate(layer_names):
+        node = layer_nodes[layer_name]
+        # Keep a copy of the output if a following operation overwrites it.
+        overwritten = any(_modifies_in_place(user, graph_module) for user in node.users)
+        reduction = reductions.get(layer_name) if isinstance(reductions, dict) else reductions
+        # The captures are computed right after the layer, before its output can be overwritten.
+        with graph.inserting_after(node):
+            node = graph.call_method("detach", (node,))
+        if overwritten:
+            with graph.inserting_after(node):
+                node = graph.call_method("clone", (node,))
+        if reduction is not None:
+            reduction_name = f"laymon_reduction_{index}"
+            graph_module.add_submodule(reduction_name, Reduction(reduction))
+            with graph.inserting_after(node):
+                node = graph.call_module(reduction_name, (node,))
+        captures.append(node)
+    output_node = next(node for node in graph.nodes if node.op == "output")
+    output_node.args = ((output_node.args[0], tuple(captures)),)
+    graph.lint()
+    graph_module.recompile()
+    return graph_module
+
+
+def traced_layers(model):
+    """Returns the (name, layer) pairs of the leaf modules called in the trace of the model."""
+    graph_module = torch.fx.symbolic_trace(model)
+    layer_names = []
+    for node in graph_module.graph.nodes:
+        if node.op == "call_module" and node.target not in layer_names:
+            layer_names.append(node.target)
+    return [(layer_name, model.get_submodule(layer_name)) for layer_name in layer_names]
+
+
+class GraphCapture(nn.Module):
+    """
+    Runs a model through its rewritten graph (compiled or not) and hands the captured outputs over
+    to a monitor. It is called instead of the model and returns the same outputs.
+    """
+
+    def __init__(self, model, monitor, layer_names, reductions=None, compile_options=None):
+        """
+        :param model: pyTorch model
+        :param monitor: FeatureMapMonitor in which the layers are registered (without hooks)
+        :param layer_names: list of the names of the layers to capture
+        :param reductions: callable or dict of layer name -> callable applied within the graph
+        :param compile_options: dict of keyword arguments of `torch.compile`, the graph isn't compiled
+            when None
+        """
+        super(GraphCapture, self).__init__()
+        self.layer_names = list(layer_names)
+        self.graph_module = capture_graph(model, self.layer_names, reductions=reductions)
+        self._monitor = monitor
+        if compile_options is not None:
+            self.graph_module.compile(**compile_options)
+
+    def forward(self, *args, **kwargs):
+        outputs, captures = self.graph_module(*args, **kwargs)
+        for layer_name, capture in zip(self.layer_names, captures):
+            self._monitor.capture_output(layer_name, capture)
+        return outputs
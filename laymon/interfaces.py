@@ -43,8 +43,11 @@ class Observer:
 
     _description = NotImplementedError
 
+    # Whether the observer displays the parameters as images, i.e. needs at least 2D feature maps.
+    requires_feature_maps = True
+
     @abc.abstractmethod
-    def update(self, parameters):
+    def update(self, parameters, step=None, channels=None):
         raise NotImplementedError
 
     def get_description(self):
@@ -54,25 +57,64 @@ class Observer:
 class Display:
     """
     Abstract class to create and update the displays attached to an observer.
+    A display whose `shared` attribute is True is shared by all the observers of a factory,
+    the `display_title` of its updates tells the layers apart.
+    When the monitoring is profiled, its Profiler is set as the `profiler` of the displays.
+    A display whose `accepts_step` attribute is True is given the step of every capture as the
+    `step` keyword argument of its updates, and one whose `accepts_channels` attribute is True the
+    indices of the channels of the capture (None if they weren't selected) as `channels`.
     """
 
     __metaclass__ = abc.ABCMeta
 
+    shared = False
+    accepts_step = False
+    accepts_channels = False
+    profiler = None
+
     @abc.abstractmethod
     def update_display(self, parameters, display_title):
         raise NotImplementedError
 
+    def close(self):
+        """Releases the resources (files, windows, workers) held by the display."""
+
 
 class ObserverFactory:
     """
     Abstract class for creating a factory to create new observers with a display attached to them.
-    The `display_object` stores a display class used to visualize an observer's parameters/states.
+    The `display_object` stores a display class used to visualize an observer's parameters/states,
+    and `display_options` the keyword arguments it is initialised with (None for no arguments),
+    which every factory instance copies so that they are not shared between factories.
     """
 
     __metaclass__ = abc.ABCMeta
 
     display_object = None
+    display_options = None
 
     @abc.abstractmethod
     def create(self, observer, observer_name):
         raise NotImplementedError
+
+    def refresh(self):
+        """Called once all the observers have been updated, e.g. to redraw a shared display."""
+
+    def release(self, observer_name):
+        """Called when an observer is not monitored anymore."""
+
+    def close(self):
+        """Called when the monitoring ends."""
+
+
+class SamplingPolicy:
+    """
+    Abstract class to decide whether the output of a layer should be captured on a forward pass.
+    A policy instance keeps the state (counters, timers) of a single layer.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def should_capture(self, layer):
+        raise NotImplementedError
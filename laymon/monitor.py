@@ -1,19 +1,125 @@
+import copy
+import threading
 import warnings
+from collections import namedtuple
 from .interfaces import Monitor
+from .profiling import measure
+from .transfer import HostTransfer
 from .exceptions import SingleDimensionalLayerWarning, LayerRegisterException
+from .exceptions import ReplicatedLayerWarning
+
+# An immutable capture: the parameters, the step they were captured on, the generation of the slot
+# (i.e. the number of captures published in the slot so far) when they were published, and the
+# indices of the channels of the parameters if the capture transform selected them (else None).
+Capture = namedtuple("Capture", ["parameters", "step", "generation", "channels"])
+
+
+class CaptureSlot(object):
+    """
+    Holds the latest capture of a layer, shared by the forward passes writing it and the
+    notifications reading it, which may run on different threads.
+
+    Every capture is published as a new immutable `Capture`, by a single reference assignment,
+    so a reader always gets a complete capture without taking any lock and never blocks the
+    forward passes. Writers serialize on a small lock, which also guards the capture counters
+    of the layer, and a capture never replaces a more recent one (e.g. when the forward passes
+    of two threads finish out of order).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()  # Taken by the writers only.
+        self.generation = 0
+        self._latest = None
+
+    def publish(self, parameters, step, channels=None):
+        """
+        Publishes a new capture.
+        :param parameters: Tensor
+        :param step: (int) step id of the capture
+        :param channels: Tensor of the indices of the channels of the parameters, if selected
+        :return: the published Capture, or None if a more recent one was already there
+        """
+        with self.lock:
+            if self._latest is not None and step < self._latest.step:
+                return None
+            self.generation += 1
+            self._latest = Capture(parameters, step, self.generation, channels)
+            return self._latest
+
+    def latest(self):
+        """Returns the latest complete capture, or None before the first one."""
+        return self._latest
 
 
 class ObserverHookObject:
     """
     AN object used to store:
         1. The observer object which is being hooked
-        2. Parameters being monitored
-        3. Handler of the hooked layer
+        2. Capture slot holding the parameters being monitored
+        3. The hooked layer, and the handler of its hook (None while the hooks are detached)
+        4. Sampling policy of the layer, the number of captured/skipped forward passes, the offset
+           of its implicit step ids, advanced by the explicit ones (see `pass_step`), and the step
+           of the last pass it captured, whether the capture was published or held back
+        5. Capture transform applied to the activations before they are retained
+        6. Drift gate of the layer, the number of captures it held back as unchanged and the
+           generation of the last capture handed over to the observer
+        7. Whether the observer draws feature maps, and whether the latest capture is single
+           dimensional (None before the first capture), classified when it is captured
 
+    The records are slotted, as the notifications go through thousands of them on large models.
     """
 
+    __slots__ = (
+        "object",
+        "layer",
+        "slot",
+        "handler",
+        "hooked",
+        "sampling_policy",
+        "captured",
+        "skipped",
+        "step_offset",
+        "last_step",
+        "capture_transform",
+        "retained_bytes",
+        "drift_gate",
+        "unchanged",
+        "notified_generation",
+        "requires_feature_maps",
+        "single_dim",
+    )
+
     def __init__(self, kwargs):
-        self.__dict__.update(**kwargs)
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    @property
+    def parameters(self):
+        """Parameters of the latest capture, use `slot.latest()` to read them with their step."""
+        capture = self.slot.latest()
+        return None if capture is None else capture.parameters
+
+    @property
+    def step(self):
+        """Step id of the latest capture, i.e. the number of the forward pass it was captured on."""
+        capture = self.slot.latest()
+        return None if capture is None else capture.step
+
+    def pass_step(self):
+        """Implicit step id of the latest pass of the layer, captured or skipped."""
+        return self.captured + self.skipped + self.step_offset
+
+    def next_step(self, step=None):
+        """
+        Returns the step id of a capture, once its pass has been counted (with the slot lock held).
+        :param step: (int) explicit step id of the capture, e.g. of a capture window, or None for
+            the implicit one. The following implicit step ids continue from an explicit one, so that
+            the slot doesn't reject them as older than it.
+        """
+        if step is None:
+            return self.pass_step()
+        self.step_offset = max(self.step_offset, step - self.captured - self.skipped)
+        return step
 
 
 class FeatureMapMonitor(Monitor):
@@ -21,16 +127,74 @@ class FeatureMapMonitor(Monitor):
     A monitor type class for visualizing the feature maps of a neural network.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        sampling_policy=None,
+        capture_transform=None,
+        host_transfer=False,
+        profiler=None,
+        attached=True,
+        drift_gate=None,
+        skip_unchanged=False,
+    ):
+        """
+        :param sampling_policy: SamplingPolicy used by the layers which don't specify their own.
+            Every layer gets its own copy of the policy, so that their states are independent.
+        :param capture_transform: CaptureTransform used by the layers which don't specify their own,
+            every layer gets its own copy.
+        :param host_transfer: (bool) copy the captured activations to pinned host buffers without
+            blocking, the observers are then only notified once the copies have completed.
+        :param profiler: Profiler recording the latencies of the hooks and notifications, if any.
+        :param attached: (bool) register the hooks of the layers when they are added, otherwise they
+            are only registered by `attach_all` (e.g. for the duration of a capture window).
+        :param drift_gate: DriftGate used by the layers which don't specify their own, every layer gets
+            its own copy. The captures which haven't drifted from the last published one are dropped,
+            and the observers of these layers are only notified of new captures.
+        :param skip_unchanged: (bool) only notify the observers of the layers which have been captured
+            since their last notification, instead of redrawing the latest capture of every layer.
+        """
         self._layer_observers = dict()  # Maintains a mapping of layers/observers being monitored.
+        self._monitored_layers = dict()  # Maps id(layer) -> layer name, to avoid duplicate hooks.
+        # (layer name, record) pairs of the layers which have been captured, in registration order.
+        # It is only rebuilt when a layer gets its first capture or is removed.
+        self._dispatch, self._dispatch_stale = ([], False)
+        # Layers captured since the last notification (layer name -> record), in capture order. The
+        # hooks add to it and the notifications drain it, so they don't scan the unchanged layers.
+        self._dirty, self._dirty_lock = (dict(), threading.Lock())
+        self._sampling_policy = sampling_policy
+        self._capture_transform = capture_transform
+        self._drift_gate = drift_gate
+        self._host_transfer = HostTransfer() if host_transfer else None
+        # Whether the hooks capture, e.g. False on the ranks of a distributed run which don't capture.
+        self.capturing = True
+        self.profiler = profiler
+        self.attached = attached
+        self.step = None  # Step id given to the captures, instead of the number of forward passes.
+        self.skip_unchanged = skip_unchanged
+        self.skipped_redraws = 0  # Number of notifications skipped as their layer was unchanged.
 
-    def add_observer(self, layer_observer):
+    def add_observer(
+        self,
+        layer_observer,
+        sampling_policy=None,
+        capture_transform=None,
+        hooked=True,
+        drift_gate=None,
+    ):
         """
         1. Creates a layer observer object.
         2. Hooks the layer to capture the activation map of the layer.
         3. Adds the observer object to the list of monitored observers.
 
         :param layer_observer: Observer object
+        :param sampling_policy: SamplingPolicy deciding on which forward passes the layer is captured,
+            defaults to a copy of the monitor's policy (if any), i.e. every forward pass.
+        :param capture_transform: callable (e.g. CaptureTransform) reducing the activations on the
+            device before they are retained, defaults to the monitor's transform (if any).
+        :param hooked: (bool) hook the layer, otherwise its outputs are handed over to the monitor
+            with `capture_output` (e.g. by the extra outputs of a rewritten graph).
+        :param drift_gate: DriftGate deciding which captures are published, defaults to a copy of
+            the monitor's gate (if any), i.e. every capture.
         """
 
         if not (hasattr(layer_observer, "get_layer") and hasattr(layer_observer, "get_layer_name")):
@@ -42,21 +206,54 @@ class FeatureMapMonitor(Monitor):
         layer = layer_observer.get_layer()
         layer_name = layer_observer.get_layer_name()
 
-        # If layer is already being monitored then return.
-        if layer_name in self._layer_observers:
+        # If layer is already being monitored (under any name) then return.
+        if layer_name in self._layer_observers or id(layer) in self._monitored_layers:
             return
 
         # Creates an observer hook object and store it in the list of monitored observers.
+        if sampling_policy is None and hasattr(layer_observer, "get_sampling_policy"):
+            sampling_policy = layer_observer.get_sampling_policy()
+        if sampling_policy is None and self._sampling_policy is not None:
+            sampling_policy = copy.deepcopy(self._sampling_policy)
+        # Observers which need their own reduction (e.g. statistics) take precedence over the monitor.
+        if capture_transform is None and hasattr(layer_observer, "get_capture_transform"):
+            capture_transform = layer_observer.get_capture_transform()
+        if capture_transform is None and self._capture_transform is not None:
+            # The transforms may keep the state of a layer too, e.g. its selected channels.
+            capture_transform = copy.deepcopy(self._capture_transform)
+        if drift_gate is None and self._drift_gate is not None:
+            drift_gate = copy.deepcopy(self._drift_gate)
         _observer_hook_object = ObserverHookObject(
-            {"object": layer_observer, "parameters": None, "handler": None}
+            {
+                "object": layer_observer,
+                "layer": layer,
+                "slot": CaptureSlot(),
+                "handler": None,
+                "hooked": hooked,
+                "sampling_policy": sampling_policy,
+                "captured": 0,
+                "skipped": 0,
+                "step_offset": 0,
+                "last_step": None,
+                "capture_transform": capture_transform,
+                "retained_bytes": 0,
+                "drift_gate": drift_gate,
+                "unchanged": 0,
+                "notified_generation": 0,
+                "requires_feature_maps": layer_observer.requires_feature_maps,
+                "single_dim": None,
+            }
         )
         self._layer_observers[layer_name] = _observer_hook_object
+        self._monitored_layers[id(layer)] = layer_name
 
-        # Create a forward hook to capture the activation map for that layer.
-        handler = layer.register_forward_hook(self._get_activation_map(layer_name))
+        # Create a hook to capture the activation map for that layer and store its handler.
+        if hooked and self.attached:
+            self._layer_observers[layer_name].handler = self._register_hook(layer, layer_name)
 
-        # Store the handler of the hook.
-        self._layer_observers[layer_name].handler = handler
+    def _register_hook(self, layer, layer_name):
+        """Registers a forward hook on the layer and returns its handler."""
+        return layer.register_forward_hook(self._get_activation_map(layer_name))
 
     def remove_observer(self, layer_observer=None, layer_name=None):
         """
@@ -81,47 +278,332 @@ class FeatureMapMonitor(Monitor):
         # If the hook was present for the layer name, then remove the unhook its handler and
         # delete the layer observer from the list of observers being monitored.
         if hook:
-            hook.handler.remove()
+            if hook.handler is not None:
+                hook.handler.remove()
             del self._layer_observers[layer_name]
+            self._monitored_layers.pop(id(hook.layer), None)
+            self._dispatch_stale = True
+            with self._dirty_lock:
+                self._dirty.pop(layer_name, None)
+            if self._host_transfer is not None:
+                self._host_transfer.discard(layer_name)
             return True
 
         return False  # Return false if layer is not present
 
+    def attach_all(self):
+        """Registers the hooks of all the monitored layers which are not hooked yet."""
+        self.attached = True
+        for layer_name, observer in self._layer_observers.items():
+            if observer.hooked and observer.handler is None:
+                observer.handler = self._register_hook(observer.layer, layer_name)
+
+    def detach_all(self):
+        """Removes the hooks of all the monitored layers, the layers stay registered."""
+        self.attached = False
+        for observer in self._layer_observers.values():
+            if observer.handler is not None:
+                observer.handler.remove()
+                observer.handler = None
+
     @staticmethod
     def _is_layer_single_dim(layer):
         """Checks if the layer is a single dimensional layer"""
-        return len(layer.squeeze().shape[1:]) == 1
+        # The batch dimension is kept, as it may be of size 1 (e.g. after a capture transform).
+        return len([dim for dim in layer.shape[1:] if dim != 1]) == 1
 
     def _get_activation_map(self, layer_name):
         """Hooks the layer to capture activation maps for the given layer and return the handler to the hook"""
 
         def hook(model, inp, out):
-            try:
-                observer = self._layer_observers[layer_name]
-                observer.parameters = out.detach()
-            except NameError:
-                raise LayerRegisterException(
-                    layer_name=layer_name
-                )  # Raise an error if the layer fails to register
+            if self.profiler is None:
+                self._on_forward(layer_name, model, out)
+                return
+            with self.profiler.measure("hook", layer_name):
+                self._on_forward(layer_name, model, out)
 
         return hook
 
-    def notify_observers(self):
-        """Updates all the observers being monitored with the new parameters"""
+    def capture_output(self, layer_name, output):
+        """
+        Captures an output of a layer computed outside of its hooks, as if its hook had been called.
+        :param layer_name: (str) name of the layer
+        :param output: Tensor
+        """
+        layer = self._layer_observers[layer_name].layer
+        if self.profiler is None:
+            self._on_forward(layer_name, layer, output)
+            return
+        with self.profiler.measure("hook", layer_name):
+            self._on_forward(layer_name, layer, output)
+
+    def _on_forward(self, layer_name, model, out):
+        """Captures the output of the layer, if the capture is due."""
+        try:
+            if not self.capturing:
+                return
+            observer = self._layer_observers[layer_name]
+            if model is not observer.layer:
+                # The replicas of nn.DataParallel share the hooks of the layer, their captures would
+                # overwrite each other.
+                warnings.warn(ReplicatedLayerWarning(layer_name))
+                return
+            policy = observer.sampling_policy
+            with observer.slot.lock:
+                # Return as early as possible when the capture is not due.
+                if policy is not None and not policy.should_capture(model):
+                    observer.skipped += 1
+                    return
+                observer.captured += 1
+                step = observer.last_step = observer.next_step(self.step)
+            self._capture(layer_name, observer, out, step=step)
+        except NameError:
+            raise LayerRegisterException(
+                layer_name=layer_name
+            )  # Raise an error if the layer fails to register
+
+    def _capture(self, layer_name, observer, tensor, step):
+        """Reduces the captured tensor and publishes it as the new parameters of the observer."""
+        parameters = tensor.detach()
+        if observer.capture_transform is not None:
+            with measure(self.profiler, "transform", layer_name):
+                parameters = observer.capture_transform(parameters)
+        if observer.drift_gate is not None:
+            with measure(self.profiler, "drift", layer_name):
+                drifted = observer.drift_gate.drifted(parameters)
+            if not drifted:
+                with observer.slot.lock:
+                    observer.unchanged += 1
+                return
+        # The transforms selecting the channels of the capture (if any) tell which ones they kept.
+        channels = getattr(observer.capture_transform, "channels", None)
+        capture = observer.slot.publish(parameters, step, channels=channels)
+        if capture is None:
+            return
+        first_capture = observer.single_dim is None
+        observer.single_dim = self._is_layer_single_dim(parameters)
+        if first_capture:
+            self._dispatch_stale = True
+        if self._host_transfer is not None:
+            # The displays get the parameters once the copy to the host has completed.
+            with measure(self.profiler, "host_transfer", layer_name):
+                self._host_transfer.submit(layer_name, capture)
+        with self._dirty_lock:
+            self._dirty[layer_name] = observer
+        observer.retained_bytes = parameters.element_size() * parameters.nelement()
+
+    def _collect_updates(self):
+        """Yields the (observer object, Capture) pairs of the layers that can be displayed."""
 
-        for observer_name, observer in self._layer_observers.items():
-            if observer.parameters is None:
+        if self._dispatch_stale:
+            # Cleared first, so that a layer captured for the first time meanwhile isn't missed.
+            self._dispatch_stale = False
+            # Layers may be added or removed by other threads while the list is rebuilt.
+            self._dispatch = [
+                (observer_name, observer)
+                for observer_name, observer in list(self._layer_observers.items())
+                if observer.single_dim is not None
+            ]
+        with self._dirty_lock:
+            dirty, self._dirty = (self._dirty, dict())
+        if self.skip_unchanged:
+            # Only the layers captured since the last notification, the others are unchanged.
+            self.skipped_redraws += max(len(self._dispatch) - len(dirty), 0)
+            updates = list(dirty.items())
+        else:
+            # The layers of the dispatch list have all published a capture.
+            updates = self._dispatch
+        for observer_name, observer in updates:
+            if self._host_transfer is not None:
+                # The capture copied to the host, which may lag behind the latest capture.
+                capture = self._host_transfer.completed(observer_name)
+                if capture is None or capture.generation != observer.slot.latest().generation:
+                    # Notify the layer again once the copy of its latest capture has completed.
+                    with self._dirty_lock:
+                        self._dirty.setdefault(observer_name, observer)
+                if capture is None:
+                    continue
+            else:
+                capture = observer.slot.latest()
+            # The drift gates only publish the captures which have drifted, don't redraw the others.
+            if (self.skip_unchanged or observer.drift_gate is not None) and (
+                capture.generation == observer.notified_generation
+            ):
+                self.skipped_redraws += 1
                 continue
-            if self._is_layer_single_dim(observer.parameters):
+            observer.notified_generation = capture.generation
+            if observer.requires_feature_maps and observer.single_dim:
                 # If layer is a single dimensional layer, then raise a warning as an image needs
                 # to be at least of two dimensions in order to be plotted on a graph.
                 warnings.warn(SingleDimensionalLayerWarning(observer_name))
                 continue
-            # Retrieve the new parameters for an observer and
-            # update the observers object with the new parameters.
-            parameters = observer.parameters
-            observer.object.update(parameters)
+            yield observer.object, capture
+
+    def notify_observers(self):
+        """
+        Updates all the observers being monitored with the new parameters
+        :return: (int) number of observers which weren't updated as their layer was unchanged
+        """
+        skipped_redraws = self.skipped_redraws
+
+        # Retrieve the new parameters for an observer and
+        # update the observers object with the new parameters.
+        if self.profiler is None:
+            for observer_object, capture in self._collect_updates():
+                observer_object.update(
+                    capture.parameters, step=capture.step, channels=capture.channels
+                )
+            return self.skipped_redraws - skipped_redraws
+        with self.profiler.measure("notify"):
+            for observer_object, capture in self._collect_updates():
+                with self.profiler.measure("update", observer_object.get_layer_name()):
+                    observer_object.update(
+                        capture.parameters, step=capture.step, channels=capture.channels
+                    )
+        return self.skipped_redraws - skipped_redraws
+
+    def snapshot_observers(self):
+        """
+        Takes a snapshot of the captured parameters so that they can be displayed later,
+        e.g. by a background renderer, while the model keeps training.
+        :return: list of (observer object, Capture) tuples
+        """
+        # Clone the activations, as in-place layers (e.g. ReLU(inplace=True)) or the next
+        # forward pass may overwrite the captured tensor before it gets rendered.
+        return [
+            (obj, capture._replace(parameters=capture.parameters.clone()))
+            for obj, capture in self._collect_updates()
+        ]
+
+    def get_capture_counts(self):
+        """
+        Returns the number of forward passes captured and skipped by the sampling policy of each layer.
+        :return: dict of layer name -> {"captured": int, "skipped": int}
+        """
+        return {
+            layer_name: {"captured": observer.captured, "skipped": observer.skipped}
+            for layer_name, observer in self._layer_observers.items()
+        }
+
+    def get_unchanged_counts(self):
+        """
+        Returns the number of captures held back by the drift gate of each layer.
+        :return: dict of layer name -> int
+        """
+        return {
+            layer_name: observer.unchanged for layer_name, observer in self._layer_observers.items()
+        }
+
+    def get_retained_bytes(self):
+        """
+        Returns the number of bytes retained by the last capture of each layer.
+        :return: dict of layer name -> int
+        """
+        return {
+            layer_name: observer.retained_bytes
+            for layer_name, observer in self._layer_observers.items()
+        }
+
+    def is_monitored(self, layer):
+        """Checks if the pyTorch layer is already being monitored."""
+        return id(layer) in self._monitored_layers
+
+    def get_monitored_name(self, layer):
+        """Returns the name the pyTorch layer is monitored under, or None if it isn't monitored."""
+        return self._monitored_layers.get(id(layer))
 
     def get_registered_observers(self):
         """Returns the list of observers being monitored."""
         return self._layer_observers
+
+
+class FeatureMapGradientMonitor(FeatureMapMonitor):
+    """
+    A monitor type class for visualizing the gradients flowing back through the layers of a network,
+    i.e. the gradients with respect to the outputs of the layers, captured by full backward hooks.
+
+    When a forward monitor is given, the gradient of a layer is only captured on the steps on which its
+    forward output was captured, so that both captures share the same step id and can be paired.
+    Note that a full backward hook doesn't allow the outputs of the layer to be modified in-place
+    (e.g. by a following ReLU(inplace=True)).
+    """
+
+    def __init__(self, forward_monitor=None, **kwargs):
+        """
+        :param forward_monitor: FeatureMapMonitor whose captures the gradients are paired with
+        :param kwargs: sampling policy, capture transform and host transfer options of the monitor
+        """
+        super(FeatureMapGradientMonitor, self).__init__(**kwargs)
+        self._forward_monitor = forward_monitor
+
+    def _register_hook(self, layer, layer_name):
+        """Registers a full backward hook on the layer and returns its handler."""
+        return layer.register_full_backward_hook(self._get_gradient_map(layer_name, layer))
+
+    def _get_forward_observer(self, layer):
+        """Returns the hook object of the layer in the forward monitor, if it is monitored there."""
+        if self._forward_monitor is None:
+            return None
+        forward_layer_name = self._forward_monitor._monitored_layers.get(id(layer))
+        return self._forward_monitor._layer_observers.get(forward_layer_name)
+
+    def _get_gradient_map(self, layer_name, layer):
+        """Hooks the layer to capture the gradients of its outputs during the backward pass"""
+
+        def hook(model, grad_input, grad_output):
+            if self.profiler is None:
+                self._on_backward(layer_name, layer, model, grad_output)
+                return
+            with self.profiler.measure("hook", layer_name):
+                self._on_backward(layer_name, layer, model, grad_output)
+
+        return hook
+
+    def _on_backward(self, layer_name, layer, model, grad_output):
+        """Captures the gradient of the output of the layer, if the capture is due."""
+        if not self.capturing:
+            return
+        if model is not layer:
+            warnings.warn(ReplicatedLayerWarning(layer_name))
+            return
+        observer = self._layer_observers[layer_name]
+        forward_observer = self._get_forward_observer(layer)
+        if forward_observer is not None:
+            # Only capture the gradient if the matching forward pass was captured, even if the drift
+            # gate of the layer held the activations back.
+            step = self._forward_monitor.step
+            if step is None:
+                step = forward_observer.pass_step()
+            due = forward_observer.last_step == step
+        else:
+            step = self.step
+            due = True
+
+        policy = observer.sampling_policy
+        with observer.slot.lock:
+            if (
+                not due
+                or grad_output[0] is None
+                or (policy is not None and not policy.should_capture(model))
+            ):
+                observer.skipped += 1
+                return
+            observer.captured += 1
+            step = observer.last_step = observer.next_step(step)
+        self._capture(layer_name, observer, grad_output[0], step=step)
+
+    def get_paired_captures(self, layer_name):
+        """
+        Returns the forward and gradient captures of a layer if they belong to the same step.
+        :param layer_name: (str) name of the layer in the gradient monitor
+        :return: (step, activations, gradients) or None
+        """
+        observer = self._layer_observers[layer_name]
+        forward_observer = self._get_forward_observer(observer.layer)
+        if forward_observer is None:
+            return None
+        # Read each slot once, so that the step and the parameters belong to the same capture.
+        forward_capture, capture = (forward_observer.slot.latest(), observer.slot.latest())
+        if capture is None or forward_capture is None or forward_capture.step != capture.step:
+            return None
+        return capture.step, forward_capture.parameters, capture.parameters
@@ -1,6 +1,17 @@
+import copy
+import fnmatch
+import functools
+from contextlib import contextmanager
+
 import torch.nn as nn
-from .monitor import FeatureMapMonitor
+from .distributed import DistributedGatherer, MERGE_CAT, MERGE_MEAN, MERGE_STATISTICS
+from .graph import GraphCapture, traced_layers
+from .monitor import Capture, FeatureMapMonitor, FeatureMapGradientMonitor
 from .observers import FeatureMapObserverFactory
+from .rendering import AsyncRenderer, DROP_OLDEST, PROCESS, ProcessRenderer, default_draw_thread
+from .statistics import ChannelStatistics
+
+GRADIENT_SUFFIX = ".grad"
 
 
 class FeatureMapMonitoring(object):
@@ -9,20 +20,119 @@ class FeatureMapMonitoring(object):
     during training of the model.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        async_render=False,
+        max_queue_size=2,
+        drop_policy=DROP_OLDEST,
+        draw_thread=None,
+        sampling_policy=None,
+        capture_transform=None,
+        host_transfer=False,
+        monitor_gradients=False,
+        distributed=False,
+        capture_ranks=None,
+        destination_rank=0,
+        merge=None,
+        profiler=None,
+        attach_hooks=True,
+        drift_gate=None,
+        skip_unchanged=False,
+    ):
         """
         Initialises:
         1. A observer factory for creating observer for a given layer.
         2. A monitor for displaying the feature maps for the monitored layer.
+        3. Optionally, a monitor for displaying the gradients of the outputs of the monitored layers.
+        4. Optionally, a background renderer so that `start` never blocks the training step.
+        5. Optionally, in a distributed run, a gatherer sending the captures to the rank rendering them.
+
+        :param async_render: (bool) render the feature maps off the training thread
+        :param max_queue_size: (int) number of snapshots that can wait for the renderer
+        :param drop_policy: (str) `drop_oldest` or `drop_newest`, used when the queue is full
+        :param draw_thread: (str) where the snapshots are drawn in async mode: `process`, in a
+            rendering process owning the displays, `background`, on a thread of this process, or
+            `main`, by `start` itself. Defaults to `process` with a GUI backend, whose windows can
+            only be drawn from the main thread of a process, else `background`.
+        :param sampling_policy: SamplingPolicy deciding on which forward passes the layers are captured
+        :param capture_transform: CaptureTransform reducing the activations before they are retained
+        :param host_transfer: (bool) copy the activations to the host asynchronously (pinned memory)
+        :param monitor_gradients: (bool) also monitor the gradients flowing back through the layers,
+            they are captured on the same steps as the feature maps and displayed as `<layer>.grad`
+        :param distributed: (bool) in an initialized `torch.distributed` run, only the capture ranks
+            capture and their captures are gathered to the destination rank, the only one rendering.
+            Every rank must create the monitoring and call `start` the same number of times.
+        :param capture_ranks: iterable of the ranks which capture their layers, defaults to all
+        :param destination_rank: (int) rank which renders the gathered captures
+        :param merge: (str) how the captures of the ranks are merged, `cat` (along the batch),
+            `mean` or `first`. Defaults to `cat` for feature maps and `mean` for reductions
+            (e.g. histograms). The per-channel statistics are combined from the number of values
+            of every rank rather than averaged, unless another mode is given.
+        :param profiler: Profiler recording the latencies of the hooks, reductions, copies,
+            notifications and displays, returned by `stats`. Without it nothing is measured.
+        :param attach_hooks: (bool) hook the layers as soon as they are added. When False, the layers
+            are only hooked within the capture windows (see `capture`), so the other forward passes
+            don't pay for the hooks.
+        :param drift_gate: DriftGate (see `laymon.drift`) publishing the captures of a layer only
+            when they have drifted from the last published one, so that the stable layers are
+            neither redrawn nor recorded again.
+        :param skip_unchanged: (bool) `start` only redraws the layers captured since the previous
+            call, so calling it more often than the layers are captured costs almost nothing.
         """
+        self.profiler = profiler
+        self.gatherer = None
+        self.merge = merge
+        if distributed:
+            self.gatherer = DistributedGatherer(
+                capture_ranks=capture_ranks, destination_rank=destination_rank
+            )
+
         self.observer_factory = FeatureMapObserverFactory()
-        self.monitor = FeatureMapMonitor()
+        self.monitor = FeatureMapMonitor(
+            sampling_policy=sampling_policy,
+            capture_transform=capture_transform,
+            host_transfer=host_transfer,
+            profiler=profiler,
+            attached=attach_hooks,
+            drift_gate=drift_gate,
+            skip_unchanged=skip_unchanged,
+        )
+        self.gradient_monitor = None
+        if monitor_gradients:
+            self.gradient_monitor = FeatureMapGradientMonitor(
+                forward_monitor=self.monitor,
+                capture_transform=capture_transform,
+                host_transfer=host_transfer,
+                profiler=profiler,
+                attached=attach_hooks,
+                drift_gate=drift_gate,
+                skip_unchanged=skip_unchanged,
+            )
+        self.renderer = None
+        if async_render and (draw_thread or default_draw_thread()) == PROCESS:
+            self.renderer = ProcessRenderer(
+                self._get_display,
+                max_queue_size=max_queue_size,
+                drop_policy=drop_policy,
+            )
+        elif async_render:
+            self.renderer = AsyncRenderer(
+                max_queue_size=max_queue_size,
+                drop_policy=drop_policy,
+                on_batch_rendered=lambda: self.observer_factory.refresh(),
+                draw_thread=draw_thread,
+            )
+        if self.gatherer is not None:
+            for monitor in self._monitors():
+                monitor.capturing = self.gatherer.capturing
 
-    def add_layer(self, layer, layer_name):
+    def add_layer(self, layer, layer_name, sampling_policy=None, capture_transform=None):
         """
         Adds the layer whose feature maps are to be monitored.
         :param layer: pyTorch layer
         :param layer_name: (str) name of the layer
+        :param sampling_policy: SamplingPolicy of the layer, overrides the one of the monitor
+        :param capture_transform: CaptureTransform of the layer, overrides the one of the monitor
         :return: the observer object of the layer being monitored
         """
         if not layer_name:
@@ -31,27 +141,84 @@ class FeatureMapMonitoring(object):
         # the layer to be monitored should be a subclass of nn.Module
         if not issubclass(layer.__class__, nn.Module):
             raise ReferenceError("Layer should be a subclass of nn.Module")
-        return self._add_layer(layer=layer, layer_name=layer_name)
+        return self._add_layer(
+            layer=layer,
+            layer_name=layer_name,
+            sampling_policy=sampling_policy,
+            capture_transform=capture_transform,
+        )
 
-    def _add_layer(self, layer, layer_name):
+    def _add_layer(self, layer, layer_name, sampling_policy=None, capture_transform=None):
         """
         Create a observer class of the layer to be monitored and adds it to the list of
         observers being monitored.
         :param layer: pyTorch layer
         :param layer_name: (str) name of the layer
-        :return: Observer object of the layer
+        :param sampling_policy: SamplingPolicy of the layer
+        :param capture_transform: CaptureTransform of the layer
+        :return: Observer object of the layer, the existing one if the layer is already monitored
         """
-        layer_observer = self.observer_factory.create(layer=layer, layer_name=layer_name)
-        self.monitor.add_observer(layer_observer=layer_observer)
+        # Checked before the observer is created, as its display would never be released.
+        monitored_name = self.monitor.get_monitored_name(layer)
+        if monitored_name is not None:
+            return self.monitor.get_registered_observers()[monitored_name].object
+        self._check_layer_name(layer_name)
+        layer_observer = self._create_observer(layer=layer, layer_name=layer_name)
+        self.monitor.add_observer(
+            layer_observer=layer_observer,
+            sampling_policy=sampling_policy,
+            capture_transform=capture_transform,
+        )
+        if self.gradient_monitor is not None:
+            gradient_layer_name = layer_name + GRADIENT_SUFFIX
+            gradient_observer = self._create_observer(layer=layer, layer_name=gradient_layer_name)
+            # The gradients keep their own transform state, e.g. their own selected channels.
+            self.gradient_monitor.add_observer(
+                layer_observer=gradient_observer, capture_transform=copy.deepcopy(capture_transform)
+            )
         return layer_observer
 
+    def _check_layer_name(self, layer_name):
+        """Raises an error if another layer is already monitored under the name."""
+        if layer_name in self.monitor.get_registered_observers():
+            raise NameError(f"Another layer is already monitored as {layer_name}.")
+
+    def _get_display(self):
+        """Returns the display class and options of the layers, created by the rendering process."""
+        return self.observer_factory.display_object, self.observer_factory.display_options
+
+    def _create_observer(self, layer, layer_name):
+        """
+        Creates the observer of a layer, without a display on the ranks which don't render or when
+        the displays belong to the rendering process.
+        """
+        if self.profiler is not None:
+            self.observer_factory.profiler = self.profiler
+        if isinstance(self.renderer, ProcessRenderer) or (
+            self.gatherer is not None and not self.gatherer.rendering
+        ):
+            return self.observer_factory.create(layer=layer, layer_name=layer_name, headless=True)
+        return self.observer_factory.create(layer=layer, layer_name=layer_name)
+
     def _remove_layer(self, layer_name):
         """
         Removes an observer from the list of observers being monitored.
         :param layer_name: name of the observer
         :return: True if observer was deleted, else False
         """
-        self.monitor.remove_observer(layer_name=layer_name)
+        removed = self.monitor.remove_observer(layer_name=layer_name)
+        if removed:
+            self._release(layer_name)
+        if self.gradient_monitor is not None:
+            if self.gradient_monitor.remove_observer(layer_name=layer_name + GRADIENT_SUFFIX):
+                self._release(layer_name + GRADIENT_SUFFIX)
+        return removed
+
+    def _release(self, layer_name):
+        """Closes the display of a layer which is not monitored anymore."""
+        self.observer_factory.release(layer_name)
+        if self.renderer is not None:
+            self.renderer.remove(layer_name)
 
     def remove_layer(self, layer_name):
         """
@@ -61,17 +228,319 @@ class FeatureMapMonitoring(object):
         """
         return self._remove_layer(layer_name=layer_name)
 
-    def add_model(self, model):
+    @staticmethod
+    def _matches(layer_name, patterns):
+        """Checks if the layer name matches any of the glob patterns or compiled regular expressions."""
+        if isinstance(patterns, str) or hasattr(patterns, "search"):
+            patterns = [patterns]
+        for pattern in patterns:
+            if hasattr(pattern, "search"):
+                if pattern.search(layer_name):
+                    return True
+            elif fnmatch.fnmatchcase(layer_name, pattern):
+                return True
+        return False
+
+    @staticmethod
+    def _output_layer_name(layer_name, layer):
+        """
+        Returns the name of the nested layer producing the output of a sequential container,
+        i.e. of its last child (recursively for nested sequential containers).
+        """
+        while isinstance(layer, nn.Sequential) and len(layer):
+            child_name, layer = list(layer.named_children())[-1]
+            layer_name = f"{layer_name}.{child_name}"
+        return layer_name
+
+    def _select_layers(self, model, recursive, include, exclude, layer_types, max_depth):
+        """Returns the (name, layer) pairs of the model which pass the filters, in model order."""
+        named_layers = model.named_modules() if recursive else model.named_children()
+        selected = []
+        for layer_name, layer in named_layers:
+            if not layer_name:
+                continue  # The model itself.
+            if max_depth is not None and layer_name.count(".") >= max_depth:
+                continue
+            if recursive and isinstance(layer, (nn.ModuleList, nn.ModuleDict)):
+                continue  # Containers without a forward method are never called.
+            if layer_types is not None and not isinstance(layer, layer_types):
+                continue
+            if include is not None and not self._matches(layer_name, include):
+                continue
+            if exclude is not None and self._matches(layer_name, exclude):
+                continue
+            selected.append((layer_name, layer))
+
+        if not recursive:
+            return selected
+
+        # A sequential container outputs the output of its last child, if that child is monitored
+        # as well the hook on the container would only capture the same tensor again.
+        selected_names = set(layer_name for layer_name, _ in selected)
+        layers = []
+        for layer_name, layer in selected:
+            output_layer_name = self._output_layer_name(layer_name, layer)
+            if output_layer_name == layer_name or output_layer_name not in selected_names:
+                layers.append((layer_name, layer))
+        return layers
+
+    def add_model(
+        self, model, recursive=False, include=None, exclude=None, layer_types=None, max_depth=None
+    ):
         """
         Registers all the layers a pyTorch model whose activations maps are to monitored.
-        :param model:
-        :return:
+        :param model: pyTorch model
+        :param recursive: (bool) register the nested layers as well, instead of only the children
+        :param include: glob pattern(s) or compiled regular expression(s), only the layers whose
+            names match are registered
+        :param exclude: glob pattern(s) or compiled regular expression(s) of the layers to skip
+        :param layer_types: layer class or tuple of classes to register, e.g. nn.Conv2d
+        :param max_depth: (int) maximum nesting depth of the registered layers, 1 being the children
+        :return: list of the names of the layers registered
         """
         if not isinstance(model, nn.Module):
             raise AttributeError("Model should be an instance of nn.Module")
-        for layer_name, layer in model.named_children():
+
+        layer_names = []
+        for layer_name, layer in self._select_layers(
+            model, recursive, include, exclude, layer_types, max_depth
+        ):
+            if self.monitor.is_monitored(layer):
+                continue
             self.add_layer(layer=layer, layer_name=layer_name)
+            layer_names.append(layer_name)
+        return layer_names
+
+    def add_graph_model(
+        self,
+        model,
+        include=None,
+        exclude=None,
+        layer_types=None,
+        reductions=None,
+        compile_options=None,
+    ):
+        """
+        Registers the layers of a model without hooking them: the model is traced with `torch.fx` and
+        its graph is rewritten to return the outputs of the layers as extra outputs, so that it can be
+        compiled with `torch.compile` without any graph break. The gradients are not monitored.
+        :param model: pyTorch model, traceable by `torch.fx.symbolic_trace`
+        :param include: glob pattern(s) or compiled regular expression(s) of the layers to register
+        :param exclude: glob pattern(s) or compiled regular expression(s) of the layers to skip
+        :param layer_types: layer class or tuple of classes to register, e.g. nn.Conv2d
+        :param reductions: callable, or dict of layer name -> callable, reducing the outputs of the
+            layers within the graph (the capture transforms run outside of the graph)
+        :param compile_options: dict of keyword arguments of `torch.compile`, e.g. {} to compile the
+            rewritten graph with the default options. It isn't compiled when None.
+        :return: module to call instead of the model, returning the same outputs
+        """
+        if not isinstance(model, nn.Module):
+            raise AttributeError("Model should be an instance of nn.Module")
+
+        layer_names = []
+        for layer_name, layer in traced_layers(model):
+            if layer_types is not None and not isinstance(layer, layer_types):
+                continue
+            if include is not None and not self._matches(layer_name, include):
+                continue
+            if exclude is not None and self._matches(layer_name, exclude):
+                continue
+            if self.monitor.is_monitored(layer):
+                continue
+            self._check_layer_name(layer_name)
+            layer_observer = self._create_observer(layer=layer, layer_name=layer_name)
+            self.monitor.add_observer(layer_observer=layer_observer, hooked=False)
+            layer_names.append(layer_name)
+        return GraphCapture(
+            model,
+            self.monitor,
+            layer_names,
+            reductions=reductions,
+            compile_options=compile_options,
+        )
+
+    def _monitors(self):
+        """Returns the forward monitor, and the gradient monitor if any."""
+        if self.gradient_monitor is None:
+            return [self.monitor]
+        return [self.monitor, self.gradient_monitor]
+
+    def _render(self, updates):
+        """Renders a list of (observer object, Capture) pairs, in the background in async mode."""
+        if self.renderer is not None:
+            if updates:
+                self.renderer.submit(updates)
+            self.renderer.drain()
+            return
+        for observer_object, capture in updates:
+            observer_object.update(capture.parameters, step=capture.step, channels=capture.channels)
+        self.observer_factory.refresh()
+
+    def _render_gathered(self):
+        """Renders the latest captures gathered from the ranks, on the destination rank."""
+        gathered = self.gatherer.completed()
+        if not self.gatherer.rendering or not gathered:
+            return
+        hook_objects = dict()
+        for monitor in self._monitors():
+            hook_objects.update(monitor.get_registered_observers())
+        self._render(
+            [
+                # Only the parameters of the captures are gathered from the ranks.
+                (hook_objects[layer_name].object, Capture(parameters, None, None, None))
+                for layer_name, parameters in gathered[-1].items()
+                if layer_name in hook_objects
+            ]
+        )
+
+    def _start_distributed(self, monitors):
+        """Sends the captures of this rank to the destination rank, and renders the gathered ones."""
+        snapshot = dict()
+        for monitor in monitors:
+            hook_objects = monitor.get_registered_observers()
+            for observer_object, capture in monitor.snapshot_observers():
+                layer_name = observer_object.get_layer_name()
+                merge, count = (self.merge, None)
+                transform = hook_objects[layer_name].capture_transform
+                if isinstance(transform, ChannelStatistics) and merge in (None, MERGE_MEAN):
+                    # The statistics of the ranks are combined from their counts, not averaged.
+                    merge, count = (MERGE_STATISTICS, transform.size)
+                elif merge is None:
+                    merge = MERGE_CAT if observer_object.requires_feature_maps else MERGE_MEAN
+                snapshot[layer_name] = (merge, capture.parameters, count)
+        self.gatherer.submit(snapshot)
+        self._render_gathered()
 
     def start(self):
-        """Starts monitoring the feature maps of the registered layers/model."""
-        self.monitor.notify_observers()
+        """
+        Starts monitoring the feature maps of the registered layers/model.
+        In async mode the captured activations are snapshotted and handed over to the
+        background renderer, so the call returns without waiting for the figures to be drawn.
+        In distributed mode the captures are sent to the destination rank, which renders the
+        captures gathered so far, i.e. usually the ones of the previous steps.
+        :return: (int) number of layers which weren't redrawn as they were unchanged
+        """
+        monitors = self._monitors()
+        skipped_redraws = sum(monitor.skipped_redraws for monitor in monitors)
+        if self.gatherer is not None:
+            self._start_distributed(monitors)
+        elif self.renderer is None:
+            for monitor in monitors:
+                monitor.notify_observers()
+            self.observer_factory.refresh()
+        else:
+            snapshot = [update for monitor in monitors for update in monitor.snapshot_observers()]
+            if snapshot:
+                self.renderer.submit(snapshot)
+            self.renderer.drain()
+        if self.profiler is not None:
+            self.profiler.maybe_log()
+        return sum(monitor.skipped_redraws for monitor in monitors) - skipped_redraws
+
+    def stats(self):
+        """
+        Returns the statistics of the monitoring of every layer: the number of captured and skipped
+        passes, of the captures held back by the drift gate, the bytes retained by the last capture
+        and, when profiled, the latency summaries of the sections of the layer (see
+        `laymon.profiling.Profiler`).
+        :return: dict with the per layer statistics under `layers`, and the latencies of the sections
+            which are not specific to a layer (e.g. `notify`) under `latency`
+        """
+        latencies = self.profiler.summary() if self.profiler is not None else dict()
+        layers = dict()
+        for monitor in self._monitors():
+            retained_bytes = monitor.get_retained_bytes()
+            unchanged = monitor.get_unchanged_counts()
+            for layer_name, counts in monitor.get_capture_counts().items():
+                layers[layer_name] = {
+                    "captured": counts["captured"],
+                    "skipped": counts["skipped"],
+                    "unchanged": unchanged[layer_name],
+                    "retained_bytes": retained_bytes[layer_name],
+                    "latency": latencies.get(layer_name, dict()),
+                }
+        return {"layers": layers, "latency": latencies.get(None, dict())}
+
+    @contextmanager
+    def capture(self, step=None, render=True):
+        """
+        A capture window: the layers are hooked on entry and unhooked on exit (unless they were
+        already hooked), then the captures are rendered with `start`.
+
+            with monitoring.capture(step):
+                loss = criterion(net(inputs), labels)
+                loss.backward()
+
+        :param step: (int) step id of the captures of the window, e.g. the global training step.
+            The step ids should increase from one window to the next. Defaults to the number of
+            forward passes of the layers, which continues from the last explicit step id.
+        :param render: (bool) call `start` when the window is closed
+        """
+        monitors = self._monitors()
+        attached = [monitor.attached for monitor in monitors]
+        for monitor in monitors:
+            monitor.step = step
+            monitor.attach_all()
+        try:
+            yield self
+        finally:
+            for monitor, was_attached in zip(monitors, attached):
+                monitor.step = None
+                if not was_attached:
+                    monitor.detach_all()
+        if render:
+            self.start()
+
+    def capture_every(self, every, render=True):
+        """
+        A decorator running one call out of `every` calls of a function (e.g. a training step)
+        in a capture window, the other calls run without any hook.
+
+            @monitoring.capture_every(1000)
+            def train_step(inputs, labels):
+                ...
+
+        :param every: (int) number of calls between two captures, the first call is captured
+        :param render: (bool) call `start` after every captured call
+        """
+
+        def decorator(function):
+            calls = [0]
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                step = calls[0]
+                calls[0] += 1
+                if step % every:
+                    return function(*args, **kwargs)
+                with self.capture(step=step, render=render):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def flush(self, timeout=None):
+        """
+        Waits until the background renderer has drawn every pending snapshot, and raises the last
+        error raised while drawing them.
+        In distributed mode, waits until the pending captures have been gathered and renders them.
+        """
+        if self.gatherer is not None:
+            if not self.gatherer.flush(timeout=timeout):
+                return False
+            self._render_gathered()
+        if self.renderer is None:
+            return True
+        return self.renderer.flush(timeout=timeout)
+
+    def close(self):
+        """Renders the pending snapshots, stops the background renderer and closes the displays."""
+        if self.gatherer is not None:
+            self.gatherer.close()
+            self._render_gathered()
+            self.gatherer = None
+        if self.renderer is not None:
+            self.renderer.close()
+            self.renderer = None
+        self.observer_factory.close()
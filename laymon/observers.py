@@ -1,5 +1,12 @@
 from .interfaces import Observer, ObserverFactory
-from .displays import FeatureMapDisplay
+from .displays import FeatureMapDisplay, FeatureMapGridDisplay, FeatureMapDashboard
+from .displays import HistogramDisplay, StatsDisplay
+from .sampling import EveryNCalls
+from .statistics import ActivationHistogram, ChannelStatistics
+
+
+def _ignore_update(parameters, display_title):
+    """Update function of the observers without a display."""
 
 
 class FeatureMapObserver(Observer):
@@ -22,19 +29,29 @@ class FeatureMapObserver(Observer):
         if not callable(update_display):
             raise TypeError("update display method should be callable.")
         self._update_display = update_display
+        # Whether the display is given the step (e.g. to record them) and channels of the captures.
+        display = getattr(update_display, "__self__", None)
+        self._display_accepts_step = getattr(display, "accepts_step", False)
+        self._display_accepts_channels = getattr(display, "accepts_channels", False)
 
         # Sets the description of the observer object.
         self._description = f"Observer -> {self._layer_name}"
 
-    def update(self, parameters):
+    def update(self, parameters, step=None, channels=None):
         """
         Update the display attached to the observer with the new parameters/activations.
         :param parameters: Tensor
+        :param step: (int) step of the capture of the parameters, if known
+        :param channels: Tensor of the indices of the channels of the parameters, if selected
         :return: None
         """
+        capture = dict()
+        if self._display_accepts_step:
+            capture["step"] = step
+        if self._display_accepts_channels:
+            capture["channels"] = channels
         # Update the display of the observer with the new parameters.
-
-        self._update_display(parameters=parameters, display_title=self._layer_name)
+        self._update_display(parameters=parameters, display_title=self._layer_name, **capture)
 
     def get_layer_name(self):
         """Returns the layer name being observed."""
@@ -45,19 +62,157 @@ class FeatureMapObserver(Observer):
         return self._layer
 
 
+class FeatureMapStatsObserver(FeatureMapObserver):
+    """
+    An observer which monitors per-channel statistics of the outputs of a layer instead of its feature
+    maps. The statistics are computed on the device by the observer's capture transform.
+    """
+
+    requires_feature_maps = False
+
+    def __init__(self, layer, layer_name, update_display, every=1):
+        """
+        :param every: (int) compute the statistics once every `every` forward passes of the layer,
+            which divides their overhead on the training loop by as much
+        """
+        super(FeatureMapStatsObserver, self).__init__(layer, layer_name, update_display)
+        self._statistics = ChannelStatistics()
+        self._every = every
+        self._description = f"Stats Observer -> {self._layer_name}"
+
+    def get_capture_transform(self):
+        """Returns the transform reducing the outputs of the layer to statistics."""
+        return self._statistics
+
+    def get_sampling_policy(self):
+        """Returns the policy capturing one forward pass out of `every`, None for every pass."""
+        return EveryNCalls(self._every) if self._every > 1 else None
+
+    def get_running_statistics(self):
+        """Returns the per-channel aggregates over all the captures of the layer."""
+        return self._statistics.running()
+
+
+class FeatureMapHistogramObserver(FeatureMapObserver):
+    """
+    An observer which monitors the histogram of the outputs of a layer over the last steps.
+    The histograms are computed on the device by the observer's capture transform.
+    """
+
+    requires_feature_maps = False
+
+    def __init__(
+        self,
+        layer,
+        layer_name,
+        update_display,
+        bins=64,
+        value_range=(-10.0, 10.0),
+        history=256,
+        log_scale=False,
+    ):
+        """
+        :param bins: (int) number of bins of the histograms
+        :param value_range: (tuple) lower and upper edges of the bins
+        :param history: (int) number of steps kept in the history
+        :param log_scale: (bool) use logarithmic buckets
+        """
+        super(FeatureMapHistogramObserver, self).__init__(layer, layer_name, update_display)
+        self._histogram = ActivationHistogram(
+            bins=bins, value_range=value_range, history=history, log_scale=log_scale
+        )
+        self._description = f"Histogram Observer -> {self._layer_name}"
+
+    def get_capture_transform(self):
+        """Returns the transform reducing the outputs of the layer to histograms."""
+        return self._histogram
+
+
 class FeatureMapObserverFactory(ObserverFactory):
     """A factory type class to create a FeatureMapObserver for the given layer"""
 
     display_object = FeatureMapDisplay
+    observer_object = FeatureMapObserver
+    observer_options = None  # Keyword arguments of the observer class, copied per factory.
+    profiler = None  # Profiler set on the displays, if the monitoring is profiled.
+
+    def __init__(self):
+        # The options of the class are copied, so that changing them doesn't affect other factories.
+        self.display_options = dict(self.display_options or {})
+        self.observer_options = dict(self.observer_options or {})
+        self._displays = dict()  # Maintains a mapping of layer names to their displays.
+        self._shared_display = None  # Display shared by all the layers, if the display is shared.
+
+    def _get_display(self):
+        """Creates a display, or returns the shared one if the display class is shared."""
+        if not getattr(self.display_object, "shared", False):
+            return self._new_display()
+        if self._shared_display is None:
+            self._shared_display = self._new_display()
+        return self._shared_display
+
+    def _new_display(self):
+        display = self.display_object(**self.display_options)
+        if self.profiler is not None:
+            display.profiler = self.profiler
+        return display
 
-    def create(self, layer, layer_name):
+    def create(self, layer, layer_name, headless=False):
         """
         Create a FeatureMapObserver for the given layer and attaches the display function
         for the layer being monitored.
         :param layer:
         :param layer_name:
+        :param headless: (bool) don't create a display, e.g. on the ranks of a distributed run
+            which don't render, the updates of the observer are then ignored
         :return:
         """
-        return FeatureMapObserver(
-            layer=layer, layer_name=layer_name, update_display=self.display_object().update_display
+        if headless:
+            update_display = _ignore_update
+        else:
+            display = self._get_display()
+            self._displays[layer_name] = display
+            update_display = display.update_display
+        return self.observer_object(
+            layer=layer,
+            layer_name=layer_name,
+            update_display=update_display,
+            **self.observer_options,
         )
+
+    def refresh(self):
+        """Redraws the shared display (if any) once all the observers have been updated."""
+        if self._shared_display is not None:
+            self._shared_display.refresh()
+
+    def release(self, layer_name):
+        """Closes the display of a layer which is not monitored anymore."""
+        display = self._displays.pop(layer_name, None)
+        if display is None:
+            return
+        if display is self._shared_display:
+            display.remove(layer_name)
+        elif hasattr(display, "close"):
+            display.close()
+
+    def close(self):
+        """Closes the displays of all the layers."""
+        for layer_name in list(self._displays):
+            self.release(layer_name)
+        if self._shared_display is not None:
+            self._shared_display.close()
+            self._shared_display = None
+
+
+class FeatureMapStatsObserverFactory(FeatureMapObserverFactory):
+    """A factory type class to create a FeatureMapStatsObserver for the given layer"""
+
+    display_object = StatsDisplay
+    observer_object = FeatureMapStatsObserver
+
+
+class FeatureMapHistogramObserverFactory(FeatureMapObserverFactory):
+    """A factory type class to create a FeatureMapHistogramObserver for the given layer"""
+
+    display_object = HistogramDisplay
+    observer_object = FeatureMapHistogramObserver
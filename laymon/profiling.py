@@ -0,0 +1,159 @@
+"""
+===========================================
+Profiling of the monitoring overhead
+===========================================
+
+Measures the time spent by laymon itself (hooks, reductions, copies to the host, notifications and
+drawing), per layer, so that its overhead on the training can be told apart from the training itself.
+When no profiler is given to the monitoring, the instrumented code paths only check that the
+profiler is None.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Upper edges of the latency buckets, in seconds: powers of 2 from 1 microsecond to ~17 seconds.
+BUCKET_EDGES = tuple(1e-6 * 2**exponent for exponent in range(25))
+
+
+class LatencyHistogram(object):
+    """A histogram of latencies over logarithmic buckets, with a constant memory usage."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_EDGES) + 1)  # The last bucket counts the slower calls.
+        self.count, self.total, self.max = (0, 0.0, 0.0)
+
+    def record(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKET_EDGES, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        Returns an upper bound of the q-th quantile, i.e. the upper edge of the bucket containing it.
+        :param q: (float) between 0 and 1
+        """
+        rank = q * self.count
+        seen = 0
+        for edge, count in zip(BUCKET_EDGES, self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(edge, self.max)
+        return self.max
+
+    def summary(self):
+        """Returns the count, total, mean, max and the 50th/90th/99th percentiles, in seconds."""
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Profiler(object):
+    """
+    Records the latencies of the sections of the monitoring, per layer.
+
+    The sections are:
+        * `hook`: a forward or backward hook, including the two sections below
+        * `transform`: the capture transform (reductions, quantization...) of a capture
+        * `host_transfer`: the start of the copy of a capture to the host
+        * `drift`: the comparison of a capture with the reference of its drift gate
+        * `notify`: the notification of all the observers of a monitor, and `update` per layer
+        * `display_params` and `draw`: the update of the artists and the redraw of a display
+    """
+
+    def __init__(self, record_functions=False, synchronize=False, log_interval=None):
+        """
+        :param record_functions: (bool) also mark the sections with `torch.profiler.record_function`
+            ranges, so that they show up in the traces of the pyTorch profiler
+        :param synchronize: (bool) wait for the CUDA kernels of a section before stopping its clock,
+            otherwise the asynchronous kernels are only measured as launched
+        :param log_interval: (float) number of seconds between two summaries logged by `maybe_log`
+        """
+        self.record_functions = record_functions
+        self.synchronize = synchronize and torch.cuda.is_available()
+        self.log_interval = log_interval
+        self._histograms = defaultdict(LatencyHistogram)  # (layer name, section) -> histogram
+        self._lock = threading.Lock()  # The hooks may run on several threads.
+        self._last_log = time.perf_counter()
+
+    def record(self, section, layer_name, seconds):
+        """Records the latency of a section, `layer_name` is None for the sections of all the layers."""
+        with self._lock:
+            self._histograms[(layer_name, section)].record(seconds)
+
+    @contextmanager
+    def measure(self, section, layer_name=None):
+        """Measures the latency of the code run in the context."""
+        if self.record_functions:
+            name = f"laymon.{section}" if layer_name is None else f"laymon.{section}.{layer_name}"
+            record_function = torch.profiler.record_function(name)
+        else:
+            record_function = nullcontext()
+        with record_function:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                if self.synchronize:
+                    torch.cuda.synchronize()
+                self.record(section, layer_name, time.perf_counter() - start)
+
+    def summary(self):
+        """
+        Returns the latency summaries of the sections.
+        :return: dict of layer name (None for the sections of all the layers) -> section -> summary
+        """
+        with self._lock:
+            summaries = defaultdict(dict)
+            for (layer_name, section), histogram in self._histograms.items():
+                summaries[layer_name][section] = histogram.summary()
+        return dict(summaries)
+
+    def reset(self):
+        """Forgets the latencies recorded so far."""
+        with self._lock:
+            self._histograms.clear()
+
+    def maybe_log(self):
+        """Logs a summary of the total time spent per section if the log interval has elapsed."""
+        if self.log_interval is None:
+            return
+        now = time.perf_counter()
+        if now - self._last_log < self.log_interval:
+            return
+        self._last_log = now
+
+        totals = defaultdict(lambda: [0, 0.0])
+        with self._lock:
+            for (_, section), histogram in self._histograms.items():
+                totals[section][0] += histogram.count
+                totals[section][1] += histogram.total
+        logger.info(
+            "laymon overhead: %s",
+            ", ".join(
+                f"{section} {count} calls {total * 1e3:.2f} ms"
+                for section, (count, total) in sorted(totals.items())
+            ),
+        )
+
+
+def measure(profiler, section, layer_name=None):
+    """Returns the measuring context of a section, or a no-op context when the profiler is None."""
+    if profiler is None:
+        return nullcontext()
+    return profiler.measure(section, layer_name)
@@ -0,0 +1,401 @@
+"""
+===========================================
+Headless recording of the feature maps
+===========================================
+
+A recording is a directory with a sub-directory per layer. Every layer directory holds an
+`index.json` file and a sequence of fixed-size segments, each made of two `.npy` files:
+    * `segment_00000.npy`: the frames, of shape (chunk_size, *frame_shape)
+    * `segment_00000.steps.npy`: the step of every frame, of shape (chunk_size,)
+The index records the shape, dtype and number of valid rows of every segment, so that
+any (layer, step) frame can be read by memory-mapping its segment.
+
+With the `delta` encoding, only the keyframes are stored in the segments. The other frames are
+stored as the sparse difference with their keyframe, in compressed files written at every flush and
+listed in the index:
+    * `deltas_00000.npz`: the `steps` of the frames and the `references` steps of their keyframes,
+      and the flat `indices` and float16 `values` of their differences, frame `i` being made of the
+      entries `offsets[i]:offsets[i + 1]`
+"""
+
+import copy
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from .drift import DriftGate
+from .interfaces import Display
+from .transforms import quantize
+
+INDEX_FILE = "index.json"
+SEGMENT_FILE = "segment_{:05d}.npy"
+STEPS_FILE = "segment_{:05d}.steps.npy"
+DELTAS_FILE = "deltas_{:05d}.npz"
+
+RAW_ENCODING = "raw"
+DELTA_ENCODING = "delta"
+
+
+def _layer_directory(path, layer_name):
+    return os.path.join(path, layer_name.replace(os.sep, "_"))
+
+
+class _LayerWriter(object):
+    """Appends the frames of a single layer to memory-mapped, preallocated segments."""
+
+    def __init__(self, path, layer_name, chunk_size, encoding=RAW_ENCODING):
+        self.directory = _layer_directory(path, layer_name)
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = {
+            "layer": layer_name,
+            "chunk_size": chunk_size,
+            "encoding": encoding,
+            "segments": [],
+        }
+        if encoding == DELTA_ENCODING:
+            self.index["deltas"] = []
+        self._chunk_size = chunk_size
+        # memory maps of the segment being written
+        self._frames, self._steps = (None, None)
+
+    def _open_segment(self, frame):
+        """Preallocates a new segment, which stays mapped until it is full."""
+        number = len(self.index["segments"])
+        segment = {
+            "file": SEGMENT_FILE.format(number),
+            "steps": STEPS_FILE.format(number),
+            "shape": list(frame.shape),
+            "dtype": frame.dtype.str,
+            "count": 0,
+        }
+        self._frames = np.lib.format.open_memmap(
+            os.path.join(self.directory, segment["file"]),
+            mode="w+",
+            dtype=frame.dtype,
+            shape=(self._chunk_size,) + frame.shape,
+        )
+        self._steps = np.lib.format.open_memmap(
+            os.path.join(self.directory, segment["steps"]),
+            mode="w+",
+            dtype=np.int64,
+            shape=(self._chunk_size,),
+        )
+        self.index["segments"].append(segment)
+        return segment
+
+    def write(self, steps, frames):
+        """Writes a batch of frames of the same shape and dtype."""
+        written = 0
+        while written < len(frames):
+            segment = self.index["segments"][-1] if self.index["segments"] else None
+            frame = frames[written]
+            if (
+                segment is None
+                or segment["count"] == self._chunk_size
+                or segment["shape"] != list(frame.shape)
+                or segment["dtype"] != frame.dtype.str
+            ):
+                segment = self._open_segment(frame)
+            rows = min(self._chunk_size - segment["count"], len(frames) - written)
+            begin = segment["count"]
+            self._frames[begin : begin + rows] = frames[written : written + rows]
+            self._steps[begin : begin + rows] = steps[written : written + rows]
+            segment["count"] += rows
+            written += rows
+
+    def write_deltas(self, steps, references, deltas):
+        """
+        Writes a batch of sparse differences to a new compressed file.
+        :param steps: steps of the frames
+        :param references: steps of the keyframes of the frames
+        :param deltas: (flat indices, values) of the difference of every frame with its keyframe
+        """
+        entry = {"file": DELTAS_FILE.format(len(self.index["deltas"])), "count": len(steps)}
+        offsets = np.cumsum([0] + [len(indices) for indices, _ in deltas], dtype=np.int64)
+        np.savez_compressed(
+            os.path.join(self.directory, entry["file"]),
+            steps=np.asarray(steps, dtype=np.int64),
+            references=np.asarray(references, dtype=np.int64),
+            offsets=offsets,
+            indices=np.concatenate([indices for indices, _ in deltas]),
+            values=np.concatenate([values for _, values in deltas]),
+        )
+        self.index["deltas"].append(entry)
+
+    def commit(self):
+        """Flushes the mapped segment and atomically replaces the index."""
+        if self._frames is not None:
+            self._frames.flush()
+            self._steps.flush()
+        temporary = os.path.join(self.directory, INDEX_FILE + ".tmp")
+        with open(temporary, "w") as index_file:
+            json.dump(self.index, index_file)
+        os.replace(temporary, os.path.join(self.directory, INDEX_FILE))
+
+    def close(self):
+        self.commit()
+        self._frames, self._steps = (None, None)
+
+
+class FeatureMapRecorder(Display):
+    """
+    A display which appends the feature maps of a layer to an on-disk recording instead of drawing them,
+    e.g. for headless training nodes. The frames are buffered in memory and written in batches into
+    memory-mapped segments, so no file is opened on a regular update.
+
+    With `delta=True`, only the frames which drift from the reference of a drift gate are stored as
+    keyframes. The other frames are stored as the entries of their difference with the keyframe
+    which exceed `delta_tolerance`, in float16, so a stable layer costs a few bytes per frame. A
+    difference too dense to be smaller than half of the frame is stored as a keyframe instead.
+
+    The frames are keyed by the step of their capture, so the recordings of the forward and gradient
+    monitors (or of a sampled layer) line up step for step.
+    """
+
+    accepts_step = True
+
+    def __init__(
+        self,
+        path,
+        dtype=None,
+        chunk_size=256,
+        flush_every=32,
+        delta=False,
+        drift_gate=None,
+        delta_tolerance=1e-3,
+    ):
+        """
+        :param path: (str) directory of the recording, shared by all the monitored layers
+        :param dtype: None to keep the dtype of the activations, `float16`, or `uint8` to quantize them
+        :param chunk_size: (int) number of frames per segment file
+        :param flush_every: (int) number of frames buffered in memory before they are written
+        :param delta: (bool) store the frames which haven't drifted as sparse differences with the
+            last keyframe
+        :param drift_gate: DriftGate (see `laymon.drift`) deciding which frames are keyframes, with
+            `delta`. It is copied, defaults to `DriftGate()`.
+        :param delta_tolerance: (float) largest absolute difference with the keyframe which isn't
+            stored, with `delta`
+        """
+        if dtype not in (None, "float16", "uint8"):
+            raise ValueError("dtype should be one of None, float16 or uint8.")
+        if delta and dtype == "uint8":
+            raise ValueError("The delta encoding adds float differences, it can't be quantized.")
+        self.path = path
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.flush_every = flush_every
+        self.delta = delta
+        self.drift_gate = copy.deepcopy(drift_gate) if drift_gate is not None else DriftGate()
+        self.delta_tolerance = delta_tolerance
+        self._writer, self._buffer, self._next_step = (None, [], 0)
+        self._keyframe = None  # Step and decoded frame of the last keyframe.
+
+    def _to_frame(self, parameters):
+        parameters = parameters.detach()
+        if self.dtype == "uint8":
+            parameters = quantize(parameters)
+        elif self.dtype == "float16":
+            parameters = parameters.to(torch.float16)
+        return parameters.cpu().numpy()
+
+    def _encode(self, parameters, step):
+        """
+        Returns the stored frame and the step of its keyframe, with the delta encoding: a keyframe
+        is stored as an array, a difference as a pair of (flat indices, values) arrays.
+        """
+        drifted = self.drift_gate.drifted(parameters)
+        if not drifted and self._keyframe is not None:
+            frame = parameters.detach().float().cpu().numpy()
+            if frame.shape == self._keyframe[1].shape:
+                difference = (frame - self._keyframe[1]).reshape(-1)
+                indices = np.flatnonzero(np.abs(difference) > self.delta_tolerance)
+                # An int32 index and a float16 value per entry.
+                if indices.size * 6 < frame.size * self._keyframe[2] / 2:
+                    delta = (indices.astype(np.int32), difference[indices].astype(np.float16))
+                    return delta, self._keyframe[0]
+            # Too dense, the frame becomes the reference of the gate as well.
+            self.drift_gate.reference = self.drift_gate.sketch(parameters)
+        stored = self._to_frame(parameters)
+        # The differences are taken with the keyframe as it is read back.
+        self._keyframe = (step, stored.astype(np.float32), stored.itemsize)
+        return stored, step
+
+    def record(self, parameters, layer_name, step=None):
+        """
+        Appends the activations of a layer to the recording.
+        :param parameters: Tensor (activation map params)
+        :param layer_name: (str) name of the layer
+        :param step: (int) step of the frame, defaults to the step following the last recorded one.
+            A frame whose step is not after the last recorded one, e.g. the same capture notified
+            again, is not recorded.
+        """
+        if step is not None and step < self._next_step:
+            return
+        if self._writer is None:
+            encoding = DELTA_ENCODING if self.delta else RAW_ENCODING
+            self._writer = _LayerWriter(self.path, layer_name, self.chunk_size, encoding=encoding)
+        step = self._next_step if step is None else step
+        self._next_step = step + 1
+        if self.delta:
+            frame, reference = self._encode(parameters, step)
+        else:
+            frame, reference = (self._to_frame(parameters), step)
+        self._buffer.append((step, frame, reference))
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def update_display(self, parameters, display_title, step=None):
+        """
+        Records the new parameters
+        :param parameters: Tensor (activation map params)
+        :param display_title: Title of the figure, i.e. the name of the layer
+        :param step: (int) step of the capture of the parameters, if known
+        """
+        self.record(parameters, layer_name=display_title, step=step)
+
+    def flush(self):
+        """Writes the buffered frames and updates the index of the layer."""
+        if not self._buffer:
+            return
+        keyframes = [entry for entry in self._buffer if isinstance(entry[1], np.ndarray)]
+        deltas = [entry for entry in self._buffer if not isinstance(entry[1], np.ndarray)]
+        # Frames of the same shape and dtype are written in a single slice assignment.
+        begin = 0
+        for end in range(1, len(keyframes) + 1):
+            if end < len(keyframes):
+                previous, current = keyframes[end - 1][1], keyframes[end][1]
+                if previous.shape == current.shape and previous.dtype == current.dtype:
+                    continue
+            steps = np.array([step for step, _, _ in keyframes[begin:end]], dtype=np.int64)
+            frames = np.stack([frame for _, frame, _ in keyframes[begin:end]])
+            self._writer.write(steps, frames)
+            begin = end
+        if deltas:
+            self._writer.write_deltas(
+                [step for step, _, _ in deltas],
+                [reference for _, _, reference in deltas],
+                [delta for _, delta, _ in deltas],
+            )
+        self._buffer = []
+        self._writer.commit()
+
+    def close(self):
+        """Writes the buffered frames and releases the memory maps."""
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class RecordingReader(object):
+    """
+    Reads the frames of a recording. Segments are memory-mapped on demand, so reading a
+    (layer, step) frame only touches the pages of that frame. Every map holds a file descriptor,
+    so only the most recently used maps are kept open.
+    """
+
+    def __init__(self, path, max_open_segments=64):
+        """
+        :param path: (str) directory of the recording
+        :param max_open_segments: (int) maximum number of segment files kept memory-mapped, the
+            least recently used map is released when another segment is mapped
+        """
+        self.path = path
+        self.max_open_segments = max_open_segments
+        self._indexes, self._locations = (dict(), dict())
+        self._segments = OrderedDict()  # (layer name, number, kind) -> memory map, in LRU order
+
+    def layers(self):
+        """Returns the names of the recorded layers."""
+        names = []
+        for entry in sorted(os.listdir(self.path)):
+            index_path = os.path.join(self.path, entry, INDEX_FILE)
+            if os.path.exists(index_path):
+                names.append(self._load_index(index_path)["layer"])
+        return names
+
+    def _load_index(self, index_path):
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+        self._indexes[index["layer"]] = index
+        self._locations.pop(index["layer"], None)
+        return index
+
+    def _segment_path(self, layer_name, number, kind):
+        if kind == "deltas":
+            name = self._indexes[layer_name]["deltas"][number]["file"]
+        else:
+            name = self._indexes[layer_name]["segments"][number][kind]
+        return os.path.join(_layer_directory(self.path, layer_name), name)
+
+    def _segment(self, layer_name, number, kind="file"):
+        key = (layer_name, number, kind)
+        if key in self._segments:
+            self._segments.move_to_end(key)
+            return self._segments[key]
+        while len(self._segments) >= self.max_open_segments:
+            # The file of a map is closed once the frames read from it are released too.
+            self._segments.popitem(last=False)
+        path = self._segment_path(layer_name, number, kind)
+        if kind == "deltas":
+            # The differences are compressed, they are read at once.
+            with np.load(path) as deltas:
+                self._segments[key] = dict(deltas)
+        else:
+            self._segments[key] = np.load(path, mmap_mode="r")
+        return self._segments[key]
+
+    def _get_locations(self, layer_name, reload=False):
+        """Returns the mapping step -> (kind, file number, row) of a layer."""
+        if reload or layer_name not in self._indexes:
+            self._load_index(os.path.join(_layer_directory(self.path, layer_name), INDEX_FILE))
+            # Drop the maps of the segments which may have been extended since.
+            for key in [key for key in self._segments if key[0] == layer_name]:
+                del self._segments[key]
+        if layer_name not in self._locations:
+            locations = dict()
+            for number, segment in enumerate(self._indexes[layer_name]["segments"]):
+                # The steps are small, they are read at once instead of being mapped.
+                steps = np.load(self._segment_path(layer_name, number, "steps"))[: segment["count"]]
+                locations.update(
+                    (int(step), ("file", number, row)) for row, step in enumerate(steps)
+                )
+            for number in range(len(self._indexes[layer_name].get("deltas", []))):
+                steps = self._segment(layer_name, number, kind="deltas")["steps"]
+                locations.update(
+                    (int(step), ("deltas", number, row)) for row, step in enumerate(steps)
+                )
+            self._locations[layer_name] = locations
+        return self._locations[layer_name]
+
+    def steps(self, layer_name):
+        """Returns the sorted steps recorded for a layer."""
+        return sorted(self._get_locations(layer_name, reload=True))
+
+    def read(self, layer_name, step):
+        """
+        Reads a single frame.
+        :param layer_name: (str) name of the layer
+        :param step: (int) step of the frame
+        :return: memory-mapped numpy array of the frame, or a float32 array (decoded from its
+            keyframe) with the delta encoding
+        """
+        locations = self._get_locations(layer_name)
+        if step not in locations:
+            # The recording may still be in progress, look for new frames.
+            locations = self._get_locations(layer_name, reload=True)
+        if step not in locations:
+            raise KeyError(f"Step {step} of layer {layer_name} is not recorded.")
+        kind, number, row = locations[step]
+        if kind == "file":
+            frame = self._segment(layer_name, number)[row]
+            if self._indexes[layer_name].get("encoding", RAW_ENCODING) != DELTA_ENCODING:
+                return frame
+            return frame.astype(np.float32)
+        deltas = self._segment(layer_name, number, kind="deltas")
+        begin, end = deltas["offsets"][row : row + 2]
+        frame = self.read(layer_name, int(deltas["references"][row]))
+        frame.reshape(-1)[deltas["indices"][begin:end]] += deltas["values"][begin:end]
+        return frame
@@ -0,0 +1,395 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import matplotlib
+import torch.multiprocessing
+
+from .observers import FeatureMapObserverFactory
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+BACKGROUND_THREAD = "background"
+MAIN_THREAD = "main"
+PROCESS = "process"
+
+EVENT_LOOP_INTERVAL = 0.05  # Seconds between two runs of the GUI event loop of the process.
+
+
+def _gui_backend():
+    """Whether the matplotlib backend draws in a GUI, whose event loop only runs on the main thread."""
+    try:
+        from matplotlib.backends import BackendFilter, backend_registry
+
+        non_interactive = backend_registry.list_builtin(BackendFilter.NON_INTERACTIVE)
+    except ImportError:  # matplotlib < 3.9
+        non_interactive = matplotlib.rcsetup.non_interactive_bk
+    return matplotlib.get_backend().lower() not in [name.lower() for name in non_interactive]
+
+
+def default_draw_thread():
+    """Draws in a rendering process with a GUI backend, else on a background thread."""
+    return PROCESS if _gui_backend() else BACKGROUND_THREAD
+
+
+class AsyncRenderer(object):
+    """
+    A worker that renders the feature maps off the training step.
+
+    Each call to `submit` enqueues a batch of (observer, parameters) pairs. When rendering falls
+    behind and the queue is full, either the oldest queued batch or the incoming batch is dropped
+    depending on the configured drop policy.
+
+    The batches are drained by a daemon thread, unless the displays draw with a GUI backend: GUI
+    toolkits only draw from the main thread, so the batches are then drained on the thread calling
+    `drain` (e.g. `FeatureMapMonitoring.start`), and the queue only bounds the batches kept.
+    """
+
+    def __init__(
+        self,
+        max_queue_size=2,
+        drop_policy=DROP_OLDEST,
+        on_batch_rendered=None,
+        draw_thread=None,
+    ):
+        """
+        Initialises the queue and starts the rendering thread.
+        :param max_queue_size: (int) maximum number of pending batches
+        :param drop_policy: (str) `drop_oldest` or `drop_newest`
+        :param on_batch_rendered: optional callable invoked after every rendered batch
+        :param draw_thread: (str) `background` to render on a daemon thread, or `main` to render
+            when `drain` is called. Defaults to `main` with a GUI matplotlib backend, else
+            `background`.
+        """
+        if max_queue_size < 1:
+            raise ValueError("max_queue_size should be at least 1.")
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"drop_policy should be one of {DROP_OLDEST}, {DROP_NEWEST}.")
+        if draw_thread is None:
+            draw_thread = MAIN_THREAD if _gui_backend() else BACKGROUND_THREAD
+        if draw_thread not in (BACKGROUND_THREAD, MAIN_THREAD):
+            raise ValueError(f"draw_thread should be one of {BACKGROUND_THREAD}, {MAIN_THREAD}.")
+
+        self._max_queue_size = max_queue_size
+        self._drop_policy = drop_policy
+        self._on_batch_rendered = on_batch_rendered
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._busy = False
+        self._closed = False
+
+        self.submitted, self.rendered, self.dropped = (0, 0, 0)
+        self.last_error = None
+
+        self._thread = None
+        if draw_thread == BACKGROUND_THREAD:
+            self._thread = threading.Thread(target=self._run, name="laymon-renderer", daemon=True)
+            self._thread.start()
+
+    def submit(self, batch):
+        """
+        Enqueues a batch of updates without waiting for it to be rendered.
+        :param batch: list of (observer, Capture) tuples
+        :return: True if the batch was queued, False if it was dropped
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot submit to a closed renderer.")
+            self.submitted += 1
+            if len(self._queue) >= self._max_queue_size:
+                self.dropped += 1
+                if self._drop_policy == DROP_NEWEST:
+                    return False
+                self._queue.popleft()
+            self._queue.append(batch)
+            self._condition.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return  # Closed and fully drained.
+                batch = self._queue.popleft()
+                self._busy = True
+            self._render(batch)
+
+    def _render(self, batch):
+        try:
+            for observer, capture in batch:
+                observer.update(capture.parameters, step=capture.step, channels=capture.channels)
+            if self._on_batch_rendered is not None:
+                self._on_batch_rendered()
+        except Exception as error:  # Keep the worker alive, surface the error to the caller.
+            self.last_error = error
+
+        with self._condition:
+            self._busy = False
+            self.rendered += 1
+            self._condition.notify_all()
+
+    def drain(self):
+        """Renders the queued batches on the calling thread, without a rendering thread."""
+        if self._thread is not None:
+            return
+        while True:
+            with self._condition:
+                if not self._queue:
+                    return
+                batch = self._queue.popleft()
+                self._busy = True
+            self._render(batch)
+
+    def _raise_error(self):
+        """Raises (once) the last error raised while rendering, if any."""
+        error, self.last_error = (self.last_error, None)
+        if error is not None:
+            raise error
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every queued batch has been rendered, and raises the last rendering error.
+        :param timeout: (float) maximum number of seconds to wait
+        :return: True if the queue was drained, else False
+        """
+        self.drain()
+        with self._condition:
+            flushed = self._condition.wait_for(lambda: not self._queue and not self._busy, timeout)
+        self._raise_error()
+        return flushed
+
+    def close(self, timeout=None):
+        """Renders the pending batches and stops the rendering thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is None:
+            self.drain()
+        else:
+            self._thread.join(timeout)
+
+    def pending(self):
+        """Returns the number of batches waiting to be rendered."""
+        with self._condition:
+            return len(self._queue)
+
+    def remove(self, layer_name):
+        """The displays drawn by the renderer belong to the observer factory, nothing to release."""
+
+
+def _render_in_process(requests, results, display_object, display_options, backend):
+    """
+    Draws the batches sent by the training process, on the main thread of the rendering process.
+    Every message is acknowledged with (whether it was a batch, error raised while handling it).
+    """
+    matplotlib.use(backend)
+    import matplotlib.pyplot as plt
+
+    factory = FeatureMapObserverFactory()
+    factory.display_object = display_object
+    factory.display_options = dict(display_options)
+    observers = dict()
+    while True:
+        try:
+            message = requests.get(timeout=EVENT_LOOP_INTERVAL)
+        except queue.Empty:
+            if plt.get_fignums():
+                plt.pause(EVENT_LOOP_INTERVAL)  # Keeps the windows responsive between batches.
+            continue
+        if message is None:
+            break
+        removed_layer, batch = message
+        try:
+            if batch is None:
+                observers.pop(removed_layer, None)
+                factory.release(removed_layer)
+            else:
+                for layer_name, capture in batch:
+                    if layer_name not in observers:
+                        observers[layer_name] = factory.create(layer=None, layer_name=layer_name)
+                    observers[layer_name].update(
+                        capture.parameters, step=capture.step, channels=capture.channels
+                    )
+                factory.refresh()
+            results.put((batch is not None, None))
+        except Exception as error:
+            results.put((batch is not None, error))
+    factory.close()
+
+
+class ProcessRenderer(object):
+    """
+    Renders the feature maps in a separate process, whose main thread owns the GUI windows, so that
+    neither the drawing nor the GUI event loop run on the training thread.
+
+    The process is started on the first batch, with the display class and options of the observer
+    factory at that time, and creates a display per layer. `submit` only queues the captured
+    activations to the process (they are pickled by a feeder thread). At most `max_queue_size`
+    batches wait for or are being drawn by the process. When the process falls behind, either the
+    incoming batch is dropped, or it is kept until the process catches up and replaces the batch
+    kept before it, depending on the drop policy.
+    """
+
+    def __init__(
+        self, get_display, max_queue_size=2, drop_policy=DROP_OLDEST, start_method="spawn"
+    ):
+        """
+        :param get_display: callable returning the (display class, display options) of the layers
+        :param max_queue_size: (int) maximum number of batches sent to the process and not drawn yet
+        :param drop_policy: (str) `drop_oldest` or `drop_newest`
+        :param start_method: (str) start method of the process, `spawn` doesn't inherit the state
+            (threads, CUDA context, GUI) of the training process
+        """
+        if max_queue_size < 1:
+            raise ValueError("max_queue_size should be at least 1.")
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"drop_policy should be one of {DROP_OLDEST}, {DROP_NEWEST}.")
+        self._get_display = get_display
+        self._max_queue_size = max_queue_size
+        self._drop_policy = drop_policy
+        self._context = torch.multiprocessing.get_context(start_method)
+        self._process, self._requests, self._results = (None, None, None)
+        self._in_flight = 0  # Messages sent to the process and not acknowledged yet.
+        self._held = None  # Latest batch waiting for the process to catch up, with `drop_oldest`.
+        self._closed = False
+
+        self.submitted, self.rendered, self.dropped = (0, 0, 0)
+        self.last_error = None
+
+    def _start(self):
+        display_object, display_options = self._get_display()
+        self._requests, self._results = (self._context.Queue(), self._context.Queue())
+        self._process = self._context.Process(
+            target=_render_in_process,
+            args=(
+                self._requests,
+                self._results,
+                display_object,
+                display_options or {},
+                matplotlib.get_backend(),
+            ),
+            name="laymon-renderer",
+            daemon=True,
+        )
+        self._process.start()
+
+    def _send(self, message):
+        if self._process is None:
+            self._start()
+        self._in_flight += 1
+        self._requests.put(message)
+
+    def _acknowledge(self, result):
+        self._in_flight -= 1
+        drawn, error = result
+        if error is not None:
+            self.last_error = error
+        elif drawn:
+            self.rendered += 1
+
+    def _collect(self):
+        """Counts the messages drawn by the process, and sends the batch kept meanwhile."""
+        while self._in_flight:
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._acknowledge(result)
+        if self._held is not None and self._in_flight < self._max_queue_size:
+            held, self._held = (self._held, None)
+            self._send((None, held))
+
+    def submit(self, batch):
+        """
+        Sends a batch of updates to the rendering process without waiting for it to be drawn.
+        :param batch: list of (observer, Capture) tuples
+        :return: True if the batch was sent or kept, False if it was dropped
+        """
+        if self._closed:
+            raise RuntimeError("Cannot submit to a closed renderer.")
+        self.submitted += 1
+        # Only host tensors can be sent to the process.
+        batch = [
+            (
+                observer.get_layer_name(),
+                capture._replace(
+                    parameters=capture.parameters.cpu(),
+                    channels=None if capture.channels is None else capture.channels.cpu(),
+                ),
+            )
+            for observer, capture in batch
+        ]
+        if self._process is not None:
+            self._collect()
+        if self._in_flight < self._max_queue_size:
+            self._send((None, batch))
+            return True
+        self.dropped += 1
+        if self._drop_policy == DROP_NEWEST:
+            return False
+        self._held = batch
+        return True
+
+    def drain(self):
+        """Sends the kept batch if the process has caught up, without waiting for it."""
+        if self._process is not None:
+            self._collect()
+
+    def remove(self, layer_name):
+        """Closes the display of a layer which is not monitored anymore."""
+        if self._process is not None:
+            self._send((layer_name, None))
+
+    def _raise_error(self):
+        """Raises (once) the last error raised while rendering, if any."""
+        error, self.last_error = (self.last_error, None)
+        if error is not None:
+            raise error
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every batch has been drawn by the process, and raises the last rendering error.
+        :param timeout: (float) maximum number of seconds to wait
+        :return: True if every batch was drawn, else False
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._process is not None:
+            self._collect()
+            if not self._in_flight and self._held is None:
+                break
+            if not self._process.is_alive():
+                raise RuntimeError("The rendering process exited.")
+            remaining = EVENT_LOOP_INTERVAL
+            if deadline is not None:
+                remaining = min(remaining, deadline - time.monotonic())
+                if remaining <= 0:
+                    return False
+            try:
+                self._acknowledge(self._results.get(timeout=remaining))
+            except queue.Empty:
+                pass
+        self._raise_error()
+        return True
+
+    def close(self, timeout=None):
+        """Draws the pending batches, closes the displays and stops the rendering process."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._process is None:
+            return
+        try:
+            self.flush(timeout=timeout)
+        finally:
+            self._requests.put(None)
+            self._process.join(timeout)
+
+    def pending(self):
+        """Returns the number of batches waiting for or being drawn by the process."""
+        self.drain()
+        return self._in_flight + (self._held is not None)
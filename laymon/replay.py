@@ -0,0 +1,145 @@
+import bisect
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from .displays import FeatureMapDisplay
+from .recording import RecordingReader
+
+
+class FeatureMapReplay(object):
+    """
+    An offline viewer for the feature maps recorded by a FeatureMapRecorder.
+
+    The frames are loaded lazily by (layer, step) and kept in a bounded LRU cache of decoded frames.
+    On every seek, the frames following the requested step are loaded in the background, so that
+    scrubbing forward through a recording mostly hits the cache.
+    """
+
+    def __init__(
+        self,
+        path,
+        display_object=FeatureMapDisplay,
+        display_options=None,
+        cache_size=256,
+        prefetch=8,
+    ):
+        """
+        :param path: (str) directory of the recording
+        :param display_object: Display class used to show the frames of every layer, or None to only
+            load the frames
+        :param display_options: (dict) keyword arguments of the display class
+        :param cache_size: (int) maximum number of decoded frames kept in memory
+        :param prefetch: (int) number of frames loaded ahead of the requested one
+        """
+        self.reader = RecordingReader(path)
+        self.display_object = display_object
+        self.display_options = display_options or {}
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+
+        self._cache = OrderedDict()  # (layer, step) -> decoded frame, in least recently used order
+        self._pending = dict()  # (layer, step) -> future of a frame being prefetched
+        self._lock = threading.Lock()
+        self._steps, self._displays = (dict(), dict())
+
+        # The prefetching thread reads through its own reader, readers are not thread-safe.
+        self._prefetch_reader = RecordingReader(path)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="laymon-prefetch")
+        self.hits, self.misses = (0, 0)
+
+    def layers(self):
+        """Returns the names of the recorded layers."""
+        return self.reader.layers()
+
+    def steps(self, layer_name):
+        """Returns the sorted steps recorded for a layer."""
+        if layer_name not in self._steps:
+            self._steps[layer_name] = self.reader.steps(layer_name)
+        return self._steps[layer_name]
+
+    @staticmethod
+    def _decode(reader, layer_name, step):
+        # Copy the frame out of the memory map, so that it doesn't depend on the file anymore.
+        return torch.from_numpy(np.array(reader.read(layer_name, step)))
+
+    def _insert(self, key, frame):
+        with self._lock:
+            self._cache[key] = frame
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _prefetch_frame(self, key):
+        try:
+            frame = self._decode(self._prefetch_reader, *key)
+            self._insert(key, frame)
+            return frame
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _schedule_prefetch(self, layer_name, step):
+        steps = self.steps(layer_name)
+        position = bisect.bisect_right(steps, step)
+        for next_step in steps[position : position + self.prefetch]:
+            key = (layer_name, next_step)
+            with self._lock:
+                if key in self._cache or key in self._pending:
+                    continue
+                self._pending[key] = self._executor.submit(self._prefetch_frame, key)
+
+    def frame(self, layer_name, step):
+        """
+        Returns a decoded frame, from the cache if possible.
+        :param layer_name: (str) name of the layer
+        :param step: (int) step of the frame
+        :return: Tensor
+        """
+        key = (layer_name, step)
+        with self._lock:
+            frame = self._cache.get(key)
+            if frame is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return frame
+            future = self._pending.get(key)
+            self.misses += 1
+
+        if future is not None:
+            return future.result()  # The frame is already being loaded.
+        frame = self._decode(self.reader, layer_name, step)
+        self._insert(key, frame)
+        return frame
+
+    def seek(self, layer_name, step):
+        """
+        Shows the frame of a layer at the given step, and prefetches the following frames.
+        :param layer_name: (str) name of the layer
+        :param step: (int) step of the frame
+        :return: Tensor (the frame)
+        """
+        frame = self.frame(layer_name, step)
+        if self.prefetch:
+            self._schedule_prefetch(layer_name, step)
+        if self.display_object is not None:
+            if layer_name not in self._displays:
+                self._displays[layer_name] = self.display_object(**self.display_options)
+            self._displays[layer_name].update_display(frame, display_title=layer_name)
+        return frame
+
+    def play(self, layer_name, start=None, stop=None):
+        """Seeks through the recorded steps of a layer in [start, stop)."""
+        for step in self.steps(layer_name):
+            if (start is None or step >= start) and (stop is None or step < stop):
+                self.seek(layer_name, step)
+
+    def close(self):
+        """Stops the prefetching and closes the displays."""
+        self._executor.shutdown(wait=True)
+        for display in self._displays.values():
+            display.close()
+        self._displays = dict()
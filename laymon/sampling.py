@@ -0,0 +1,65 @@
+import random
+import time
+
+from .interfaces import SamplingPolicy
+
+
+class EveryNCalls(SamplingPolicy):
+    """Captures the output of a layer once every `n` forward passes."""
+
+    def __init__(self, n):
+        if n < 1:
+            raise ValueError("n should be at least 1.")
+        self.n = n
+        self._calls = 0
+
+    def should_capture(self, layer):
+        self._calls += 1
+        if self._calls < self.n:
+            return False
+        self._calls = 0
+        return True
+
+
+class RandomFraction(SamplingPolicy):
+    """Captures the output of a layer on a random fraction of the forward passes."""
+
+    def __init__(self, fraction, seed=None):
+        if not 0.0 <= fraction <= 1.0:
+            raise ValueError("fraction should be in the range [0, 1].")
+        self.fraction = fraction
+        self._random = random.Random(seed)
+
+    def should_capture(self, layer):
+        return self._random.random() < self.fraction
+
+
+class TimeInterval(SamplingPolicy):
+    """Captures the output of a layer at most once every `seconds` seconds."""
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.seconds = seconds
+        self._clock = clock
+        self._last_capture = None
+
+    def should_capture(self, layer):
+        now = self._clock()
+        if self._last_capture is not None and now - self._last_capture < self.seconds:
+            return False
+        self._last_capture = now
+        return True
+
+
+class TrainingOnly(SamplingPolicy):
+    """
+    Captures the output of a layer only while it is in training mode, i.e. validation and inference
+    passes are skipped. Optionally chains another policy for the training passes.
+    """
+
+    def __init__(self, policy=None):
+        self.policy = policy
+
+    def should_capture(self, layer):
+        if not layer.training:
+            return False
+        return self.policy is None or self.policy.should_capture(layer)
@@ -0,0 +1,154 @@
+import torch
+
+STATISTICS = ("mean", "std", "min", "max", "zero_fraction", "l2_norm")
+
+
+def merge_statistics(captures, counts):
+    """
+    Combines per-channel statistics (e.g. of several captures, or of several ranks) into the
+    statistics of all their values: the means are weighted by the number of values, the variances
+    are combined with the parallel variant of Welford's algorithm, and the extrema are the ones of
+    all the statistics.
+    :param captures: list of Tensors of shape (len(STATISTICS), channels), see `ChannelStatistics`
+    :param counts: list of the numbers of values per channel the statistics were computed from
+    :return: Tensor of shape (len(STATISTICS), channels)
+    """
+    rows = {name: row for row, name in enumerate(STATISTICS)}
+    statistics = torch.stack([capture.float() for capture in captures])
+    weights = torch.tensor(counts, dtype=torch.float32, device=statistics.device).view(-1, 1)
+    total = weights.sum()
+
+    means = statistics[:, rows["mean"]]
+    mean = (weights * means).sum(dim=0) / total
+    # Sum of the squared deviations of every statistics, plus the ones of its mean to the combined mean.
+    m2 = (weights * (statistics[:, rows["std"]] ** 2 + (means - mean) ** 2)).sum(dim=0)
+    variance = m2 / total
+    merged = torch.empty_like(statistics[0])
+    merged[rows["mean"]] = mean
+    merged[rows["std"]] = variance.sqrt()
+    merged[rows["min"]] = statistics[:, rows["min"]].amin(dim=0)
+    merged[rows["max"]] = statistics[:, rows["max"]].amax(dim=0)
+    merged[rows["zero_fraction"]] = (weights * statistics[:, rows["zero_fraction"]]).sum(0) / total
+    merged[rows["l2_norm"]] = torch.sqrt(total * (variance + mean * mean))
+    return merged
+
+
+class ChannelStatistics(object):
+    """
+    A capture transform reducing the output of a layer to per-channel statistics, on the device.
+
+    Instead of the activations, a (len(STATISTICS), channels) tensor is retained, i.e. a few hundred
+    floats per layer. All the channels are reduced at once by a handful of vectorized reductions
+    over the batch and spatial dimensions, in the layout of the activations (no transposed copy).
+    The variance is the mean of the squared deviations from the mean, two reductions which are several
+    times faster than `var_mean` on the CPU, and the L2 norm is derived from the mean and variance.
+
+    Running aggregates over all the captures are kept with the parallel variant of Welford's
+    algorithm, so no history is kept. The statistics of the captures are merged into them every
+    `merge_every` captures (or when they are read), by a few vectorized operations over the batch of
+    captures instead of a dozen small ones per capture.
+    """
+
+    def __init__(self, merge_every=32):
+        """
+        :param merge_every: (int) number of captures whose statistics are merged at once
+        """
+        self.merge_every = merge_every
+        self.count = 0  # Number of values aggregated per channel.
+        self.size = None  # Number of values per channel of the last capture.
+        self._running = None  # Statistics of the merged captures, as returned by a call.
+        self._pending, self._pending_sizes = ([], [])  # Statistics of the captures not merged yet.
+
+    def __call__(self, activation):
+        """
+        Computes the statistics of a capture, to be merged into the running aggregates.
+        :param activation: Tensor of shape (batch, channels, ...)
+        :return: Tensor of shape (len(STATISTICS), channels)
+        """
+        if activation.dim() < 2:
+            raise ValueError("activation should be of shape (batch, channels, ...).")
+        values = activation.float()
+        dims = (0,) + tuple(range(2, values.dim()))  # Every dimension but the channels.
+        size = self.size = values.numel() // values.size(1)
+
+        mean = values.mean(dim=dims, keepdim=True)
+        variance = (values - mean).square_().mean(dim=dims)
+        mean = mean.view(-1)
+        minimum, maximum = (values.amin(dim=dims), values.amax(dim=dims))
+        zero_fraction = 1.0 - torch.count_nonzero(values, dim=dims) / size
+        l2_norm = torch.sqrt(size * (variance + mean * mean))
+        statistics = torch.stack((mean, variance.sqrt(), minimum, maximum, zero_fraction, l2_norm))
+
+        self.count += size
+        self._pending.append(statistics)
+        self._pending_sizes.append(size)
+        if len(self._pending) >= self.merge_every:
+            self._merge()
+        return statistics
+
+    def _merge(self):
+        if not self._pending:
+            return
+        if self._running is not None:
+            self._pending.append(self._running)
+            self._pending_sizes.append(self.count - sum(self._pending_sizes))
+        self._running = merge_statistics(self._pending, self._pending_sizes)
+        self._pending, self._pending_sizes = ([], [])
+
+    def running(self):
+        """
+        Returns the per-channel aggregates over all the captures so far.
+        :return: dict of statistic name -> Tensor of shape (channels,), or None before any capture
+        """
+        self._merge()
+        if self._running is None:
+            return None
+        return {name: self._running[row] for row, name in enumerate(STATISTICS)}
+
+
+class ActivationHistogram(object):
+    """
+    A capture transform reducing the output of a layer to a fixed-bin histogram, on the device.
+
+    The histograms of the last `history` captures are kept in a ring buffer of shape (history, bins),
+    preallocated on the first capture, so the memory used stays constant over the whole run.
+    """
+
+    def __init__(self, bins=64, value_range=(-10.0, 10.0), history=256, log_scale=False):
+        """
+        :param bins: (int) number of bins
+        :param value_range: (tuple) lower and upper edges of the bins, values outside are clamped
+        :param history: (int) number of histograms kept
+        :param log_scale: (bool) bucket sign(x) * log(1 + |x|) instead of x, the range applies to
+            the transformed values
+        """
+        self.bins = bins
+        self.value_range = value_range
+        self.history = history
+        self.log_scale = log_scale
+        self._ring, self._head, self.captures = (None, 0, 0)
+
+    def __call__(self, activation):
+        """
+        Adds the histogram of a capture to the ring buffer.
+        :param activation: Tensor of any shape
+        :return: Tensor of shape (history, bins), the histograms ordered from the oldest to the latest,
+            as fractions of the values of each capture
+        """
+        values = activation.detach().float()
+        if self.log_scale:
+            values = torch.sign(values) * torch.log1p(values.abs())
+        low, high = self.value_range
+        values = values.clamp(low, high)
+
+        if self._ring is None:
+            self._ring = values.new_zeros((self.history, self.bins))
+        torch.histc(values, bins=self.bins, min=low, max=high, out=self._ring[self._head])
+        self._ring[self._head] /= max(values.numel(), 1)
+        self._head = (self._head + 1) % self.history
+        self.captures += 1
+        return torch.roll(self._ring, shifts=-self._head, dims=0)
+
+    def bin_edges(self):
+        """Returns the edges of the bins, of shape (bins + 1,)."""
+        return torch.linspace(self.value_range[0], self.value_range[1], self.bins + 1)
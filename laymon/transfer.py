@@ -0,0 +1,130 @@
+import threading
+from collections import defaultdict, deque
+
+import torch
+
+
+def _fields(capture):
+    """Returns the (name, tensor) pairs of a capture which are copied to the host."""
+    return [
+        (name, value)
+        for name, value in (("parameters", capture.parameters), ("channels", capture.channels))
+        if value is not None
+    ]
+
+
+def _tensors(capture):
+    return [value for _, value in _fields(capture)]
+
+
+class HostTransfer(object):
+    """
+    Copies the captured activations from the device to the host without stalling the device.
+
+    The activations are copied with `non_blocking=True` into pinned host buffers, which are taken
+    from a pool of reusable buffers (keyed by shape and dtype). An event is recorded after every copy
+    and a buffer is only read for the displays once its event has completed, so neither the
+    training loop nor the displays ever wait for the device.
+
+    At most `max_in_flight` copies of a layer are pending at once, further captures of the layer are
+    not copied (and counted in `dropped`) until one of the copies has completed. The pinned buffers
+    are never handed over themselves: the displays get a copy of a completed buffer, so a buffer
+    goes back to the pool as soon as a more recent copy of its layer has completed.
+
+    The captures (`laymon.monitor.Capture`) are handed over with their parameters, and the indices
+    of their channels if any, on the host. Tensors which already are on the host (CPU-only machines)
+    are handed over as they are.
+    """
+
+    def __init__(self, max_in_flight=2):
+        """
+        :param max_in_flight: (int) maximum number of pending copies per layer
+        """
+        self.max_in_flight = max_in_flight
+        # Number of captures which weren't copied, as too many copies were pending.
+        self.dropped = 0
+        self._lock = threading.Lock()  # Captures are submitted and handed over from other threads.
+        self._pool = defaultdict(list)  # (shape, dtype) -> list of free pinned buffers
+        self._pending = defaultdict(deque)  # key -> deque of (host capture, event, source) in order
+        # key -> [latest completed host capture, its copy handed over (if any), whether the
+        # tensors of the capture are buffers of the pool]
+        self._ready = dict()
+
+    def _get_buffer(self, tensor):
+        free_buffers = self._pool[(tuple(tensor.shape), tensor.dtype)]
+        if free_buffers:
+            return free_buffers.pop()
+        return torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+
+    def _release(self, buffer):
+        self._pool[(tuple(buffer.shape), buffer.dtype)].append(buffer)
+
+    def _reap(self, key):
+        """Makes the completed copies of a layer ready, the latest one supersedes the others."""
+        pending = self._pending.get(key)
+        while pending and pending[0][1].query():
+            capture, _, _ = pending.popleft()
+            previous = self._ready.get(key)
+            if previous is not None and previous[2]:
+                # Only copies of the buffers were handed over, nothing else holds them.
+                for buffer in _tensors(previous[0]):
+                    self._release(buffer)
+            self._ready[key] = [capture, None, True]
+
+    def _copy(self, tensor):
+        buffer = self._get_buffer(tensor)
+        buffer.copy_(tensor, non_blocking=True)
+        return buffer
+
+    def submit(self, key, capture):
+        """
+        Starts copying a capture to the host.
+        :param key: (str) name of the layer the capture was taken from
+        :param capture: Capture whose parameters (and channels) are on any device
+        """
+        device = capture.parameters.device
+        if device.type == "cpu":
+            with self._lock:
+                self._ready[key] = [capture, capture, False]  # Zero-copy path.
+            return
+        if device.type != "cuda":
+            # No asynchronous copies for other devices.
+            capture = capture._replace(**{name: value.cpu() for name, value in _fields(capture)})
+            with self._lock:
+                self._ready[key] = [capture, capture, False]
+            return
+
+        with self._lock:
+            self._reap(key)
+            if len(self._pending[key]) >= self.max_in_flight:
+                self.dropped += 1
+                return
+            copy = capture._replace(**{name: self._copy(value) for name, value in _fields(capture)})
+            event = torch.cuda.Event()
+            event.record(torch.cuda.current_stream(device))
+            # Keep a reference to the source capture until the copy has completed.
+            self._pending[key].append((copy, event, capture))
+
+    def completed(self, key):
+        """
+        Returns the most recent capture of the layer whose copy has completed, without blocking.
+        :param key: (str) name of the layer
+        :return: Capture on the host, or None if no copy has completed yet
+        """
+        with self._lock:
+            self._reap(key)
+            ready = self._ready.get(key)
+            if ready is None:
+                return None
+            if ready[1] is None:
+                # The buffers are reused by the next copies, the displays get their own copy.
+                ready[1] = ready[0]._replace(
+                    **{name: value.clone() for name, value in _fields(ready[0])}
+                )
+            return ready[1]
+
+    def discard(self, key):
+        """Forgets the copies of a layer, e.g. once it is not monitored anymore."""
+        with self._lock:
+            self._pending.pop(key, None)
+            self._ready.pop(key, None)
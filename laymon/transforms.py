@@ -0,0 +1,244 @@
+"""
+===========================================
+Tensor transforms applied to the activations
+===========================================
+"""
+
+import math
+
+import torch
+import torch.nn.functional as F
+
+SAMPLE_REDUCTIONS = {
+    "mean": lambda activation: activation.mean(dim=0),
+    "max": lambda activation: activation.max(dim=0)[0],
+}
+
+
+def select_sample(activation, sample=0):
+    """
+    Selects a single sample out of a batch of activations.
+    :param activation: Tensor of shape (batch, channels, ...)
+    :param sample: index of the sample, or the name of a reduction over the batch (`mean`, `max`)
+    :return: Tensor of shape (channels, ...)
+    """
+    if isinstance(sample, str):
+        if sample not in SAMPLE_REDUCTIONS:
+            raise ValueError(f"sample should be an index or one of {sorted(SAMPLE_REDUCTIONS)}.")
+        return SAMPLE_REDUCTIONS[sample](activation)
+    return activation[sample]
+
+
+def tile_feature_maps(feature_maps, max_channels=16, columns=None, padding=1):
+    """
+    Tiles the channels of a single sample into one mosaic image, without looping over the channels.
+    The empty cells and the padding between the tiles are filled with NaN, which matplotlib leaves blank.
+    :param feature_maps: Tensor of shape (channels, height, width)
+    :param max_channels: (int) maximum number of channels in the mosaic
+    :param columns: (int) number of tiles per row, defaults to a square-ish layout
+    :param padding: (int) number of blank pixels between two tiles
+    :return: Tensor of shape (rows * (height + padding), columns * (width + padding))
+    """
+    if feature_maps.dim() != 3:
+        raise ValueError("feature_maps should be of shape (channels, height, width).")
+
+    maps = feature_maps[:max_channels].float()
+    num_of_channels, height, width = maps.shape
+    columns = columns or math.ceil(math.sqrt(num_of_channels))
+    rows = math.ceil(num_of_channels / columns)
+
+    # Pad every map on the bottom/right, then add blank maps to fill the last row.
+    maps = F.pad(maps, (0, padding, 0, padding), value=float("nan"))
+    blank = maps.new_full((rows * columns - num_of_channels,) + maps.shape[1:], float("nan"))
+    maps = torch.cat((maps, blank))
+
+    # (rows, columns, H, W) -> (rows, H, columns, W) -> (rows * H, columns * W)
+    tile_height, tile_width = maps.shape[1:]
+    mosaic = maps.view(rows, columns, tile_height, tile_width).permute(0, 2, 1, 3)
+    mosaic = mosaic.reshape(rows * tile_height, columns * tile_width)
+
+    # Drop the trailing padding on the outer edges.
+    return mosaic[: mosaic.size(0) - padding, : mosaic.size(1) - padding]
+
+
+def feature_map_image(activation, sample=0, max_channels=16, columns=None, padding=1):
+    """
+    Reduces the activations of a layer to a single 2D image: a sample is selected and its channels
+    are tiled into a mosaic.
+    :param activation: Tensor of shape (batch, channels, ...)
+    :param sample: index of the sample, or the name of a reduction over the batch (`mean`, `max`)
+    :param max_channels: (int) maximum number of channels in the mosaic
+    :param columns: (int) number of tiles per row, defaults to a square-ish layout
+    :param padding: (int) number of blank pixels between two tiles
+    :return: Tensor of shape (height, width)
+    """
+    feature_maps = select_sample(activation.detach(), sample=sample)
+    if feature_maps.dim() == 3:
+        return tile_feature_maps(
+            feature_maps, max_channels=max_channels, columns=columns, padding=padding
+        )
+    if feature_maps.dim() == 1:
+        return feature_maps.unsqueeze(0)
+    return feature_maps
+
+
+def quantize(activation):
+    """
+    Min-max scales every feature map (or the whole tensor, for 2D outputs) to uint8.
+    :param activation: Tensor of shape (batch, channels, ...)
+    :return: Tensor of dtype uint8
+    """
+    activation = activation.float()
+    dims = tuple(range(2, activation.dim())) or tuple(range(activation.dim()))
+    low = activation.amin(dim=dims, keepdim=True)
+    high = activation.amax(dim=dims, keepdim=True)
+    scale = 255.0 / (high - low).clamp_min(torch.finfo(activation.dtype).eps)
+    return ((activation - low) * scale).round_().to(torch.uint8)
+
+
+CHANNEL_SCORES = ("energy", "variance", "change")
+
+
+class ChannelSelector(object):
+    """
+    Selects the `k` most informative channels of a layer, instead of its first channels which are
+    often dead or redundant. The channels are scored on the device, in a single vectorized pass:
+        * `energy`: mean of the squared activations
+        * `variance`: variance of the activations over the batch and the spatial dimensions
+        * `change`: mean squared difference of the batch mean with the one of the previous capture
+
+    To keep the displayed channels from flickering, the scores of the channels selected on the previous
+    capture are increased by `hysteresis` (relatively) before the top-k are taken, so a channel only
+    replaces a selected one when it scores clearly higher. The selection never leaves the device.
+    A selector keeps the state (selection, previous capture) of a single layer.
+    """
+
+    def __init__(self, k=5, score="energy", hysteresis=0.1):
+        """
+        :param k: (int) number of channels to select, e.g. `max_subplots`
+        :param score: (str) `energy`, `variance` or `change`
+        :param hysteresis: (float) relative bonus of the channels selected on the previous capture
+        """
+        if score not in CHANNEL_SCORES:
+            raise ValueError(f"score should be one of {CHANNEL_SCORES}.")
+        self.k = k
+        self.score = score
+        self.hysteresis = hysteresis
+        self.selected = None  # Sorted indices of the selected channels, on the device.
+        self._previous = None  # Batch mean of the previous capture, for the `change` score.
+
+    def scores(self, activation):
+        """
+        Scores the channels of a capture.
+        :param activation: Tensor of shape (batch, channels, ...)
+        :return: Tensor of shape (channels,)
+        """
+        values = activation.detach().float()
+        values = values.flatten(2) if values.dim() > 2 else values.unsqueeze(-1)
+        if self.score == "variance":
+            return values.var(dim=(0, 2), unbiased=False)
+        if self.score == "change":
+            mean = values.mean(dim=0)
+            previous, self._previous = (self._previous, mean)
+            if previous is not None and previous.shape == mean.shape:
+                return (mean - previous).pow(2).mean(dim=1)
+        # The energy is also the score of the first capture of the `change` score.
+        return values.pow(2).mean(dim=(0, 2))
+
+    def select(self, activation, limit=None):
+        """
+        Selects the channels of a capture.
+        :param activation: Tensor of shape (batch, channels, ...)
+        :param limit: (int) maximum number of channels to select, if lower than `k`
+        :return: Tensor of the sorted indices of the selected channels
+        """
+        scores = self.scores(activation)
+        selected = self.selected
+        if selected is not None and selected.device == scores.device:
+            scores[selected[selected < scores.size(0)]] *= 1.0 + self.hysteresis
+        k = self.k if limit is None else min(self.k, limit)
+        # The highest scores are taken first, and only then sorted by channel.
+        indices = scores.topk(min(k, scores.size(0))).indices
+        self.selected = indices.sort().values
+        return self.selected
+
+    @property
+    def channels(self):
+        """Indices of the channels kept by the last call, as a transform."""
+        return self.selected
+
+    def __call__(self, activation):
+        return activation.index_select(1, self.select(activation))
+
+
+class CaptureTransform(object):
+    """
+    Reduces the activations of a layer before they are retained by the monitor, so that only what
+    is displayed stays alive on the device between two forward passes. The stages run on the
+    tensor's device, in order:
+        1. Select a sample of the batch (or reduce the batch), keeping a batch dimension of 1.
+        2. Keep the channels chosen by the channel selector (scored on the whole batch), and at most
+           `max_channels` channels.
+        3. Downsample the feature maps with an adaptive average pooling to `output_size`.
+        4. Cast to `float16`, or quantize to `uint8` (min-max scaled per feature map).
+    """
+
+    def __init__(
+        self, sample=None, max_channels=None, output_size=None, dtype=None, channel_selector=None
+    ):
+        """
+        :param sample: index of the sample to keep, a reduction over the batch (`mean`, `max`),
+            or None to keep the whole batch
+        :param max_channels: (int) maximum number of channels to keep, e.g. `max_subplots`
+        :param output_size: (int or tuple) maximum height and width of the feature maps
+        :param dtype: torch.float16, torch.uint8 or None to keep the dtype of the layer output
+        :param channel_selector: ChannelSelector choosing the channels to keep, so that only these
+            are retained and copied to the host
+        """
+        if dtype not in (None, torch.float16, torch.uint8):
+            raise ValueError("dtype should be one of None, torch.float16 or torch.uint8.")
+        self.sample = sample
+        self.max_channels = max_channels
+        self.output_size = output_size
+        self.dtype = dtype
+        self.channel_selector = channel_selector
+        # Indices of the channels kept by the last call, if they were selected.
+        self.channels = None
+
+    def _downsample(self, activation):
+        target = self.output_size
+        if isinstance(target, int):
+            target = (target, target)
+        # Only downsample, never upsample the feature maps.
+        size = tuple(min(dim, limit) for dim, limit in zip(activation.shape[2:], target))
+        if size == tuple(activation.shape[2:]):
+            return activation
+        return F.adaptive_avg_pool2d(activation, size)
+
+    def __call__(self, activation):
+        output = activation
+        channels = None
+        if self.channel_selector is not None and activation.dim() > 1:
+            channels = self.channel_selector.select(activation, limit=self.max_channels)
+        if self.sample is not None:
+            activation = select_sample(activation, sample=self.sample).unsqueeze(0)
+        if channels is not None:
+            activation = activation.index_select(1, channels)
+        if self.max_channels is not None and activation.dim() > 1:
+            activation = activation[:, : self.max_channels]
+        self.channels = channels
+        if self.output_size is not None and activation.dim() == 4:
+            activation = self._downsample(activation)
+        if self.dtype == torch.uint8:
+            activation = quantize(activation)
+        elif self.dtype is not None:
+            activation = activation.to(self.dtype)
+
+        # A view (e.g. of the selected channels) keeps the whole output of the layer alive,
+        # copy it so that only the reduced tensor is retained.
+        shares_storage = (
+            activation.untyped_storage().data_ptr() == output.untyped_storage().data_ptr()
+        )
+        if activation is not output and shares_storage:
+            activation = activation.clone()
+        return activation
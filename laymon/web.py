@@ -0,0 +1,265 @@
+"""
+===========================================
+Web based live viewer
+===========================================
+
+Serves the latest feature map of every monitored layer to a browser, from a small HTTP server
+running on an asyncio loop in a background thread:
+    * `/`: a page showing the layers, which polls for new frames
+    * `/updates?since=<version>`: waits (long poll) until a frame newer than `version` is available,
+      returns the versions of the changed layers and the names of all the layers as JSON
+    * `/frame/<layer name>`: the latest PNG frame of a layer
+"""
+
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from .encoding import apply_colormap, colormap_lut, encode_png
+from .interfaces import Display
+from .transforms import feature_map_image
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>laymon</title>
+<style>
+body { font-family: sans-serif; background: #222; color: #eee; }
+figure { display: inline-block; margin: 8px; }
+img { image-rendering: pixelated; min-width: 256px; }
+</style></head>
+<body>
+<div id="layers"></div>
+<script>
+let version = 0;
+const layers = document.getElementById("layers");
+async function poll() {
+    while (true) {
+        try {
+            const response = await fetch("/updates?since=" + version);
+            const update = await response.json();
+            for (const figure of Array.from(layers.children)) {
+                if (!update.names.includes(figure.dataset.name)) { figure.remove(); }
+            }
+            for (const [name, frameVersion] of Object.entries(update.layers)) {
+                let figure = layers.querySelector(`figure[data-name="${CSS.escape(name)}"]`);
+                if (!figure) {
+                    figure = document.createElement("figure");
+                    figure.dataset.name = name;
+                    figure.innerHTML = "<img><figcaption></figcaption>";
+                    figure.querySelector("figcaption").textContent = name;
+                    layers.appendChild(figure);
+                }
+                figure.querySelector("img").src =
+                    "/frame/" + encodeURIComponent(name) + "?v=" + frameVersion;
+            }
+            version = update.version;
+        } catch (error) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+}
+poll();
+</script>
+</body>
+</html>
+"""
+
+
+class FeatureMapWebDisplay(Display):
+    """
+    A display shared by all the monitored layers, which streams their feature maps to a browser.
+
+    Updates never block: the latest activation of a layer is handed over to a pool of encoding
+    threads, and if a layer is updated again before its previous frame was encoded, only the newest
+    activation is encoded. Clients only download the frames which changed since their last poll,
+    a slow client simply gets the newest frame of every layer on its next poll.
+    """
+
+    shared = True
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8008,
+        sample=0,
+        max_channels=16,
+        colormap="viridis",
+        workers=2,
+        poll_timeout=25.0,
+    ):
+        """
+        :param host: (str) address the server listens on
+        :param port: (int) port the server listens on, 0 picks a free port
+        :param sample: index of the sample to display, or a reduction over the batch (`mean`, `max`)
+        :param max_channels: (int) maximum number of channels tiled into every frame
+        :param colormap: (str) name of the matplotlib colormap of the frames
+        :param workers: (int) number of encoding threads
+        :param poll_timeout: (float) maximum number of seconds an update request waits for a frame
+        """
+        self.host = host
+        self.port = port
+        self.sample = sample
+        self.max_channels = max_channels
+        self.poll_timeout = poll_timeout
+        self._lut = colormap_lut(colormap)
+
+        self._lock = threading.Lock()
+        self._inputs = dict()  # layer name -> latest image waiting to be encoded
+        self._encoding = set()  # layers which have an encoding job queued or running
+        self._frames = dict()  # layer name -> (version, PNG bytes)
+        self._version = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="laymon-encoder"
+        )
+
+        self._loop, self._server, self._changed = (None, None, None)
+        started = threading.Event()
+        self._thread = threading.Thread(
+            target=self._serve, args=(started,), name="laymon-web", daemon=True
+        )
+        self._thread.start()
+        started.wait()
+
+    @property
+    def url(self):
+        """Returns the URL of the viewer."""
+        return f"http://{self.host}:{self.port}/"
+
+    def update_display(self, parameters, display_title):
+        """
+        Hands the new parameters of a layer over to the encoders, without waiting for them
+        :param parameters: Tensor (activation map params)
+        :param display_title: Name of the layer
+        """
+        image = feature_map_image(parameters, sample=self.sample, max_channels=self.max_channels)
+        image = image.cpu().float().numpy()
+        with self._lock:
+            self._inputs[display_title] = image
+            if display_title in self._encoding:
+                return  # The running job picks the newest image up.
+            self._encoding.add(display_title)
+        self._executor.submit(self._encode, display_title)
+
+    def _encode(self, layer_name):
+        while True:
+            with self._lock:
+                image = self._inputs.pop(layer_name, None)
+                if image is None:
+                    self._encoding.discard(layer_name)
+                    return
+            frame = encode_png(apply_colormap(image, self._lut))
+            with self._lock:
+                self._version += 1
+                self._frames[layer_name] = (self._version, frame)
+            self._loop.call_soon_threadsafe(self._wake_clients)
+
+    def refresh(self):
+        """Frames are encoded as soon as they are updated, there is nothing to redraw."""
+
+    def remove(self, layer_name):
+        """Stops serving the frames of a layer which is not monitored anymore."""
+        with self._lock:
+            self._inputs.pop(layer_name, None)
+            self._frames.pop(layer_name, None)
+            self._version += 1
+        self._loop.call_soon_threadsafe(self._wake_clients)
+
+    def get_frame(self, layer_name):
+        """Returns the (version, PNG bytes) of the latest frame of a layer, or None."""
+        with self._lock:
+            return self._frames.get(layer_name)
+
+    @staticmethod
+    def frame_path(layer_name):
+        """Returns the path of the latest frame of a layer, relative to the URL of the viewer."""
+        return "frame/" + quote(layer_name, safe="")
+
+    def _serve(self, started):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._changed = asyncio.Event()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    def _wake_clients(self):
+        # Wakes up the pending update requests, later requests wait on a new event.
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _changes(self, since):
+        with self._lock:
+            layers = {
+                name: version for name, (version, _) in self._frames.items() if version > since
+            }
+            return {"version": self._version, "layers": layers, "names": sorted(self._frames)}
+
+    async def _updates(self, since):
+        changes = self._changes(since)
+        if changes["version"] > since:
+            return changes
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=self.poll_timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._changes(since)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            method, target = request.decode("latin-1").split(" ", 2)[:2]
+            url = urlsplit(target)
+            if method != "GET":
+                status, content_type, body = ("405 Method Not Allowed", "text/plain", b"")
+            elif url.path == "/":
+                status, content_type, body = ("200 OK", "text/html", PAGE.encode())
+            elif url.path == "/updates":
+                since = int(parse_qs(url.query).get("since", ["0"])[0])
+                changes = await self._updates(since)
+                status, content_type, body = (
+                    "200 OK",
+                    "application/json",
+                    json.dumps(changes).encode(),
+                )
+            elif url.path.startswith("/frame/"):
+                frame = self.get_frame(unquote(url.path[len("/frame/") :]))
+                if frame is None:
+                    status, content_type, body = ("404 Not Found", "text/plain", b"")
+                else:
+                    status, content_type, body = ("200 OK", "image/png", frame[1])
+            else:
+                status, content_type, body = ("404 Not Found", "text/plain", b"")
+
+            header = (
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nCache-Control: no-store\r\nConnection: close\r\n\r\n"
+            )
+            writer.write(header.encode("latin-1") + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        """Stops the server and the encoders."""
+        if self._thread is None:
+            return
+        self._executor.shutdown(wait=True)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
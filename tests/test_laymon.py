@@ -2,10 +2,65 @@
 
 """Tests for `laymon` package."""
 
-
+import copy
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
+import urllib.request
+import warnings
+
+import matplotlib
+import numpy
+
+matplotlib.use("Agg")
+
+import matplotlib.image  # noqa: E402
+import torch  # noqa: E402
+import torch.nn as nn  # noqa: E402
+
+import laymon  # noqa: E402
+from laymon import distributed, drift, encoding, profiling  # noqa: E402
+from laymon.exceptions import ReplicatedLayerWarning  # noqa: E402
+from laymon.export import FeatureMapExporter  # noqa: E402
+from laymon.interfaces import Display  # noqa: E402
+from laymon.monitor import Capture, CaptureSlot  # noqa: E402
+from laymon.recording import FeatureMapRecorder, RecordingReader  # noqa: E402
+from laymon.rendering import AsyncRenderer, DROP_NEWEST, MAIN_THREAD  # noqa: E402
+from laymon.replay import FeatureMapReplay  # noqa: E402
+from laymon.sampling import EveryNCalls, RandomFraction, TimeInterval, TrainingOnly  # noqa: E402
+from laymon.statistics import STATISTICS, ActivationHistogram, ChannelStatistics  # noqa: E402
+from laymon.transfer import HostTransfer  # noqa: E402
+from laymon.transforms import CaptureTransform, ChannelSelector, feature_map_image  # noqa: E402
+from laymon.transforms import select_sample, tile_feature_maps  # noqa: E402
+from laymon.web import FeatureMapWebDisplay  # noqa: E402
+
+
+class RecordingDisplay(Display):
+    """A display which records the parameters it receives instead of drawing them."""
+
+    def __init__(self):
+        self.updates = []
+
+    def update_display(self, parameters, display_title):
+        self.updates.append((display_title, parameters))
+
 
-import laymon
+class SmallNet(nn.Module):
+    def __init__(self):
+        super(SmallNet, self).__init__()
+        self.conv1 = nn.Conv2d(3, 4, 3)
+        self.relu = nn.ReLU(inplace=True)
+        self.conv2 = nn.Conv2d(4, 6, 3)
+
+    def forward(self, x):
+        return self.conv2(self.relu(self.conv1(x)))
 
 
 class TestLaymon(unittest.TestCase):
@@ -19,3 +74,1627 @@ class TestLaymon(unittest.TestCase):
 
     def test_000_something(self):
         """Test something."""
+
+
+class TestAsyncRendering(unittest.TestCase):
+    """Tests for the background rendering mode of `FeatureMapMonitoring`."""
+
+    def setUp(self):
+        self.net = SmallNet()
+        self.displays = []
+
+        def display_factory():
+            display = RecordingDisplay()
+            self.displays.append(display)
+            return display
+
+        self.monitoring = laymon.FeatureMapMonitoring(async_render=True)
+        self.monitoring.observer_factory.display_object = display_factory
+        self.monitoring.add_model(self.net)
+
+    def tearDown(self):
+        self.monitoring.close()
+
+    def test_start_renders_in_background(self):
+        self.net(torch.randn(2, 3, 8, 8))
+        self.monitoring.start()
+        self.assertTrue(self.monitoring.flush(timeout=5))
+
+        titles = sorted(title for display in self.displays for title, _ in display.updates)
+        self.assertEqual(titles, ["conv1", "conv2", "relu"])
+
+    def test_snapshot_is_not_modified_by_inplace_layers(self):
+        captured = self.monitoring.monitor.get_registered_observers()
+        self.net(torch.randn(1, 3, 8, 8))
+        snapshot = dict(
+            (obj.get_layer_name(), params)
+            for obj, (params, _, _, _) in self.monitoring.monitor.snapshot_observers()
+        )
+        self.assertIsNot(snapshot["conv1"], captured["conv1"].parameters)
+        self.assertTrue(torch.equal(snapshot["conv1"], captured["conv1"].parameters))
+
+
+class TestProcessRendering(unittest.TestCase):
+    """Tests for the rendering process of `FeatureMapMonitoring`."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _monitoring(self, **display_options):
+        monitoring = laymon.FeatureMapMonitoring(async_render=True, draw_thread="process")
+        monitoring.observer_factory.display_object = FeatureMapRecorder
+        monitoring.observer_factory.display_options = dict(path=self.path, **display_options)
+        return monitoring
+
+    def test_displays_are_drawn_by_the_process(self):
+        net = SmallNet()
+        monitoring = self._monitoring(flush_every=1)
+        monitoring.add_layer(net.conv2, "conv2")
+        expected = []
+        for _ in range(3):
+            net(torch.randn(1, 3, 8, 8))
+            expected.append(monitoring.monitor.get_registered_observers()["conv2"].parameters)
+            monitoring.start()
+            self.assertTrue(monitoring.flush(timeout=30))
+        # The training process doesn't create any display.
+        self.assertEqual(monitoring.observer_factory._displays, {})
+        monitoring.close()
+
+        self.assertEqual(monitoring.renderer, None)
+        reader = RecordingReader(self.path)
+        self.assertEqual(reader.steps("conv2"), [1, 2, 3])
+        self.assertTrue(numpy.array_equal(reader.read("conv2", 3), expected[-1].numpy()))
+
+    def test_flush_raises_rendering_errors(self):
+        net = SmallNet()
+        monitoring = self._monitoring(dtype="int8")
+        monitoring.add_layer(net.conv2, "conv2")
+        net(torch.randn(1, 3, 8, 8))
+        monitoring.start()
+        with self.assertRaises(ValueError):
+            monitoring.flush(timeout=30)
+        monitoring.close()
+
+
+class TestAsyncRenderer(unittest.TestCase):
+    """Tests for the queue and drop policies of `AsyncRenderer`."""
+
+    class SlowObserver(object):
+        def __init__(self, gate):
+            self.gate = gate
+            self.seen = []
+
+        def update(self, parameters, step=None, channels=None):
+            self.gate.wait()
+            self.seen.append(parameters)
+
+    def _fill(self, drop_policy):
+        gate = threading.Event()
+        observer = self.SlowObserver(gate)
+        renderer = AsyncRenderer(max_queue_size=1, drop_policy=drop_policy)
+        renderer.submit([(observer, Capture(0, None, None, None))])
+        # Wait until the worker is blocked on the first batch.
+        while renderer.pending():
+            time.sleep(0.001)
+        for value in (1, 2, 3):
+            renderer.submit([(observer, Capture(value, None, None, None))])
+        gate.set()
+        renderer.close(timeout=5)
+        return renderer, observer
+
+    def test_drop_oldest(self):
+        renderer, observer = self._fill(drop_policy="drop_oldest")
+        self.assertEqual(observer.seen, [0, 3])
+        self.assertEqual(renderer.dropped, 2)
+
+    def test_drop_newest(self):
+        renderer, observer = self._fill(drop_policy=DROP_NEWEST)
+        self.assertEqual(observer.seen, [0, 1])
+        self.assertEqual(renderer.dropped, 2)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            AsyncRenderer(drop_policy="drop_all")
+
+    def test_main_thread_draws(self):
+        threads = []
+        observer = unittest.mock.Mock()
+        observer.update.side_effect = lambda *_, **__: threads.append(threading.current_thread())
+        renderer = AsyncRenderer(draw_thread=MAIN_THREAD)
+        renderer.submit([(observer, Capture(0, None, None, None))])
+        self.assertEqual(threads, [])
+        renderer.drain()
+        renderer.submit([(observer, Capture(1, None, None, None))])
+        renderer.close()
+        self.assertEqual(threads, [threading.main_thread()] * 2)
+
+    def test_flush_raises_rendering_errors(self):
+        observer = unittest.mock.Mock()
+        observer.update.side_effect = [ValueError("broken display"), None]
+        renderer = AsyncRenderer()
+        renderer.submit([(observer, Capture(0, None, None, None))])
+        with self.assertRaises(ValueError):
+            renderer.flush(timeout=5)
+        # The error is raised once, the renderer keeps rendering.
+        renderer.submit([(observer, Capture(1, None, None, None))])
+        self.assertTrue(renderer.flush(timeout=5))
+        renderer.close()
+        self.assertEqual(renderer.rendered, 2)
+
+
+class TestFeatureMapDisplay(unittest.TestCase):
+    """Tests for the artist reuse of `FeatureMapDisplay`."""
+
+    def setUp(self):
+        self.display = laymon.FeatureMapDisplay()
+
+    def tearDown(self):
+        matplotlib.pyplot.close("all")
+
+    def test_images_are_reused(self):
+        for _ in range(5):
+            self.display.update_display(torch.randn(2, 3, 6, 6), display_title="conv1")
+
+        self.assertEqual(len(self.display._subplots), 3)
+        for subplot in self.display._subplots:
+            self.assertEqual(len(subplot.images), 1)
+
+    def test_images_show_latest_activation(self):
+        self.display.update_display(torch.randn(1, 2, 4, 4), display_title="conv1")
+        activation = torch.arange(32, dtype=torch.float32).view(1, 2, 4, 4)
+        self.display.update_display(activation, display_title="conv1")
+
+        image = self.display._images[1]
+        self.assertTrue((image.get_array() == activation[0, 1].numpy()).all())
+        self.assertEqual(image.get_clim(), (16.0, 31.0))
+
+    def test_single_channel(self):
+        self.display.update_display(torch.randn(1, 1, 4, 4), display_title="conv1")
+        self.assertEqual(len(self.display._images), 1)
+
+    def test_release_closes_figure(self):
+        net = SmallNet()
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.add_layer(net.conv1, "conv1")
+        net(torch.randn(1, 3, 8, 8))
+        monitoring.start()
+        display = monitoring.observer_factory._displays["conv1"]
+        number = display._figure.number
+
+        monitoring.remove_layer("conv1")
+        self.assertFalse(matplotlib.pyplot.fignum_exists(number))
+        self.assertIsNone(display._figure)
+
+
+class TestFeatureMapGrid(unittest.TestCase):
+    """Tests for the batch-aware mosaic display."""
+
+    def tearDown(self):
+        matplotlib.pyplot.close("all")
+
+    def test_tile_feature_maps_layout(self):
+        feature_maps = torch.arange(5 * 2 * 3, dtype=torch.float32).view(5, 2, 3)
+        mosaic = tile_feature_maps(feature_maps, max_channels=5, padding=1)
+
+        # 5 channels -> 2 rows x 3 columns of (2 + 1) x (3 + 1) tiles, minus the outer padding.
+        self.assertEqual(tuple(mosaic.shape), (2 * 3 - 1, 3 * 4 - 1))
+        self.assertTrue(torch.equal(mosaic[0:2, 0:3], feature_maps[0]))
+        self.assertTrue(torch.equal(mosaic[0:2, 4:7], feature_maps[1]))
+        self.assertTrue(torch.equal(mosaic[3:5, 4:7], feature_maps[4]))
+        self.assertTrue(torch.isnan(mosaic[3:5, 8:11]).all())
+
+    def test_select_sample(self):
+        activation = torch.randn(4, 3, 2, 2)
+        self.assertTrue(torch.equal(select_sample(activation, 2), activation[2]))
+        self.assertTrue(torch.allclose(select_sample(activation, "mean"), activation.mean(0)))
+        with self.assertRaises(ValueError):
+            select_sample(activation, "median")
+
+    def test_one_draw_per_update(self):
+        display = laymon.FeatureMapGridDisplay(sample="mean", max_channels=4)
+        display.update_display(torch.randn(128, 6, 5, 5), display_title="conv1")
+        draws = []
+        display._redraw = lambda: draws.append(1)
+        display.update_display(torch.randn(128, 6, 5, 5), display_title="conv1")
+
+        self.assertEqual(len(draws), 1)
+        self.assertEqual(len(display._images), 1)
+        self.assertEqual(display._images[0].get_array().shape, (11, 11))
+
+    def test_non_spatial_outputs(self):
+        display = laymon.FeatureMapGridDisplay(max_channels=4)
+        display.update_display(torch.randn(4, 6, 10), display_title="conv1d")
+        self.assertEqual(display._images[0].get_array().shape, (6, 10))
+        display = laymon.FeatureMapGridDisplay(max_channels=4)
+        display.update_display(torch.randn(4, 6), display_title="fc")
+        self.assertEqual(display._images[0].get_array().shape, (1, 6))
+
+    def test_display_options_are_not_shared(self):
+        first, second = (laymon.FeatureMapMonitoring(), laymon.FeatureMapMonitoring())
+        first.observer_factory.display_object = laymon.FeatureMapGridDisplay
+        first.observer_factory.display_options["max_channels"] = 4
+
+        self.assertEqual(second.observer_factory.display_options, {})
+        self.assertIsNone(type(first.observer_factory).display_options)
+        first.add_layer(SmallNet().conv1, "conv1")
+        self.assertEqual(first.observer_factory._displays["conv1"].max_channels, 4)
+
+
+class TestSamplingPolicies(unittest.TestCase):
+    """Tests for the capture sampling policies of `FeatureMapMonitor`."""
+
+    def setUp(self):
+        self.net = SmallNet()
+        self.inputs = torch.randn(1, 3, 8, 8)
+
+    def _monitoring(self, **kwargs):
+        monitoring = laymon.FeatureMapMonitoring(**kwargs)
+        monitoring.observer_factory.display_object = RecordingDisplay
+        return monitoring
+
+    def test_every_n_calls_per_monitor(self):
+        monitoring = self._monitoring(sampling_policy=EveryNCalls(3))
+        monitoring.add_model(self.net)
+        for _ in range(7):
+            self.net(self.inputs)
+
+        counts = monitoring.monitor.get_capture_counts()
+        self.assertEqual(counts["conv1"], {"captured": 2, "skipped": 5})
+        # Every layer keeps its own copy of the monitor's policy.
+        self.assertEqual(counts["conv2"], {"captured": 2, "skipped": 5})
+
+    def test_training_only_per_layer(self):
+        monitoring = self._monitoring()
+        monitoring.add_layer(self.net.conv1, "conv1", sampling_policy=TrainingOnly())
+        monitoring.add_layer(self.net.conv2, "conv2")
+
+        self.net.eval()
+        self.net(self.inputs)
+        observers = monitoring.monitor.get_registered_observers()
+        self.assertIsNone(observers["conv1"].parameters)
+        self.assertIsNotNone(observers["conv2"].parameters)
+
+        self.net.train()
+        self.net(self.inputs)
+        self.assertIsNotNone(observers["conv1"].parameters)
+        self.assertEqual(monitoring.monitor.get_capture_counts()["conv1"]["skipped"], 1)
+
+    def test_time_interval(self):
+        now = [0.0]
+        policy = TimeInterval(seconds=1.0, clock=lambda: now[0])
+        decisions = []
+        for timestamp in (0.0, 0.5, 1.0, 1.2, 2.5):
+            now[0] = timestamp
+            decisions.append(policy.should_capture(self.net))
+        self.assertEqual(decisions, [True, False, True, False, True])
+
+    def test_random_fraction(self):
+        policy = RandomFraction(0.25, seed=0)
+        captured = sum(policy.should_capture(self.net) for _ in range(4000))
+        self.assertAlmostEqual(captured / 4000, 0.25, delta=0.03)
+        self.assertFalse(any(RandomFraction(0.0).should_capture(self.net) for _ in range(100)))
+
+
+class TestCaptureTransform(unittest.TestCase):
+    """Tests for the reduction of the activations before they are retained."""
+
+    def test_stages(self):
+        activation = torch.randn(8, 32, 20, 20)
+        reduced = CaptureTransform(sample=3, max_channels=5, output_size=10, dtype=torch.float16)(
+            activation
+        )
+        self.assertEqual(tuple(reduced.shape), (1, 5, 10, 10))
+        self.assertEqual(reduced.dtype, torch.float16)
+        expected = torch.nn.functional.adaptive_avg_pool2d(activation[3:4, :5], 10).half()
+        self.assertTrue(torch.equal(reduced, expected))
+
+    def test_quantize(self):
+        activation = torch.randn(2, 3, 4, 4)
+        reduced = CaptureTransform(dtype=torch.uint8)(activation)
+        self.assertEqual(reduced.dtype, torch.uint8)
+        self.assertTrue((reduced.amin(dim=(2, 3)) == 0).all())
+        self.assertTrue((reduced.amax(dim=(2, 3)) == 255).all())
+
+    def test_views_are_copied(self):
+        activation = torch.randn(1, 16, 4, 4)
+        reduced = CaptureTransform(max_channels=2)(activation)
+        self.assertNotEqual(
+            reduced.untyped_storage().data_ptr(), activation.untyped_storage().data_ptr()
+        )
+        self.assertEqual(reduced.untyped_storage().nbytes(), 2 * 4 * 4 * 4)
+
+    def test_retained_bytes(self):
+        net = SmallNet()
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory.display_object = RecordingDisplay
+        monitoring.add_layer(
+            net.conv1, "conv1", capture_transform=CaptureTransform(sample="mean", dtype=torch.uint8)
+        )
+        monitoring.add_layer(net.conv2, "conv2")
+        net(torch.randn(4, 3, 8, 8))
+
+        retained = monitoring.monitor.get_retained_bytes()
+        self.assertEqual(retained["conv1"], 4 * 6 * 6)
+        self.assertEqual(retained["conv2"], 4 * 6 * 4 * 4 * 4)
+
+        # The reduced activations keep a batch dimension of 1 and are still displayed.
+        monitoring.start()
+        observer = monitoring.monitor.get_registered_observers()["conv1"].object
+        display = observer._update_display.__self__
+        self.assertEqual(tuple(display.updates[-1][1].shape), (1, 4, 6, 6))
+
+
+class TestChannelSelector(unittest.TestCase):
+    """Tests for the selection of the most informative channels."""
+
+    def test_scores(self):
+        activation = torch.zeros(4, 8, 5, 5)
+        activation[:, 6] = 3.0
+        activation[:, 2] = torch.randn(4, 5, 5)
+        energy = ChannelSelector(k=2, score="energy")
+        self.assertEqual(energy.select(activation).tolist(), [2, 6])
+        variance = ChannelSelector(k=1, score="variance")
+        self.assertEqual(variance.select(activation).tolist(), [2])
+
+        change = ChannelSelector(k=1, score="change", hysteresis=0.0)
+        self.assertEqual(change.select(activation).tolist(), [6])
+        changed = activation.clone()
+        changed[:, 4] += 1.0
+        self.assertEqual(change.select(changed).tolist(), [4])
+        with self.assertRaises(ValueError):
+            ChannelSelector(score="norm")
+
+    def test_hysteresis(self):
+        selector = ChannelSelector(k=1, hysteresis=0.5)
+        activation = torch.ones(1, 3, 2, 2)
+        activation[:, 0] = 2.0
+        self.assertEqual(selector.select(activation).tolist(), [0])
+        # Channel 1 scores higher, but not by enough to replace the selected channel.
+        activation[:, 1] = 2.2
+        self.assertEqual(selector.select(activation).tolist(), [0])
+        activation[:, 1] = 3.0
+        self.assertEqual(selector.select(activation).tolist(), [1])
+
+    def test_capture_transform(self):
+        activation = torch.randn(4, 16, 6, 6)
+        activation[:, 9] *= 10
+        activation[:, 13] *= 10
+        transform = CaptureTransform(sample=1, channel_selector=ChannelSelector(k=2))
+        reduced = transform(activation)
+        self.assertTrue(torch.equal(reduced, activation[1:2, [9, 13]]))
+
+        # Every layer gets its own copy of the monitor's transform, and its own selection.
+        net = SmallNet()
+        monitoring = laymon.FeatureMapMonitoring(capture_transform=transform)
+        monitoring.add_layer(net.conv1, "conv1")
+        monitoring.add_layer(net.conv2, "conv2")
+        net(torch.randn(2, 3, 8, 8))
+        observers = monitoring.monitor.get_registered_observers()
+        self.assertEqual(tuple(observers["conv2"].parameters.shape), (1, 2, 4, 4))
+        selectors = [observers[name].capture_transform.channel_selector for name in observers]
+        self.assertIsNot(selectors[0], selectors[1])
+        self.assertEqual(transform.channel_selector.selected.tolist(), [9, 13])
+
+    def test_selection_beyond_max_channels(self):
+        # The energy of the channels rises with their index.
+        activation = torch.arange(8, dtype=torch.float32).view(1, 8, 1, 1).expand(2, 8, 3, 3)
+        transform = CaptureTransform(max_channels=2, channel_selector=ChannelSelector(k=4))
+        reduced = transform(activation)
+        self.assertEqual(transform.channels.tolist(), [6, 7])
+        self.assertTrue(torch.equal(reduced, activation[:, [6, 7]]))
+
+    def test_displays_label_selected_channels(self):
+        net = SmallNet()
+        transform = CaptureTransform(sample=0, channel_selector=ChannelSelector(k=3))
+        monitoring = laymon.FeatureMapMonitoring(capture_transform=transform, host_transfer=True)
+        monitoring.add_layer(net.conv2, "conv2")
+        grid = laymon.FeatureMapGridDisplay()
+        self.addCleanup(matplotlib.pyplot.close, "all")
+
+        for _ in range(3):
+            net(torch.randn(2, 3, 8, 8))
+            monitoring.start()
+            capture = monitoring.monitor.get_registered_observers()["conv2"].slot.latest()
+            grid.update_display(capture.parameters, "conv2", channels=capture.channels)
+
+            selected = capture.channels.tolist()
+            self.assertEqual(len(selected), 3)
+            display = monitoring.observer_factory._displays["conv2"]
+            titles = [subplot.get_title() for subplot in display._subplots]
+            self.assertEqual(titles, [f"channel {channel}" for channel in selected])
+            channels = ", ".join(str(channel) for channel in selected)
+            self.assertEqual(grid._subplots[0].get_title(), f"channels {channels}")
+
+
+class TestHostTransfer(unittest.TestCase):
+    """Tests for the device to host transfer stage."""
+
+    class FakeEvent(object):
+        def __init__(self, done=False):
+            self.done = done
+
+        def query(self):
+            return self.done
+
+    def test_zero_copy_on_cpu(self):
+        net = SmallNet()
+        monitoring = laymon.FeatureMapMonitoring(host_transfer=True)
+        monitoring.observer_factory.display_object = RecordingDisplay
+        monitoring.add_layer(net.conv2, "conv2")
+        out = net(torch.randn(2, 3, 8, 8))
+
+        snapshot = monitoring.monitor.snapshot_observers()
+        self.assertEqual(len(snapshot), 1)
+        self.assertTrue(torch.equal(snapshot[0][1].parameters, out))
+        ready = monitoring.monitor._host_transfer.completed("conv2")
+        self.assertEqual(ready.parameters.data_ptr(), out.data_ptr())
+        self.assertEqual((ready.generation, ready.step), (1, 1))
+        self.assertEqual(snapshot[0][1].step, 1)
+
+    def test_only_completed_copies_are_handed_over(self):
+        transfer = HostTransfer()
+        first = Capture(torch.zeros(2), 10, 1, torch.tensor([3, 5]))
+        second = Capture(torch.ones(2), 20, 2, None)
+        events = (self.FakeEvent(), self.FakeEvent())
+        transfer._pending["conv"].extend([(first, events[0], None), (second, events[1], None)])
+
+        self.assertIsNone(transfer.completed("conv"))
+        events[0].done = True
+        ready = transfer.completed("conv")
+        self.assertEqual((ready.step, ready.generation), (10, 1))
+        self.assertTrue(torch.equal(ready.channels, first.channels))
+        events[1].done = True
+        ready = transfer.completed("conv")
+        self.assertEqual((ready.step, ready.generation), (20, 2))
+        self.assertTrue(torch.equal(ready.parameters, second.parameters))
+
+    def test_in_flight_copies_are_bounded(self):
+        transfer = HostTransfer(max_in_flight=2)
+        events = (self.FakeEvent(), self.FakeEvent())
+        transfer._pending["conv"].extend(
+            [(Capture(torch.zeros(2), 0, 1, None), event, None) for event in events]
+        )
+        parameters = unittest.mock.Mock(device=torch.device("cuda"))
+
+        transfer.submit("conv", Capture(parameters, 1, 2, None))
+        self.assertEqual(transfer.dropped, 1)
+        self.assertEqual(len(transfer._pending["conv"]), 2)
+        events[0].done = True
+        transfer._reap("conv")
+        self.assertEqual(len(transfer._pending["conv"]), 1)
+
+    def test_handed_over_copies_outlive_the_buffers(self):
+        transfer = HostTransfer()
+        first = Capture(torch.zeros(2, 4), 1, 1, None)
+        second = Capture(torch.ones(2, 4), 2, 2, None)
+        events = (self.FakeEvent(), self.FakeEvent())
+        transfer._pending["conv"].extend([(first, events[0], None), (second, events[1], None)])
+
+        events[0].done = True
+        ready = transfer.completed("conv")
+        self.assertIsNot(ready.parameters, first.parameters)
+        self.assertIs(transfer.completed("conv"), ready)
+        events[1].done = True
+        transfer._reap("conv")
+        # The superseded buffer goes back to the pool even though its copy is still held.
+        self.assertEqual(transfer._pool[((2, 4), torch.float32)], [first.parameters])
+        first.parameters.fill_(5)
+        self.assertTrue(torch.equal(ready.parameters, torch.zeros(2, 4)))
+
+    @unittest.skipUnless(torch.cuda.is_available(), "requires a CUDA device")
+    def test_pinned_buffers_are_reused(self):
+        transfer = HostTransfer()
+        buffers = set()
+        for step in range(3):
+            parameters = torch.full((4, 4), float(step), device="cuda")
+            transfer.submit("conv", Capture(parameters, step, step + 1, None))
+            torch.cuda.synchronize()
+            ready = transfer.completed("conv").parameters
+            self.assertEqual(ready[0, 0].item(), float(step))
+            buffers.add(transfer._ready["conv"][0].parameters.data_ptr())
+        # The buffer of the first step is reused by the third one.
+        self.assertEqual(len(buffers), 2)
+
+
+class TestFeatureMapRecorder(unittest.TestCase):
+    """Tests for the headless on-disk recording of the feature maps."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_record_and_read(self):
+        net = SmallNet()
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory.display_object = FeatureMapRecorder
+        monitoring.observer_factory.display_options = {
+            "path": self.path,
+            "chunk_size": 4,
+            "flush_every": 3,
+        }
+        monitoring.add_layer(net.conv1, "conv1")
+        monitoring.add_layer(net.conv2, "conv2")
+
+        expected = []
+        for _ in range(10):
+            net(torch.randn(2, 3, 8, 8))
+            observers = monitoring.monitor.get_registered_observers()
+            expected.append(observers["conv2"].parameters.clone())
+            monitoring.start()
+        monitoring.close()
+
+        reader = RecordingReader(self.path)
+        self.assertEqual(reader.layers(), ["conv1", "conv2"])
+        # The frames are keyed by the steps of the captures, the passes of the layer.
+        self.assertEqual(reader.steps("conv2"), list(range(1, 11)))
+        frame = reader.read("conv2", 7)
+        self.assertIsInstance(frame, numpy.memmap)
+        self.assertTrue(numpy.array_equal(frame, expected[6].numpy()))
+        with self.assertRaises(KeyError):
+            reader.read("conv2", 11)
+
+    def test_frames_are_keyed_by_capture_step(self):
+        net = SmallNet()
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory.display_object = FeatureMapRecorder
+        monitoring.observer_factory.display_options = {"path": self.path, "flush_every": 1}
+        monitoring.add_layer(net.conv2, "conv2", sampling_policy=EveryNCalls(3))
+
+        expected = dict()
+        for _ in range(9):
+            net(torch.randn(1, 3, 8, 8))
+            capture = monitoring.monitor.get_registered_observers()["conv2"].slot.latest()
+            if capture is not None:
+                expected[capture.step] = capture.parameters.clone()
+            # Notifying again without a new capture doesn't record the capture twice.
+            monitoring.start()
+        monitoring.close()
+
+        reader = RecordingReader(self.path)
+        self.assertEqual(reader.steps("conv2"), sorted(expected))
+        self.assertEqual(len(expected), 3)
+        for step, parameters in expected.items():
+            self.assertTrue(numpy.array_equal(reader.read("conv2", step), parameters.numpy()))
+
+    def test_open_segments_are_bounded(self):
+        recorder = FeatureMapRecorder(self.path, chunk_size=2, flush_every=1)
+        frames = [torch.randn(1, 2, 3, 3) for _ in range(8)]
+        for frame in frames:
+            recorder.record(frame, layer_name="conv")
+        recorder.close()
+
+        reader = RecordingReader(self.path, max_open_segments=2)
+        for step in (0, 7, 2, 5, 3, 6):
+            self.assertTrue(numpy.array_equal(reader.read("conv", step), frames[step].numpy()))
+            self.assertLessEqual(len(reader._segments), 2)
+        self.assertEqual(list(reader._segments), [("conv", 1, "file"), ("conv", 3, "file")])
+
+    def test_quantized_segments_follow_frame_shape(self):
+        recorder = FeatureMapRecorder(self.path, dtype="uint8", chunk_size=8, flush_every=100)
+        recorder.record(torch.randn(2, 3, 4, 4), layer_name="conv", step=10)
+        recorder.record(torch.randn(1, 3, 4, 4), layer_name="conv", step=20)
+        recorder.record(torch.randn(1, 3, 4, 4), layer_name="conv")
+
+        # Nothing is written until the buffer is flushed.
+        self.assertEqual(RecordingReader(self.path).layers(), [])
+        recorder.close()
+
+        reader = RecordingReader(self.path)
+        self.assertEqual(reader.steps("conv"), [10, 20, 21])
+        self.assertEqual(reader.read("conv", 10).shape, (2, 3, 4, 4))
+        self.assertEqual(reader.read("conv", 21).dtype, numpy.uint8)
+        self.assertEqual(len(reader._indexes["conv"]["segments"]), 2)
+
+    def test_delta_encoding(self):
+        raw_path, delta_path = (os.path.join(self.path, "raw"), os.path.join(self.path, "delta"))
+        raw = FeatureMapRecorder(raw_path, chunk_size=2)
+        delta = FeatureMapRecorder(delta_path, chunk_size=2, delta=True)
+        frames = [torch.randn(2, 4, 16, 16) * 10]
+        for _ in range(9):
+            # A few activations change, the others only by less than the tolerance.
+            frame = frames[-1] + 1e-4 * torch.randn(2, 4, 16, 16)
+            frame.view(-1)[torch.randint(0, frame.numel(), (20,))] += 1.0
+            frames.append(frame)
+        # A small change of all the activations doesn't drift, but is too dense to be a delta.
+        frames.append(frames[-1] + 0.01 * torch.randn(2, 4, 16, 16))
+        for step, frame in enumerate(frames):
+            raw.record(frame, layer_name="conv", step=step)
+            delta.record(frame, layer_name="conv", step=step)
+        raw.close()
+        delta.close()
+
+        reader = RecordingReader(delta_path)
+        self.assertEqual(reader.steps("conv"), list(range(11)))
+        locations = reader._get_locations("conv")
+        self.assertEqual([step for step in range(11) if locations[step][0] == "file"], [0, 10])
+        deltas = reader._segment("conv", 0, kind="deltas")
+        self.assertEqual(deltas["references"].tolist(), [0] * 9)
+        for step in (0, 3, 9, 10):
+            frame = reader.read("conv", step)
+            self.assertEqual(frame.dtype, numpy.float32)
+            numpy.testing.assert_allclose(frame, frames[step].numpy(), atol=2e-3)
+
+        def size(path):
+            directory = os.path.join(path, "conv")
+            return sum(
+                os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+            )
+
+        # Only two keyframes are stored, the stable frames cost a few hundred bytes.
+        self.assertLess(size(delta_path), 0.3 * size(raw_path))
+        with self.assertRaises(ValueError):
+            FeatureMapRecorder(self.path, dtype="uint8", delta=True)
+
+
+class TestFeatureMapReplay(unittest.TestCase):
+    """Tests for the offline replay of a recording."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        recorder = FeatureMapRecorder(self.directory.name, chunk_size=16)
+        self.frames = [torch.full((1, 2, 3, 3), float(step)) for step in range(40)]
+        for frame in self.frames:
+            recorder.record(frame, layer_name="conv")
+        recorder.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lru_cache(self):
+        replay = FeatureMapReplay(
+            self.directory.name, display_object=None, cache_size=3, prefetch=0
+        )
+        for step in (0, 1, 2, 0, 3):
+            self.assertTrue(torch.equal(replay.frame("conv", step), self.frames[step]))
+        self.assertEqual(list(replay._cache), [("conv", 2), ("conv", 0), ("conv", 3)])
+        self.assertEqual((replay.hits, replay.misses), (1, 4))
+        replay.close()
+
+    def test_seek_prefetches_next_frames(self):
+        display = RecordingDisplay()
+        replay = FeatureMapReplay(
+            self.directory.name, display_object=lambda: display, cache_size=64, prefetch=4
+        )
+        replay.seek("conv", 10)
+        replay._executor.submit(lambda: None).result()  # Wait for the prefetching to complete.
+        for step in range(11, 15):
+            self.assertTrue(torch.equal(replay.frame("conv", step), self.frames[step]))
+        self.assertEqual(replay.hits, 4)
+        self.assertEqual(display.updates[0][0], "conv")
+        replay.close()
+
+
+class TestAddModel(unittest.TestCase):
+    """Tests for the registration of the layers of a model."""
+
+    def setUp(self):
+        self.net = nn.Sequential(
+            nn.Conv2d(3, 4, 3),
+            nn.Sequential(nn.Conv2d(4, 4, 3), nn.Sequential(nn.ReLU(), nn.Conv2d(4, 2, 1))),
+            nn.ModuleList([nn.Linear(2, 2)]),
+        )
+        self.monitoring = laymon.FeatureMapMonitoring()
+        self.monitoring.observer_factory.display_object = RecordingDisplay
+
+    def test_children_only_by_default(self):
+        self.assertEqual(self.monitoring.add_model(self.net), ["0", "1", "2"])
+
+    def test_recursive_skips_redundant_containers(self):
+        names = self.monitoring.add_model(self.net, recursive=True)
+        self.assertEqual(names, ["0", "1.0", "1.1.0", "1.1.1", "2.0"])
+
+    def test_filters(self):
+        self.assertEqual(
+            self.monitoring.add_model(self.net, recursive=True, layer_types=nn.Conv2d, max_depth=2),
+            ["0", "1.0"],
+        )
+        self.assertEqual(
+            self.monitoring.add_model(
+                self.net, recursive=True, include="1.*", exclude=re.compile(r"\.0$")
+            ),
+            ["1.1.1"],
+        )
+
+    def test_containers_are_kept_if_their_output_is_not_monitored(self):
+        names = self.monitoring.add_model(self.net, recursive=True, layer_types=nn.Sequential)
+        self.assertEqual(names, ["1", "1.1"])
+
+    def test_no_duplicate_hooks(self):
+        self.monitoring.add_model(self.net, recursive=True)
+        self.assertEqual(self.monitoring.add_model(self.net, recursive=True), [])
+        self.monitoring.add_layer(self.net[0], "first_conv")
+        self.assertNotIn("first_conv", self.monitoring.monitor.get_registered_observers())
+        self.assertEqual(len(self.net[0]._forward_hooks), 1)
+
+    def test_same_layer_under_two_names(self):
+        first = self.monitoring.add_layer(self.net[0], "a")
+        second = self.monitoring.add_layer(self.net[0], "b")
+        self.assertIs(second, first)
+        self.assertEqual(list(self.monitoring.observer_factory._displays), ["a"])
+        self.assertEqual(list(self.monitoring.monitor.get_registered_observers()), ["a"])
+        with self.assertRaises(NameError):
+            self.monitoring.add_layer(self.net[1][0], "a")
+        self.assertEqual(list(self.monitoring.observer_factory._displays), ["a"])
+
+        self.assertTrue(self.monitoring.remove_layer(second.get_layer_name()))
+        self.assertEqual(self.monitoring.observer_factory._displays, {})
+
+    def test_many_layers(self):
+        model = nn.Sequential(*[nn.Sequential(nn.Linear(2, 2), nn.ReLU()) for _ in range(1000)])
+        begin = time.perf_counter()
+        names = self.monitoring.add_model(model, recursive=True)
+        self.assertEqual(len(names), 2000)
+        self.assertLess(time.perf_counter() - begin, 10)
+
+
+class TestChannelStatistics(unittest.TestCase):
+    """Tests for the per-channel statistics mode."""
+
+    def test_statistics(self):
+        activation = torch.relu(torch.randn(4, 3, 5, 5))
+        statistics = ChannelStatistics()(activation)
+
+        values = activation.transpose(0, 1).reshape(3, -1)
+        expected = torch.stack(
+            (
+                values.mean(1),
+                values.std(1, unbiased=False),
+                values.min(1)[0],
+                values.max(1)[0],
+                (values == 0).float().mean(1),
+                values.norm(dim=1),
+            )
+        )
+        self.assertTrue(torch.allclose(statistics, expected, atol=1e-5))
+
+    def test_running_aggregates(self):
+        # The statistics are merged by batches of two captures, the last one when they are read.
+        statistics = ChannelStatistics(merge_every=2)
+        captures = [torch.randn(2, 4, 3, 3) * (step + 1) + step for step in range(5)]
+        for capture in captures:
+            statistics(capture)
+
+        values = torch.cat(captures).transpose(0, 1).reshape(4, -1)
+        self.assertEqual(len(statistics._pending), 1)
+        running = statistics.running()
+        self.assertEqual(statistics.count, values.size(1))
+        self.assertTrue(torch.allclose(running["mean"], values.mean(1), atol=1e-5))
+        self.assertTrue(torch.allclose(running["std"], values.std(1, unbiased=False), atol=1e-4))
+        self.assertTrue(torch.equal(running["max"], values.max(1)[0]))
+
+    def test_stats_monitoring(self):
+        net = nn.Sequential(nn.Conv2d(3, 4, 3), nn.ReLU(), nn.Flatten(), nn.Linear(144, 2))
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory = laymon.FeatureMapStatsObserverFactory()
+        monitoring.add_model(net)
+        with torch.no_grad():
+            net[0].weight.zero_()
+            net[0].bias.fill_(-1.0)
+        net(torch.randn(2, 3, 8, 8))
+
+        retained = monitoring.monitor.get_retained_bytes()
+        self.assertEqual(retained["0"], len(STATISTICS) * 4 * 4)
+        self.assertEqual(retained["3"], len(STATISTICS) * 2 * 4)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")  # Single dimensional layers are fine for statistics.
+            monitoring.start()
+        relu_display = monitoring.observer_factory._displays["1"]
+        self.assertEqual(relu_display.dead_channels, [0, 1, 2, 3])
+
+    def test_stats_every_n_passes(self):
+        net = nn.Sequential(nn.Linear(4, 3))
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory = laymon.FeatureMapStatsObserverFactory()
+        monitoring.observer_factory.observer_options = {"every": 3}
+        monitoring.add_model(net)
+        for _ in range(7):
+            net(torch.randn(2, 4))
+
+        self.assertEqual(
+            monitoring.monitor.get_capture_counts()["0"], {"captured": 2, "skipped": 5}
+        )
+        observer = monitoring.monitor.get_registered_observers()["0"].object
+        self.assertEqual(observer._statistics.count, 4)
+
+
+class TestActivationHistogram(unittest.TestCase):
+    """Tests for the histogram observer and its ring buffer."""
+
+    def tearDown(self):
+        matplotlib.pyplot.close("all")
+
+    def test_ring_buffer(self):
+        histogram = ActivationHistogram(bins=4, value_range=(0.0, 4.0), history=3)
+        for value in (0.5, 1.5, 2.5, 3.5):
+            ring = histogram(torch.full((2, 5), value))
+            self.assertNotEqual(ring.data_ptr(), histogram._ring.data_ptr())
+
+        # The oldest capture (0.5) was overwritten, the history is ordered oldest first.
+        expected = torch.tensor([[0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0]])
+        self.assertTrue(torch.equal(ring, expected))
+        self.assertEqual(histogram._ring.shape, (3, 4))
+
+    def test_values_are_clamped(self):
+        histogram = ActivationHistogram(bins=2, value_range=(-1.0, 1.0), history=1)
+        ring = histogram(torch.tensor([-100.0, 100.0, 100.0, 0.5]))
+        self.assertTrue(torch.equal(ring[0], torch.tensor([0.25, 0.75])))
+
+    def test_histogram_monitoring(self):
+        net = nn.Sequential(nn.Linear(4, 8), nn.ReLU())
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory = laymon.FeatureMapHistogramObserverFactory()
+        monitoring.observer_factory.observer_options = {"bins": 16, "history": 10}
+        monitoring.add_model(net)
+        for _ in range(3):
+            net(torch.randn(2, 4))
+            monitoring.start()
+
+        display = monitoring.observer_factory._displays["1"]
+        self.assertEqual(len(display._images), 1)
+        self.assertEqual(display._images[0].get_array().shape, (16, 10))
+        self.assertEqual(monitoring.monitor.get_retained_bytes()["1"], 16 * 10 * 4)
+
+
+class TestGradientMonitoring(unittest.TestCase):
+    """Tests for the monitoring of the gradients through full backward hooks."""
+
+    def setUp(self):
+        self.net = nn.Sequential(nn.Conv2d(3, 4, 3), nn.ReLU(), nn.Conv2d(4, 2, 3))
+        self.inputs = torch.randn(2, 3, 8, 8)
+
+    def _monitoring(self, **kwargs):
+        monitoring = laymon.FeatureMapMonitoring(monitor_gradients=True, **kwargs)
+        monitoring.observer_factory.display_object = RecordingDisplay
+        monitoring.add_model(self.net)
+        return monitoring
+
+    def test_gradients_are_captured(self):
+        monitoring = self._monitoring()
+        output = self.net(self.inputs)
+        grad_output = torch.randn_like(output)
+        output.backward(grad_output)
+
+        observers = monitoring.gradient_monitor.get_registered_observers()
+        self.assertEqual(sorted(observers), ["0.grad", "1.grad", "2.grad"])
+        self.assertTrue(torch.equal(observers["2.grad"].parameters, grad_output))
+
+        step, activations, gradients = monitoring.gradient_monitor.get_paired_captures("0.grad")
+        self.assertEqual(step, 1)
+        self.assertEqual(activations.shape, gradients.shape)
+
+        monitoring.start()
+        titles = set(
+            title
+            for display in monitoring.observer_factory._displays.values()
+            for title, _ in display.updates
+        )
+        self.assertEqual(titles, {"0", "1", "2", "0.grad", "1.grad", "2.grad"})
+
+    def test_gradients_follow_forward_sampling(self):
+        monitoring = self._monitoring(
+            sampling_policy=EveryNCalls(2), capture_transform=CaptureTransform(sample=0)
+        )
+        for _ in range(3):
+            self.net(self.inputs).sum().backward()
+
+        counts = monitoring.gradient_monitor.get_capture_counts()
+        self.assertEqual(counts["2.grad"], {"captured": 1, "skipped": 2})
+        observers = monitoring.gradient_monitor.get_registered_observers()
+        self.assertEqual(observers["2.grad"].step, 2)
+        self.assertEqual(tuple(observers["2.grad"].parameters.shape), (1, 2, 4, 4))
+        # Both captures of the layer belong to the second step.
+        step, activations, _ = monitoring.gradient_monitor.get_paired_captures("2.grad")
+        self.assertEqual(step, 2)
+        self.assertEqual(monitoring.monitor.get_registered_observers()["2"].step, 2)
+
+        # A captured forward pass without its backward pass can't be paired.
+        self.net(self.inputs)
+        self.assertIsNone(monitoring.gradient_monitor.get_paired_captures("2.grad"))
+
+    def test_gradients_are_not_gated_by_forward_drift(self):
+        monitoring = self._monitoring(drift_gate=drift.DriftGate(threshold=10.0))
+        for _ in range(3):
+            self.net(self.inputs).sum().backward()
+
+        # The activations drift on the first pass only, the gradients are captured on every pass.
+        self.assertEqual(monitoring.monitor.get_unchanged_counts()["2"], 2)
+        counts = monitoring.gradient_monitor.get_capture_counts()
+        self.assertEqual(counts["2.grad"], {"captured": 3, "skipped": 0})
+
+    def test_replicas_are_not_captured(self):
+        monitoring = self._monitoring()
+        # The replicas of nn.DataParallel share the hooks of the layer.
+        replica = copy.copy(self.net[0])
+        with self.assertWarns(ReplicatedLayerWarning):
+            replica(self.inputs).sum().backward()
+        counts = monitoring.monitor.get_capture_counts()
+        self.assertEqual(counts["0"], {"captured": 0, "skipped": 0})
+        self.assertEqual(monitoring.gradient_monitor.get_capture_counts()["0.grad"]["captured"], 0)
+
+        self.net(self.inputs).sum().backward()
+        self.assertEqual(monitoring.monitor.get_capture_counts()["0"]["captured"], 1)
+
+    def test_remove_layer(self):
+        monitoring = self._monitoring()
+        monitoring.remove_layer("1")
+        self.assertNotIn("1.grad", monitoring.gradient_monitor.get_registered_observers())
+        self.assertEqual(len(self.net[1]._backward_hooks), 0)
+
+
+class TestFeatureMapDashboard(unittest.TestCase):
+    """Tests for the dashboard display shared by all the layers."""
+
+    def setUp(self):
+        matplotlib.pyplot.close("all")
+        self.net = SmallNet()
+        self.monitoring = laymon.FeatureMapMonitoring()
+        self.monitoring.observer_factory.display_object = laymon.FeatureMapDashboard
+        self.monitoring.add_model(self.net)
+        self.dashboard = self.monitoring.observer_factory._shared_display
+
+    def tearDown(self):
+        self.monitoring.close()
+
+    def _count_draws(self):
+        draws = []
+        canvas = self.dashboard._figure.canvas
+        canvas.draw = lambda: draws.append("draw")
+        canvas.blit = lambda bbox=None: draws.append("blit")
+        return draws
+
+    def test_single_figure_single_redraw(self):
+        self.net(torch.randn(4, 3, 8, 8))
+        self.monitoring.start()
+        self.assertEqual(sorted(self.dashboard._panels), ["conv1", "conv2", "relu"])
+        self.assertEqual(len(matplotlib.pyplot.get_fignums()), 1)
+
+        draws = self._count_draws()
+        self.net(torch.randn(4, 3, 8, 8))
+        self.monitoring.start()
+        self.assertEqual(draws, ["blit"])
+
+    def test_incremental_layout(self):
+        self.net(torch.randn(1, 3, 8, 8))
+        self.monitoring.start()
+        conv1_subplot = self.dashboard._panels["conv1"][0]
+
+        self.monitoring.remove_layer("relu")
+        self.assertEqual(sorted(self.dashboard._panels), ["conv1", "conv2"])
+        self.assertNotIn(self.dashboard._panels.get("relu"), self.dashboard._figure.axes)
+
+        extra = nn.Conv2d(3, 2, 1)
+        self.monitoring.add_layer(extra, "extra")
+        extra(torch.randn(1, 3, 4, 4))
+        draws = self._count_draws()
+        self.monitoring.start()
+
+        self.assertEqual(draws, ["draw"])
+        self.assertIs(self.dashboard._panels["conv1"][0], conv1_subplot)
+        self.assertEqual(len(self.dashboard._figure.axes), 3)
+
+
+class TestEncoding(unittest.TestCase):
+    """Tests for the PNG encoding of the feature maps."""
+
+    def test_encode_png(self):
+        image = numpy.arange(12, dtype=numpy.float32).reshape(3, 4)
+        image[0, 0] = numpy.nan
+        lut = encoding.colormap_lut("gray")
+        pixels = encoding.apply_colormap(image, lut)
+        self.assertEqual(pixels.shape, (3, 4, 3))
+
+        for data in (pixels, pixels[..., 0]):
+            frame = encoding.encode_png(data)
+            self.assertTrue(frame.startswith(encoding.PNG_SIGNATURE))
+            decoded = matplotlib.image.imread(io.BytesIO(frame), format="png")
+            numpy.testing.assert_array_equal((decoded * 255).round().astype(numpy.uint8), data)
+
+
+class TestFeatureMapWebDisplay(unittest.TestCase):
+    """Tests for the web viewer, through a local HTTP client."""
+
+    def setUp(self):
+        self.net = SmallNet()
+        self.monitoring = laymon.FeatureMapMonitoring()
+        self.monitoring.observer_factory.display_object = FeatureMapWebDisplay
+        self.monitoring.observer_factory.display_options = {"port": 0, "poll_timeout": 5.0}
+        self.monitoring.add_model(self.net)
+        self.viewer = self.monitoring.observer_factory._shared_display
+
+    def tearDown(self):
+        self.monitoring.close()
+
+    def _get(self, path):
+        with urllib.request.urlopen(self.viewer.url + path, timeout=10) as response:
+            return response.headers["Content-Type"], response.read()
+
+    def _updates(self, since):
+        return json.loads(self._get(f"updates?since={since}")[1])
+
+    def _wait_for(self, layer_names, since=0):
+        update = {"version": since, "layers": {}}
+        changed = dict()
+        while not set(layer_names) <= set(changed):
+            update = self._updates(update["version"])
+            changed.update(update["layers"])
+        return update["version"], changed
+
+    def test_streams_frames(self):
+        content_type, page = self._get("")
+        self.assertEqual(content_type, "text/html")
+        self.assertIn(b"/updates", page)
+
+        self.net(torch.randn(2, 3, 8, 8))
+        self.monitoring.start()
+        version, changed = self._wait_for(["conv1", "conv2", "relu"])
+
+        content_type, frame = self._get(self.viewer.frame_path("conv1"))
+        self.assertEqual(content_type, "image/png")
+        decoded = matplotlib.image.imread(io.BytesIO(frame), format="png")
+        # 4 channels of 6x6 tiled into a 2x2 mosaic with a padding of 1.
+        self.assertEqual(decoded.shape, (13, 13, 3))
+
+        # Only the frames updated since the last poll are reported.
+        self.monitoring.remove_layer("conv2")
+        self.viewer.update_display(torch.randn(2, 4, 6, 6), "conv1")
+        _, changed = self._wait_for(["conv1"], since=version)
+        self.assertNotIn("relu", changed)
+        self.assertNotIn("conv2", self._updates(0)["names"])
+
+    def test_update_does_not_block(self):
+        release = threading.Event()
+        encode_png = encoding.encode_png
+
+        def slow_encode(pixels):
+            release.wait(10)
+            return encode_png(pixels)
+
+        with unittest.mock.patch("laymon.web.encode_png", slow_encode):
+            start = time.perf_counter()
+            for _ in range(5):
+                self.viewer.update_display(torch.randn(1, 4, 8, 8), "layer")
+            self.assertLess(time.perf_counter() - start, 1.0)
+            release.set()
+            _, changed = self._wait_for(["layer"])
+        # The queued updates were coalesced into the newest one.
+        self.assertLessEqual(self.viewer.get_frame("layer")[0], 2)
+
+
+def _run_distributed_monitoring(rank, world_size, init_file, output_dir, capture_ranks):
+    """Trains a SmallNet on a rank of a gloo process group and saves what the rank rendered."""
+    torch.distributed.init_process_group(
+        "gloo", init_method=f"file://{init_file}", rank=rank, world_size=world_size
+    )
+    torch.manual_seed(0)
+    net = SmallNet()
+    monitoring = laymon.FeatureMapMonitoring(
+        distributed=True,
+        capture_ranks=capture_ranks,
+        capture_transform=CaptureTransform(sample=0),
+    )
+    monitoring.observer_factory.display_object = RecordingDisplay
+    monitoring.add_model(net)
+    for step in range(3):
+        net(torch.full((1, 3, 8, 8), float(rank)))
+        monitoring.start()
+    monitoring.flush()
+    displays = monitoring.observer_factory._displays
+    rendered = {name: display.updates[-1][1] for name, display in displays.items()}
+    monitoring.close()
+    torch.save(rendered, f"{output_dir}/rank{rank}.pt")
+    torch.distributed.destroy_process_group()
+
+
+@unittest.skipUnless(torch.distributed.is_gloo_available(), "requires the gloo backend")
+class TestDistributedMonitoring(unittest.TestCase):
+    """Tests for the distributed mode, over local CPU processes."""
+
+    def _spawn(self, world_size, capture_ranks=None):
+        with tempfile.TemporaryDirectory() as directory:
+            torch.multiprocessing.spawn(
+                _run_distributed_monitoring,
+                args=(world_size, f"{directory}/init", directory, capture_ranks),
+                nprocs=world_size,
+            )
+            return [torch.load(f"{directory}/rank{rank}.pt") for rank in range(world_size)]
+
+    def test_gathered_to_rank_zero(self):
+        rendered = self._spawn(world_size=3, capture_ranks=[0, 2])
+        # Only rank 0 renders, the captures of the capture ranks are concatenated along the batch.
+        self.assertEqual(rendered[1], {})
+        self.assertEqual(rendered[2], {})
+        self.assertEqual(sorted(rendered[0]), ["conv1", "conv2", "relu"])
+        torch.manual_seed(0)
+        conv1 = SmallNet().conv1
+        with torch.no_grad():
+            expected = torch.cat([conv1(torch.full((1, 3, 8, 8), float(rank))) for rank in (0, 2)])
+        torch.testing.assert_close(rendered[0]["conv1"], expected)
+
+
+class TestDistributedGatherer(unittest.TestCase):
+    """Tests for the merge and the queue of the captures sent to the destination rank."""
+
+    def test_statistics_are_combined(self):
+        values = torch.randn(5, 3, 4, 4) * torch.tensor([1.0, 5.0, 0.1]).view(1, 3, 1, 1)
+        values[values.abs() < 0.2] = 0
+        ranks = [ChannelStatistics(), ChannelStatistics()]
+        captures = [ranks[0](values[:1]), ranks[1](values[1:])]
+        counts = [statistics.size for statistics in ranks]
+
+        merged = distributed.merge_captures(captures, distributed.MERGE_STATISTICS, counts=counts)
+        torch.testing.assert_close(merged, ChannelStatistics()(values), rtol=1e-4, atol=1e-5)
+
+    @unittest.skipUnless(torch.distributed.is_gloo_available(), "requires the gloo backend")
+    def test_outgoing_captures_are_bounded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            torch.distributed.init_process_group(
+                "gloo", init_method=f"file://{directory}/init", rank=0, world_size=1
+            )
+            try:
+                gatherer = distributed.DistributedGatherer(max_outgoing=2)
+                blocked = threading.Event()
+                with unittest.mock.patch.object(gatherer, "_gather", lambda _: blocked.wait()):
+                    for step in range(5):
+                        snapshot = {"conv": (distributed.MERGE_CAT, torch.full((1,), step), None)}
+                        gatherer.submit(snapshot)
+                        if step == 0:
+                            # The first snapshot is being sent, the others wait behind it.
+                            with gatherer._condition:
+                                gatherer._condition.wait_for(lambda: gatherer._busy, timeout=10)
+                    self.assertFalse(gatherer.flush(timeout=0))
+                    with gatherer._condition:
+                        queued = list(gatherer._outgoing)
+                    blocked.set()
+                    self.assertTrue(gatherer.flush(timeout=10))
+                gatherer.close()
+            finally:
+                torch.distributed.destroy_process_group()
+
+        # Every snapshot is still sent, the oldest waiting ones without their captures.
+        self.assertEqual(gatherer.sent, 5)
+        self.assertEqual(gatherer.dropped_outgoing, 2)
+        self.assertEqual([len(snapshot) for snapshot in queued], [0, 0, 1, 1])
+
+
+class TestCaptureSlot(unittest.TestCase):
+    """Tests for the capture slots shared by the forward passes and the notifications."""
+
+    def test_publish_keeps_latest(self):
+        slot = CaptureSlot()
+        self.assertIsNone(slot.latest())
+        self.assertEqual(slot.publish(torch.zeros(1), step=2).generation, 1)
+        self.assertIsNone(slot.publish(torch.ones(1), step=1))
+        capture = slot.latest()
+        self.assertEqual((capture.step, capture.generation), (2, 1))
+        self.assertEqual(capture.parameters.item(), 0)
+
+    def test_concurrent_forwards_and_notifications(self):
+        layer = nn.Conv2d(1, 2, 1, bias=False)
+        nn.init.ones_(layer.weight)
+        display = RecordingDisplay()
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory.display_object = lambda: display
+        monitoring.add_layer(layer, "conv")
+        threads, forwards, errors = (4, 200, [])
+        done = threading.Event()
+
+        def forward(thread_id):
+            try:
+                for step in range(forwards):
+                    layer(torch.full((2, 1, 16, 16), float(thread_id * forwards + step)))
+            except Exception as error:
+                errors.append(error)
+
+        def notify():
+            while not done.is_set():
+                monitoring.start()
+
+        notifier = threading.Thread(target=notify)
+        notifier.start()
+        workers = [threading.Thread(target=forward, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        done.set()
+        notifier.join()
+        monitoring.start()
+
+        self.assertEqual(errors, [])
+        observer = monitoring.monitor.get_registered_observers()["conv"]
+        self.assertEqual(observer.captured, threads * forwards)
+        # Captures finishing after a more recent one are not published.
+        self.assertLessEqual(observer.slot.generation, threads * forwards)
+        self.assertEqual(observer.step, threads * forwards)
+        self.assertGreater(len(display.updates), 1)
+        # Every notified capture is complete, i.e. the output of a single forward pass.
+        for _, parameters in display.updates:
+            self.assertTrue(bool((parameters == parameters.flatten()[0]).all()))
+
+
+class TestProfiling(unittest.TestCase):
+    """Tests for the profiling of the monitoring overhead."""
+
+    def setUp(self):
+        matplotlib.pyplot.close("all")
+        self.net = SmallNet()
+
+    def _monitoring(self, profiler):
+        monitoring = laymon.FeatureMapMonitoring(
+            capture_transform=CaptureTransform(sample=0), profiler=profiler
+        )
+        monitoring.observer_factory.display_object = laymon.FeatureMapGridDisplay
+        monitoring.add_layer(self.net.conv1, "conv1")
+        monitoring.add_layer(self.net.conv2, "conv2", sampling_policy=EveryNCalls(2))
+        self.addCleanup(monitoring.close)
+        return monitoring
+
+    def test_latency_histogram(self):
+        histogram = profiling.LatencyHistogram()
+        for seconds in [1e-5] * 90 + [1e-2] * 10:
+            histogram.record(seconds)
+        summary = histogram.summary()
+        self.assertEqual(summary["count"], 100)
+        self.assertAlmostEqual(summary["mean"], (90 * 1e-5 + 10 * 1e-2) / 100)
+        self.assertLess(summary["p50"], 2e-5)
+        self.assertGreaterEqual(summary["p99"], 1e-2)
+        self.assertEqual(summary["max"], 1e-2)
+
+    def test_stats(self):
+        monitoring = self._monitoring(profiling.Profiler(log_interval=0))
+        with self.assertLogs("laymon.profiling", level="INFO") as logs:
+            for _ in range(4):
+                self.net(torch.randn(2, 3, 8, 8))
+                monitoring.start()
+        self.assertIn("hook 8 calls", logs.output[-1])
+
+        stats = monitoring.stats()
+        conv1, conv2 = (stats["layers"]["conv1"], stats["layers"]["conv2"])
+        self.assertEqual((conv2["captured"], conv2["skipped"]), (2, 2))
+        self.assertEqual(conv1["retained_bytes"], 4 * 6 * 6 * 4)
+        self.assertEqual(conv1["latency"]["hook"]["count"], 4)
+        self.assertEqual(conv2["latency"]["hook"]["count"], 4)
+        self.assertEqual(conv2["latency"]["transform"]["count"], 2)
+        self.assertEqual(conv1["latency"]["update"]["count"], 4)
+        self.assertEqual(conv1["latency"]["display_params"]["count"], 4)
+        self.assertEqual(conv1["latency"]["draw"]["count"], 4)
+        self.assertEqual(stats["latency"]["notify"]["count"], 4)
+
+    def test_record_function_ranges(self):
+        self._monitoring(profiling.Profiler(record_functions=True))
+        with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as trace:
+            self.net(torch.randn(2, 3, 8, 8))
+        names = set(event.name for event in trace.events())
+        self.assertIn("laymon.hook.conv1", names)
+        self.assertIn("laymon.transform.conv1", names)
+
+    def test_disabled(self):
+        monitoring = self._monitoring(None)
+        self.net(torch.randn(2, 3, 8, 8))
+        monitoring.start()
+        stats = monitoring.stats()
+        self.assertEqual(stats["latency"], {})
+        self.assertEqual(stats["layers"]["conv1"]["latency"], {})
+        self.assertEqual(stats["layers"]["conv1"]["captured"], 1)
+        self.assertIsNone(monitoring.observer_factory._displays["conv1"].profiler)
+
+
+class TestCaptureWindows(unittest.TestCase):
+    """Tests for the capture windows hooking the layers only for the selected steps."""
+
+    def setUp(self):
+        self.net = SmallNet()
+        self.display = RecordingDisplay()
+        self.monitoring = laymon.FeatureMapMonitoring(attach_hooks=False)
+        self.monitoring.observer_factory.display_object = lambda: self.display
+        self.monitoring.add_model(self.net)
+
+    def _hooks(self):
+        return sum(len(layer._forward_hooks) for layer in self.net.children())
+
+    def test_hooks_only_within_window(self):
+        self.assertEqual(self._hooks(), 0)
+        self.net(torch.randn(1, 3, 8, 8))
+        self.assertEqual(self.monitoring.stats()["layers"]["conv1"]["captured"], 0)
+
+        with self.monitoring.capture(step=10):
+            self.assertEqual(self._hooks(), 3)
+            self.net(torch.randn(1, 3, 8, 8))
+        self.assertEqual(self._hooks(), 0)
+        self.assertEqual(self.monitoring.monitor.get_registered_observers()["conv1"].step, 10)
+        # The captures are rendered when the window is closed.
+        titles = sorted(title for title, _ in self.display.updates)
+        self.assertEqual(titles, ["conv1", "conv2", "relu"])
+
+    def test_attached_hooks_stay_attached(self):
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory.display_object = RecordingDisplay
+        monitoring.add_layer(self.net.conv1, "conv1")
+        with monitoring.capture(step=3, render=False):
+            self.net(torch.randn(1, 3, 8, 8))
+        self.assertEqual(len(self.net.conv1._forward_hooks), 1)
+        self.assertEqual(monitoring.monitor.get_registered_observers()["conv1"].step, 3)
+
+    def test_captures_after_explicit_step(self):
+        layer = nn.Conv2d(3, 4, 3)
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory.display_object = RecordingDisplay
+        monitoring.add_layer(layer, "conv")
+        observer = monitoring.monitor.get_registered_observers()["conv"]
+        display = observer.object._update_display.__self__
+        layer(torch.randn(1, 3, 8, 8))
+        with monitoring.capture(step=1000):
+            layer(torch.randn(1, 3, 8, 8))
+
+        # The hooks stay attached, the following passes are captured after the window's step.
+        inputs = torch.randn(1, 3, 8, 8)
+        layer(inputs)
+        self.assertEqual(observer.step, 1001)
+        monitoring.start()
+        expected = nn.functional.conv2d(inputs, layer.weight, layer.bias)
+        torch.testing.assert_close(display.updates[-1][1], expected)
+        layer(inputs)
+        self.assertEqual(observer.step, 1002)
+
+    def test_capture_every(self):
+        @self.monitoring.capture_every(3)
+        def train_step(inputs):
+            self.assertEqual(self._hooks(), 3 if train_step.calls % 3 == 0 else 0)
+            train_step.calls += 1
+            return self.net(inputs)
+
+        train_step.calls = 0
+        for _ in range(7):
+            train_step(torch.randn(1, 3, 8, 8))
+        self.assertEqual(self._hooks(), 0)
+        self.assertEqual(self.monitoring.stats()["layers"]["conv1"]["captured"], 3)
+        self.assertEqual(self.monitoring.monitor.get_registered_observers()["conv1"].step, 6)
+
+    def test_gradients_within_window(self):
+        net = nn.Sequential(nn.Conv2d(1, 2, 3), nn.Conv2d(2, 2, 3))
+        monitoring = laymon.FeatureMapMonitoring(attach_hooks=False, monitor_gradients=True)
+        monitoring.observer_factory.display_object = RecordingDisplay
+        monitoring.add_model(net)
+        with monitoring.capture(step=5, render=False):
+            net(torch.randn(1, 1, 8, 8)).sum().backward()
+        net(torch.randn(1, 1, 8, 8)).sum().backward()
+        step, _, _ = monitoring.gradient_monitor.get_paired_captures("1.grad")
+        self.assertEqual(step, 5)
+        self.assertEqual(len(net[1]._backward_hooks), 0)
+
+
+class TestGraphCapture(unittest.TestCase):
+    """Tests for the capture of compiled models through a rewritten fx graph."""
+
+    def setUp(self):
+        torch._dynamo.reset()
+        self.net = SmallNet()
+        self.monitoring = laymon.FeatureMapMonitoring()
+        self.monitoring.observer_factory.display_object = RecordingDisplay
+        self.inputs = torch.randn(2, 3, 8, 8)
+
+    def test_extra_outputs(self):
+        model = self.monitoring.add_graph_model(
+            self.net, exclude="relu", reductions={"conv2": lambda capture: capture[:1]}
+        )
+        self.assertEqual(model.layer_names, ["conv1", "conv2"])
+        self.assertEqual(len(self.net.conv1._forward_hooks), 0)
+
+        with torch.no_grad():
+            torch.testing.assert_close(model(self.inputs), self.net(self.inputs))
+            observers = self.monitoring.monitor.get_registered_observers()
+            # The output of conv1 is copied before the in-place ReLU overwrites it.
+            torch.testing.assert_close(observers["conv1"].parameters, self.net.conv1(self.inputs))
+        self.assertEqual(tuple(observers["conv2"].parameters.shape), (1, 6, 4, 4))
+        self.assertEqual(self.monitoring.stats()["layers"]["conv1"]["captured"], 1)
+
+    def test_compiled_without_graph_breaks(self):
+        model = self.monitoring.add_graph_model(self.net)
+        explanation = torch._dynamo.explain(model.graph_module)(self.inputs)
+        self.assertEqual(explanation.graph_break_count, 0)
+        self.assertEqual(explanation.graph_count, 1)
+
+        torch._dynamo.reset()
+        model = laymon.FeatureMapMonitoring().add_graph_model(
+            self.net, compile_options={"backend": "aot_eager"}
+        )
+        compiled = torch.compile(copy.deepcopy(self.net), backend="aot_eager")
+
+        def step_time(function):
+            with torch.no_grad():
+                for _ in range(3):
+                    function(self.inputs)
+                timings = []
+                for _ in range(30):
+                    start = time.perf_counter()
+                    function(self.inputs)
+                    timings.append(time.perf_counter() - start)
+            return sorted(timings)[len(timings) // 2]
+
+        with torch.no_grad():
+            torch.testing.assert_close(model(self.inputs), compiled(self.inputs))
+        self.assertLess(step_time(model), 2 * step_time(compiled) + 1e-3)
+
+
+class TestDriftGate(unittest.TestCase):
+    """Tests for the drift detection of the captures."""
+
+    def test_distances(self):
+        activation = torch.randn(2, 4, 16, 16)
+        for metric in (drift.RELATIVE_L2, drift.COSINE):
+            gate = drift.DriftGate(threshold=0.05, metric=metric, reference_size=4)
+            self.assertTrue(gate.drifted(activation))
+            self.assertEqual(tuple(gate.reference.shape), (4 * 4 * 4,))
+            self.assertFalse(gate.drifted(activation + 1e-4 * torch.randn_like(activation)))
+            self.assertLess(gate.distance, 0.05)
+            self.assertTrue(gate.drifted(-activation))
+            torch.testing.assert_close(gate.reference, gate.sketch(-activation))
+        # Any shape change starts a new reference.
+        self.assertTrue(gate.drifted(torch.randn(2, 10)))
+        with self.assertRaises(ValueError):
+            drift.DriftGate(metric="l1")
+
+    def test_slow_drift_is_detected(self):
+        gate = drift.DriftGate(threshold=0.1)
+        activation = torch.ones(1, 2, 8, 8)
+        self.assertTrue(gate.drifted(activation))
+        drifted = [gate.drifted(activation * (1 + 0.03 * step)) for step in range(1, 5)]
+        # The reference is kept until the accumulated drift reaches the threshold.
+        self.assertEqual(drifted, [False, False, False, True])
+
+    def test_stable_layers_are_not_redrawn(self):
+        net = SmallNet()
+        monitoring = laymon.FeatureMapMonitoring(drift_gate=drift.DriftGate(threshold=0.05))
+        monitoring.observer_factory.display_object = RecordingDisplay
+        monitoring.add_layer(net.conv1, "conv1")
+        inputs = torch.randn(1, 3, 8, 8)
+        observer = monitoring.monitor.get_registered_observers()["conv1"].object
+        display = observer._update_display.__self__
+        for _ in range(5):
+            net(inputs)
+            monitoring.start()
+        self.assertEqual(len(display.updates), 1)
+        net(torch.randn(1, 3, 8, 8))
+        monitoring.start()
+        self.assertEqual(len(display.updates), 2)
+
+        conv1 = monitoring.stats()["layers"]["conv1"]
+        self.assertEqual((conv1["captured"], conv1["unchanged"]), (6, 4))
+        self.assertEqual(monitoring.monitor.get_registered_observers()["conv1"].slot.generation, 2)
+
+
+class TestObserverRegistry(unittest.TestCase):
+    """Tests for the dispatch of the notifications to the captured layers only."""
+
+    def test_only_captured_layers_are_dispatched(self):
+        net = SmallNet()
+        unused = nn.Conv2d(6, 6, 1)
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory.display_object = RecordingDisplay
+        monitoring.add_layer(net.conv1, "conv1")
+        monitoring.add_layer(unused, "unused")
+        monitoring.add_layer(net.conv2, "conv2")
+        observers = monitoring.monitor.get_registered_observers()
+        self.assertFalse(hasattr(observers["conv1"], "__dict__"))
+
+        net(torch.randn(1, 3, 8, 8))
+        with unittest.mock.patch.object(
+            laymon.FeatureMapMonitor, "_is_layer_single_dim"
+        ) as single_dim:
+            monitoring.start()
+            monitoring.start()
+        # The dimensionality is classified when the layers are captured, not on every notification.
+        single_dim.assert_not_called()
+        self.assertEqual([name for name, _ in monitoring.monitor._dispatch], ["conv1", "conv2"])
+        self.assertIsNone(observers["unused"].single_dim)
+        self.assertFalse(observers["conv2"].single_dim)
+
+        monitoring.monitor.remove_observer(layer_name="conv1")
+        monitoring.start()
+        self.assertEqual([name for name, _ in monitoring.monitor._dispatch], ["conv2"])
+
+    def test_unchanged_layers_are_not_redrawn(self):
+        net = SmallNet()
+        monitoring = laymon.FeatureMapMonitoring(skip_unchanged=True)
+        monitoring.observer_factory.display_object = RecordingDisplay
+        monitoring.add_layer(net.conv1, "conv1")
+        monitoring.add_layer(net.conv2, "conv2")
+        observers = monitoring.monitor.get_registered_observers()
+        displays = {
+            name: observer.object._update_display.__self__ for name, observer in observers.items()
+        }
+
+        net(torch.randn(1, 3, 8, 8))
+        self.assertEqual(monitoring.start(), 0)
+        self.assertEqual(monitoring.monitor._dirty, {})
+        self.assertEqual(monitoring.start(), 2)
+        # Only conv1 runs, e.g. on a conditional path.
+        net.conv1(torch.randn(1, 3, 8, 8))
+        self.assertEqual(list(monitoring.monitor._dirty), ["conv1"])
+        with unittest.mock.patch.object(
+            observers["conv2"].slot, "latest", wraps=observers["conv2"].slot.latest
+        ) as latest:
+            self.assertEqual(monitoring.start(), 1)
+        # The notification doesn't go through the layers which weren't captured.
+        latest.assert_not_called()
+        self.assertEqual(len(displays["conv1"].updates), 2)
+        self.assertEqual(len(displays["conv2"].updates), 1)
+        self.assertEqual(monitoring.monitor.skipped_redraws, 3)
+
+    def test_lagging_host_copies_are_redrawn(self):
+        layer = nn.Conv2d(3, 4, 3)
+        monitoring = laymon.FeatureMapMonitoring(host_transfer=True, skip_unchanged=True)
+        monitoring.observer_factory.display_object = RecordingDisplay
+        monitoring.add_layer(layer, "conv")
+        display = monitoring.monitor.get_registered_observers()["conv"].object
+        display = display._update_display.__self__
+        copies = [torch.zeros(1, 4, 6, 6), torch.ones(1, 4, 6, 6)]
+
+        layer(torch.randn(1, 3, 8, 8))
+        layer(torch.randn(1, 3, 8, 8))
+        transfer = monitoring.monitor._host_transfer
+        # The copy of the second capture hasn't completed yet, only the first one is handed over.
+        with unittest.mock.patch.object(
+            transfer, "completed", return_value=Capture(copies[0], 1, 1, None)
+        ):
+            self.assertEqual(monitoring.start(), 0)
+            self.assertEqual(monitoring.start(), 1)
+        with unittest.mock.patch.object(
+            transfer, "completed", return_value=Capture(copies[1], 2, 2, None)
+        ):
+            self.assertEqual(monitoring.start(), 0)
+        self.assertEqual(len(display.updates), 2)
+        self.assertIs(display.updates[-1][1], copies[1])
+
+
+class TestFeatureMapExporter(unittest.TestCase):
+    """Tests for the export of the feature maps from worker processes."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _export(self, steps, **options):
+        net = SmallNet()
+        monitoring = laymon.FeatureMapMonitoring()
+        monitoring.observer_factory.display_object = FeatureMapExporter
+        monitoring.observer_factory.display_options = dict(path=self.path, workers=1, **options)
+        monitoring.add_layer(net.conv1, "conv1")
+        monitoring.add_layer(net.conv2, "conv2")
+        exporter = monitoring.observer_factory._shared_display
+        for _ in range(steps):
+            net(torch.randn(2, 3, 8, 8))
+            monitoring.start()
+        return monitoring, exporter
+
+    def test_frames_are_written(self):
+        monitoring, exporter = self._export(steps=4, max_pending=1)
+        conv1 = monitoring.monitor.get_registered_observers()["conv1"].parameters.clone()
+        monitoring.close()
+
+        self.assertEqual(sorted(os.listdir(self.path)), ["conv1", "conv2"])
+        frames = sorted(os.listdir(os.path.join(self.path, "conv1")))
+        self.assertEqual(frames, [f"frame_{number:06d}.png" for number in range(4)])
+        frame = matplotlib.image.imread(os.path.join(self.path, "conv1", frames[-1]))
+        expected = feature_map_image(conv1)
+        self.assertEqual(frame.shape, tuple(expected.shape) + (3,))
+        # Every shared memory block has been released.
+        self.assertFalse(exporter._futures)
+        self.assertTrue(exporter._pending.acquire(blocking=False))
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg is not installed")
+    def test_video(self):
+        monitoring, _ = self._export(steps=3, video=True, fps=5)
+        monitoring.close()
+        self.assertTrue(os.path.getsize(os.path.join(self.path, "conv2.mp4")) > 0)